@@ -13,7 +13,7 @@
 
 uint8_t incoming = 0;
 uint8_t x_pulse_high_time = 100; // in ms
-uint8_t x_pulse_low_time = 300;
+uint8_t x_pulse_low_time = 300; // truncated to 44 (300 % 256) by the type, the host planner models 44
 uint8_t dir = 1; //the status of direction, used to record the pulse sent to motor
 volatile int encoder0Pos = 0; //reading of the encoder
 volatile int is_move = 1;
@@ -23,6 +23,23 @@ volatile long start_pos = 0;
 volatile long pulse = 0; //accumulative pulse sine booting
 volatile long target_dis = 0; //created by parsing the incoming command
 String output;
+volatile unsigned long sample_time = 0; //micros() at the last encoder edge
+
+//1 appends the micros() of the encoder edge to the ASCII frames: "RR<pulse>;<pos>;<micros>!"
+//the host maps it to its own clock, for sample times independent of the serial timing
+#define FRAME_MICROS 0
+
+//binary protocol, negotiated by the host with "P<version><baud>#", ASCII stays the default
+//frame: 0xA5 0x5A | seq u16 | count u8 | count x record | crc16 u16, little-endian
+//record version 1: status u8, pulse i32, dro i32; version 2 adds micros u32 of the encoder edge
+#define BINARY_VERSION 2 //highest version understood, the host asks for one
+#define BATCH_SIZE 8 //samples per frame, the host accepts up to 32
+#define MAX_RECORD_SIZE 13
+uint8_t protocol = 0; //0 ASCII, else the binary version
+uint8_t record_size = 9;
+uint8_t frame[5 + BATCH_SIZE * MAX_RECORD_SIZE + 2];
+uint8_t batch_count = 0;
+uint16_t frame_seq = 0;
 
  
 void setup() {
@@ -67,13 +84,16 @@ void loop()
     if (incoming == 35){ // '#' indicate end of command{
 
       switch (command[0]){
-        case 76:
+        case 76: // 'L' move
           move(command);
           break;
+        case 80: // 'P' protocol handshake
+          handshake(command);
+          break;
       }
       command_index = 0;
     }
-    else{
+    else if (command_index < 9){
       command[command_index] = incoming;
       command_index++;
     }
@@ -83,6 +103,7 @@ void loop()
 
 void doEncoder() 
 {
+  sample_time = micros();
   //by comparing two pins of dro, record the dro reading
   if (digitalRead(encoder_pin1) == digitalRead(encoder_pin2)) 
   {
@@ -148,6 +169,10 @@ void move(int commands[]){
 // print the encoder reading with the status
 // 1 for running, 0 for finishing
 void print_cor(int status){
+  if (protocol != 0){
+    add_record(status);
+    return;
+  }
   switch (status){
     case 1:
       output = "RR";
@@ -159,7 +184,85 @@ void print_cor(int status){
   output.concat(String(pulse));
   output.concat(";");
   output.concat(String(encoder0Pos));
+#if FRAME_MICROS
+  output.concat(";");
+  output.concat(String(sample_time));
+#endif
+  output.concat("!");
+  Serial.write(output.c_str());
+  output = "";
+}
+
+// "P1115200": switch to binary protocol version 1 at 115200 baud, "P2115200" version 2
+// the acknowledgement "RB<version>;<baud>!" is sent at the old baud rate
+void handshake(int commands[]){
+  long baud = 0;
+  for (int i = 2; i < 8; i++){
+    baud = baud * 10 + (commands[i] - 48);
+  }
+  int version = commands[1] - 48;
+  if (version < 1 || version > BINARY_VERSION || baud <= 0){
+    return; //unknown version, the host falls back to ASCII
+  }
+  output = "RB";
+  output.concat(String(version));
+  output.concat(";");
+  output.concat(String(baud));
   output.concat("!");
   Serial.write(output.c_str());
   output = "";
+  Serial.flush(); //wait until the acknowledgement is out before changing the baud rate
+  Serial.begin(baud);
+  protocol = version;
+  record_size = version == 2 ? 13 : 9;
+  batch_count = 0;
+}
+
+void put_long(uint8_t *p, long value){
+  for (int i = 0; i < 4; i++){
+    p[i] = (value >> (8 * i)) & 0xFF;
+  }
+}
+
+// append one sample to the current frame, send it when full or when the move finishes
+void add_record(int status){
+  long position = encoder0Pos;
+  uint8_t *p = frame + 5 + batch_count * record_size;
+  p[0] = status;
+  put_long(p + 1, pulse);
+  put_long(p + 5, position);
+  if (protocol == 2){
+    put_long(p + 9, sample_time);
+  }
+  batch_count++;
+  if (batch_count == BATCH_SIZE || status == 0){
+    send_frame();
+  }
+}
+
+// CRC-16/XMODEM, polynomial 0x1021, initial value 0
+uint16_t crc16(const uint8_t *data, int length){
+  uint16_t crc = 0;
+  for (int i = 0; i < length; i++){
+    crc ^= (uint16_t)data[i] << 8;
+    for (int b = 0; b < 8; b++){
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void send_frame(){
+  int length = 5 + batch_count * record_size;
+  frame[0] = 0xA5;
+  frame[1] = 0x5A;
+  frame[2] = frame_seq & 0xFF;
+  frame[3] = frame_seq >> 8;
+  frame[4] = batch_count;
+  uint16_t crc = crc16(frame + 2, length - 2);
+  frame[length] = crc & 0xFF;
+  frame[length + 1] = crc >> 8;
+  Serial.write(frame, length + 2);
+  frame_seq++;
+  batch_count = 0;
 }
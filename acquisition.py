@@ -0,0 +1,504 @@
+#############################################################################
+#Qt-free acquisition engine: serial links, move commands and recording
+#Used by main_ui.py and usable on its own, e.g. on a headless test bench:
+#
+#   python acquisition.py /dev/ttyACM0 moves.csv
+#   python acquisition.py /dev/pts/3 moves.json --out ./record --protocol binary
+#
+#   with Acquisition() as acquisition:
+#       controller = acquisition.add("/dev/ttyACM0")
+#       controller.connect(timeout=5)
+#       controller.move("+", "High", 10)
+#       controller.wait(timeout=60)
+#############################################################################
+
+import os
+import csv
+import sys
+import json
+import time
+import struct
+import argparse
+import threading
+import numpy as np
+import serial
+
+import queue as Queue
+from collections import deque
+from datetime import datetime
+
+from frame_parser import (FrameParser, BinaryFrameParser, STATUS_FINISH,
+        BINARY_VERSION, handshake_command, parse_handshake)
+from sample_store import SampleStore, to_records
+from sample_bus import SampleBus
+from session_recorder import SessionRecorder
+from frame_clock import FrameClock
+from io_engine import SerialEngine
+from diagnostics import Diagnostics
+from calibration import Calibration
+from move_index import MoveIndex
+from event_log import DEBUG, INFO, WARNING, ERROR
+
+DEFAULTS = {"timeout": 0.1, "record_capacity": 2000000, "record_path": "./record",
+            "baudrate": 9600, "protocol": "ascii", "binary_baudrate": 115200, "binary_version": BINARY_VERSION}
+
+SPEEDS = {"High": 0, "Middle": 50, "Low": 90}     # delay of the firmware move loop, in us
+
+CAPTURE_NAME = "serial.cap"                 # raw serial traffic, next to the segments when capture_serial is set
+CAPTURE_HEADER = struct.Struct("<dcI")      # s since the first connect, b"R" received / b"T" sent, length
+
+
+# "SSDDDD" part of a move command: speed as a name of SPEEDS or 0-99, distance in mm (0-99)
+def move_parameters(speed, distance):
+    speed = SPEEDS.get(speed, speed)
+    if not isinstance(speed, (int, np.integer)) or not 0 <= speed <= 99:
+        raise ValueError("invalid speed: %r" % (speed,))
+    try:
+        distance = float(distance)
+    except (TypeError, ValueError):
+        raise ValueError("invalid stroke: %r" % (distance,))
+    if distance<0 or distance>99:
+        raise ValueError("invalid stroke: out of range")
+    return "%02d%04d" % (speed, int(distance*100))   # Unit of DRO is 0.01 mm, while unit of use input is 1 mm
+
+
+def move_command(direction, speed, distance):     # direction: "+" / "-" or 1 / -1
+    if direction not in ("+", "-", 1, -1):
+        raise ValueError("invalid direction: %r" % (direction,))
+    sign = "-" if direction in ("-", -1) else "+"
+    return "L" + sign + move_parameters(speed, distance) + "#"
+
+
+#Serial link to one Arduino, served by the event loop of io_engine.SerialEngine
+class ComPortConnector: 
+
+    def __init__(self, portname, baudrate, UI, engine, protocol="ascii", binary_baudrate=115200,
+                 binary_version=BINARY_VERSION):    # Initialise with serial port details
+        self.portname, self.baudrate = portname, baudrate
+        self.protocol, self.binary_baudrate, self.binary_version = protocol, binary_baudrate, binary_version
+        self.txq = Queue.Queue()
+        self.running = False                # True while the port is open
+        self.opened = threading.Event()     # set while the port is open, for waiting on connect
+        self.parser = FrameParser()
+        self.clock = FrameClock(baudrate, UI.start_ns)   # sample times from the reads
+        self.ser = None
+        self.interface = UI
+        self.engine = engine
+        self.outstanding = deque()          # [command, move, sent time, first RR time] of moves waiting for RF
+        self.move = None                    # move the frames belong to, None: the last one of the controller
+        self.latency = deque(maxlen=1000)   # command to first RR frame, in s
+ 
+    def ser_out(self, s, move=None):        # Write outgoing data to serial port if open, move: number of a move command
+        self.txq.put((str(s), move))        # ..using a queue to hand it to the engine thread
+        self.engine.call(self.flush_tx)
+
+    def flush_tx(self):                     # Runs on the engine thread, coalesces everything queued into one write
+
+        if self.txq.empty() or not self.running:
+            return
+        commands = []
+        while not self.txq.empty():
+            commands.append(self.txq.get_nowait())
+        for command, move in commands:
+            if command.startswith("L"):
+                self.expect(command, move)
+        self.transmit("".join(command for command, _ in commands).encode())
+
+    def expect(self, command, move):        # Engine thread, a move command is sent: wait for its RF (also used by replay.py)
+        self.outstanding.append([command, move, time.monotonic(), None])
+
+    def transmit(self, data):               # Engine thread, write to the port
+        self.interface.capture_data(b"T", data)
+        try:
+            self.ser.write(data)
+        except (serial.SerialException, OSError):
+            pass                            # the reader notices the lost port and reconnects
+
+    def latency_stats(self):                # command to first RR frame, in ms
+        if not self.latency:
+            return None
+        latency = np.array(self.latency)*1000
+        return {"last": float(latency[-1]), "p50": float(np.percentile(latency, 50)), "max": float(latency.max()), "moves": len(latency)}
+         
+    # Parse incoming serial data and store the samples, read_ns: time.monotonic_ns() when s was read
+    def ser_in(self, s, read_ns=None):
+
+        diagnostics = self.interface.diagnostics
+        started = diagnostics.clock()
+        frames = self.parser.feed(s)
+        record_time = self.clock.stamp(frames, self.parser.tails, read_ns or time.monotonic_ns(), len(s))
+        diagnostics.add("parse", started, len(frames))
+        if len(frames) == 0:
+            return
+        self.store(to_records(self.interface.record_index[0], frames["status"], frames["pulse"], frames["dro"], record_time))
+
+    # Store parsed samples in arrival order, RF frames included; also fed from the
+    # shared-memory ring of acquisition_process.py. The firmware sends RF on every
+    # encoder edge while no move runs (overshoot, coasting, jitter during the start
+    # delay of the next move), so the frames are given to the moves here: the first
+    # RR after a command starts that move, the first RF after it finishes it, and
+    # any other RF still belongs to the move before. A move reaching its target on
+    # its first edge sends no RR and is only finished by a later one.
+    def store(self, records):
+
+        if self.move is None:
+            self.move = self.interface.record_index[0]
+        status = records["status"]
+        moving, finish = np.flatnonzero(status != STATUS_FINISH), np.flatnonzero(status == STATUS_FINISH)
+        pos = 0
+        while pos < len(records):
+            end, finished = len(records), None
+            if self.outstanding and self.outstanding[0][3] is None:    # waiting for the first RR of the oldest move
+                k = np.searchsorted(moving, pos)
+                if k < len(moving):
+                    end = int(moving[k])
+            elif self.outstanding:          # waiting for its RF
+                k = np.searchsorted(finish, pos)
+                if k < len(finish):
+                    end, finished = int(finish[k]) + 1, self.outstanding[0]
+            if finished is not None:
+                self.outstanding.popleft()
+            if end > pos:
+                self.store_move(records[pos:end], self.move, finished)
+            if finished is None and end < len(records):     # first RR of the oldest move
+                self.move = self.outstanding[0][1]
+                self.outstanding[0][3] = time.monotonic()
+                self.latency.append(self.outstanding[0][3] - self.outstanding[0][2])
+            pos = end
+
+    # Store, index and publish samples of one move, finished: its entry of outstanding if it ends with the finishing RF
+    def store_move(self, records, move_no, finished=None):
+
+        diagnostics = self.interface.diagnostics
+        record = self.interface.dro_pulse_record
+
+        # Finish replaces the sample right before it, which may already be stored
+        finish = np.flatnonzero(records["status"] == STATUS_FINISH)
+        keep = np.ones(len(records), dtype=bool)
+        keep[finish[finish > 0] - 1] = False
+        replace_last = bool(len(finish)) and finish[0] == 0   # first kept frame replaces the stored last sample
+        records = records[keep]             # a copy, the caller's buffer may be reused
+        records["move"] = move_no
+        started = diagnostics.clock()
+        replaced = None
+        if replace_last:
+            replaced = record.last()
+            record.replace_last(*records[0].tolist())
+            record.extend_records(records[1:])
+        else:
+            record.extend_records(records)
+        diagnostics.add("store", started, len(records))
+        self.interface.move_index.update(records, replace_last, record.total)
+        # calibration sees the stored rows: the replaced sample goes out, its replacement in
+        if replaced is not None and self.interface.directions.get(replaced[0]):
+            self.interface.calibration.remove(self.interface.directions[replaced[0]], replaced[2], replaced[3])
+        direction = self.interface.directions.get(move_no)
+        if direction:
+            self.interface.calibration.update(direction, records["pulse"], records["dro"])
+        self.interface.sample_bus.publish(records, replace_last, self.interface.name, record.total - len(records))   # plot, recorder, ...
+
+        if len(finish):
+            last = record.last()
+            self.interface.update_text(last[2], last[3])
+        if finished is not None:
+            command, move, sent, first = finished
+            self.interface.write("%s finished, first frame after %.1f ms" % (command, (first - sent)*1000))
+            self.interface.moves_finished(move)
+
+    def negotiate(self):                    # Switch to the binary protocol, stay on ASCII if not acknowledged
+
+        self.ser.write(handshake_command(self.binary_baudrate, self.binary_version).encode())
+        reply = b""
+        deadline = time.monotonic() + self.interface.timeout*10
+        while b"!" not in reply and time.monotonic() < deadline:
+            reply += self.ser.read(self.ser.in_waiting or 1)
+
+        if parse_handshake(reply) == (self.binary_version, self.binary_baudrate):
+            self.ser.baudrate = self.binary_baudrate
+            self.baudrate = self.binary_baudrate
+            self.parser = BinaryFrameParser(self.binary_version)
+            self.clock.set_baudrate(self.binary_baudrate)
+            self.interface.write("binary protocol v%d at %d baud" % (self.binary_version, self.binary_baudrate))
+        else:
+            self.interface.write("binary protocol not acknowledged, using ASCII", WARNING)
+
+    def write(self, text, level=INFO):
+        self.interface.write(text, level)
+
+    def open(self, report=True):            # Open the port, runs in the executor of the engine
+        try:
+            # Accepts COM names, device paths (e.g. the pty of virtual_device.py) and pySerial URLs
+            self.ser = serial.serial_for_url(self.portname, self.baudrate, timeout=self.interface.timeout)
+            
+            time.sleep(self.interface.timeout*1.2)
+            self.ser.flushInput()
+            if self.protocol == "binary":
+                self.negotiate()
+        except Exception:
+            if self.ser:
+                self.ser.close()
+            self.ser = None
+            if report:
+                self.interface.write("Can't open port", ERROR)
+            return False
+        self.running = True
+        self.opened.set()
+        self.interface.write("connect router")
+        self.interface.connection_changed(True)
+        return True
+
+    def poll(self, ready=True):             # Read and parse what is waiting, False once the port is gone
+        try:
+            waiting = self.ser.in_waiting
+            if waiting:
+                started = self.interface.diagnostics.clock()
+                data = self.ser.read(waiting)
+                read_ns = time.monotonic_ns()
+                self.interface.diagnostics.add("read", started, len(data))
+                self.interface.capture_data(b"R", data)
+                self.ser_in(data, read_ns)
+            return waiting > 0 or not ready     # readable without data means hang-up
+        except (serial.SerialException, OSError):
+            return False
+
+    def close(self):                        # Called by the engine when the port is lost or detached
+        if self.running:
+            self.interface.connection_changed(False)
+        self.running = False
+        self.opened.clear()
+        self.outstanding.clear()
+        self.move = None
+        while not self.txq.empty():         # moves are not replayed after a reconnect
+            self.txq.get_nowait()
+        if self.ser:
+            self.ser.close()
+            self.ser = None
+
+
+#One controller (Arduino) with its own port, sample store, move counter and
+#recorder. owner provides config, start_time, timeout, sample_bus, diagnostics
+#and engine: an Acquisition, or the WidgetGallery for the Station subclass.
+class Controller:
+
+    def __init__(self, name, portname, owner, log=print):
+        self.name = name
+        self.portname = portname
+        self.owner = owner
+        self.log = log
+        self.parameter = dict(DEFAULTS, **owner.config["parameter"])
+        self.start_time = owner.start_time
+        self.start_ns = owner.start_ns      # origin of the sample times
+        self.timeout = owner.timeout
+        self.sample_bus = owner.sample_bus  # shared by every controller, batches carry the name
+        self.diagnostics = owner.diagnostics
+        self.record_index = [0]             # move counter of this controller
+        self.record_time = {}
+        self.dro_pulse_record = SampleStore(self.parameter["record_capacity"])   # 21 B a sample, the recorder keeps the rest on disk
+        self.connector = None               # ComPortConnector while connected
+        self.recorder = None                # SessionRecorder, started with the first connection
+        self.last_text = (0, 0)             # last pulse and DRO reported by update_text
+        self.condition = threading.Condition()
+        self.finished = set()               # numbers of the moves answered with RF
+        self.on_finish = None               # callback(move) once a move has finished, engine thread (MoveProgram)
+        self.on_connection = None           # callback(connected) when the port opens or closes, engine thread
+        self.directions = {}                # move number -> +1 (L+) / -1 (L-)
+        self.calibration = Calibration()    # pulse to DRO fit, fed by the connector
+        self.move_index = MoveIndex()       # per-move summary, fed by the connector
+        self.capture = None                 # serial.cap file, see replay.py
+        self.capture_start = 0.0
+
+    @property
+    def connected(self):
+        return self.connector is not None and self.connector.running
+
+    def write(self, text, level=INFO):      # level of event_log; DEBUG (e.g. every command) is not passed to log
+        if level > DEBUG:
+            self.log("%s: %s" % (self.name, text))
+
+    def update_text(self, pulse, dro):
+        self.last_text = (pulse, dro)
+
+    def capture_data(self, kind, data):     # Engine thread, kind b"R" received / b"T" sent
+        if self.capture:
+            self.capture.write(CAPTURE_HEADER.pack(time.monotonic() - self.capture_start, kind, len(data)) + data)
+
+    def connection_changed(self, connected):    # Called by the connector once the port is open or gone
+        if self.on_connection:
+            self.on_connection(connected)
+
+    def moves_finished(self, move):         # Called by the connector once per move, on its finishing RF
+        with self.condition:
+            self.finished.add(move)
+            self.condition.notify_all()
+        if self.on_finish:
+            self.on_finish(move)
+
+    # Open the port on the engine; with a timeout, wait for it and return whether it opened
+    def connect(self, timeout=None):
+        if self.recorder is None and self.parameter["record_path"]:
+            self.recorder = SessionRecorder(os.path.join(self.parameter["record_path"], str(self.start_time), self.name),
+                                            self.sample_bus.subscribe("recorder " + self.name, source=self.name))
+            self.recorder.start()
+            if self.parameter.get("capture_serial"):
+                self.capture_start = time.monotonic()
+                if not self.parameter.get("acquisition_process"):   # else written by the child process
+                    self.capture = open(os.path.join(self.recorder.directory, CAPTURE_NAME), "ab")
+        if self.parameter.get("acquisition_process"):
+            from acquisition_process import ProcessConnector     # imports this module
+            self.connector = ProcessConnector(self.portname, self.parameter["baudrate"], self, self.owner.engine,
+                                              self.parameter["protocol"], self.parameter["binary_baudrate"],
+                                              self.parameter["binary_version"], self.parameter.get("process_ring", 1 << 20))
+        else:
+            self.connector = ComPortConnector(self.portname, self.parameter["baudrate"], self, self.owner.engine,
+                                              self.parameter["protocol"], self.parameter["binary_baudrate"],
+                                              self.parameter["binary_version"])
+        self.owner.engine.attach(self.connector)    # reports "connect router" or "Can't open port"
+        if timeout is not None:
+            return self.connector.opened.wait(timeout)
+
+    def disconnect(self):
+        if self.connector:
+            self.owner.engine.detach(self.connector)
+            self.connector = None
+            self.write("disconnect router")
+
+    def close(self):
+        self.disconnect()
+        if self.recorder:
+            self.recorder.stop()            # Flush the samples still queued
+            self.recorder = None
+        if self.capture:
+            self.capture.close()
+            self.capture = None
+
+    def register_move(self, direction, command=None):   # Start a new move number, direction +1 / -1; also used by replay.py
+        self.record_index[0] += 1
+        self.record_time[self.record_index[0]] = datetime.now().strftime("%d%m%Y_%H%M%S")
+        self.directions[self.record_index[0]] = direction
+        self.move_index.begin(self.record_index[0], direction, command, self.dro_pulse_record.last())
+        if self.recorder:
+            self.recorder.mark_move(self.record_index[0], self.record_time[self.record_index[0]])
+        return self.record_index[0]
+
+    def send(self, command):                # Send a move command, returns the number of the move
+        move = self.register_move(-1 if command[1:2] == "-" else 1, command)
+        self.write("send %s, move %d" % (command, move), DEBUG)
+        self.connector.ser_out(command, move)
+        return move
+
+    def move(self, direction, speed, distance):
+        return self.send(move_command(direction, speed, distance))
+
+    # Wait until a move (default: the last one sent) has finished, False on timeout
+    def wait(self, move=None, timeout=None):
+        move = self.record_index[0] if move is None else move
+        with self.condition:
+            return self.condition.wait_for(lambda: move == 0 or move in self.finished, timeout)
+
+
+#Owns the bus, diagnostics and the I/O engine shared by the controllers
+class Acquisition:
+
+    def __init__(self, parameter=None, log=print):
+        self.config = {"parameter": dict(DEFAULTS, **(parameter or {}))}
+        self.log = log
+        self.start_time = int(time.time() * 1000)
+        self.start_ns = time.monotonic_ns()
+        self.timeout = self.config["parameter"]["timeout"]
+        self.sample_bus = SampleBus()
+        self.diagnostics = Diagnostics()
+        self.engine = SerialEngine()
+        self.engine.start()
+        self.stations = []
+        self.station_by_name = {}
+
+    def add(self, portname, name=None):
+        controller = Controller(name or "S%d" % (len(self.stations) + 1), portname, self, self.log)
+        self.stations.append(controller)
+        self.station_by_name[controller.name] = controller
+        return controller
+
+    def close(self):
+        self.engine.stop()                  # Cancel every link, wait until the ports are closed
+        for controller in self.stations:
+            controller.connector = None
+            controller.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Move program from CSV (header direction,speed,distance[,dwell]) or JSON (list of objects);
+# dwell is the pause after the move, in s
+def load_moves(path):
+    with open(path, newline="") as move_file:
+        if path.lower().endswith(".json"):
+            rows = json.load(move_file)
+        else:
+            rows = list(csv.DictReader(move_file))
+    moves = []
+    for number, row in enumerate(rows, 1):
+        speed = row.get("speed", "High")
+        speed = int(speed) if str(speed).isdigit() else speed
+        direction = row.get("direction", "+")
+        direction = int(direction) if str(direction).lstrip("+-").isdigit() else direction
+        try:
+            move_command(direction, speed, row["distance"])
+            moves.append({"direction": direction, "speed": speed, "distance": float(row["distance"]),
+                          "dwell": float(row.get("dwell") or 0)})
+        except (KeyError, ValueError) as error:
+            raise ValueError("move %d: %s" % (number, error))
+    return moves
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Run a move program without the UI and record the samples")
+    parser.add_argument("port", help="serial port, device path or pySerial URL")
+    parser.add_argument("program", help="moves as CSV or JSON: direction, speed, distance, dwell")
+    parser.add_argument("--config", default="./config/config.json", help="parameters are read from here if it exists")
+    parser.add_argument("--out", default=None, help="record directory, overrides record_path")
+    parser.add_argument("--baud", type=int, default=None)
+    parser.add_argument("--protocol", choices=("ascii", "binary"), default=None)
+    parser.add_argument("--move-timeout", type=float, default=600, help="give up waiting for a move, in s")
+    parser.add_argument("--results", default=None, help="write the per-move results to this CSV")
+    args = parser.parse_args()
+
+    parameter = {}
+    if os.path.exists(args.config):
+        with open(args.config, "r") as json_file:
+            parameter = json.load(json_file)["parameter"]
+    for key, value in (("record_path", args.out), ("baudrate", args.baud), ("protocol", args.protocol)):
+        if value is not None:
+            parameter[key] = value
+
+    moves = load_moves(args.program)
+    with Acquisition(parameter) as acquisition:
+        controller = acquisition.add(args.port)
+        if not controller.connect(timeout=30):
+            sys.exit(1)
+        from move_program import MoveProgram
+        program = MoveProgram(controller, moves)
+        begin = time.monotonic()
+        program.start()
+        finished, last_change = 0, begin
+        while not program.wait(1):
+            if program.progress[0] != finished:
+                finished, last_change = program.progress[0], time.monotonic()
+            elif time.monotonic() - last_change > args.move_timeout:
+                controller.write("move %d did not finish" % (finished + 1), ERROR)
+                sys.exit(1)
+        elapsed = time.monotonic() - begin
+        if args.results and program.results:
+            with open(args.results, "w", newline="") as results_file:
+                writer = csv.DictWriter(results_file, fieldnames=list(program.results[0]))
+                writer.writeheader()
+                writer.writerows(program.results)
+        samples = len(controller.dro_pulse_record)
+        print(json.dumps({"moves": len(moves), "samples": samples, "seconds": round(elapsed, 3),
+                          "samples_per_second": round(samples / elapsed, 1), "last": controller.last_text,
+                          "calibration": controller.calibration.estimates(),
+                          "record": controller.recorder.directory if controller.recorder else None}))
@@ -0,0 +1,227 @@
+#############################################################################
+#Serial acquisition in a child process
+#With "acquisition_process" set in the config, the port of a controller is
+#read and parsed by its own process, so GUI frames and the GIL of the main
+#process can't delay the reads. The child writes the samples to a SampleRing
+#(shm_ring.py) in shared memory; in the main process a ProcessConnector takes
+#the place of the ComPortConnector on the SerialEngine and stores them.
+#
+#   control pipe  main -> child  ("send", bytes, move number) / ("stop",)
+#   event pipe    child -> main  ("write", text, level) / ("opened", baudrate) /
+#                                ("failed",) / ("lost",) / ("data",)
+#
+#The child serves one connection: it exits when the port is lost, on "stop"
+#or when the main process goes away. The engine reconnects as for a port,
+#with a new child.
+#############################################################################
+
+import os
+import time
+import serial
+import numpy as np
+import multiprocessing
+from multiprocessing.connection import wait
+
+from acquisition import ComPortConnector, CAPTURE_NAME, CAPTURE_HEADER
+from frame_parser import BINARY_VERSION
+from sample_store import to_records
+from shm_ring import SampleRing, FRAMES, MALFORMED, LOST, NOTIFY, CLOCK_OFFSET, CLOCK_DRIFT
+from event_log import INFO, WARNING, ERROR
+
+POLL_INTERVAL = 0.002                       # ports without a descriptor, as SerialEngine
+STARTUP_TIMEOUT = 30                        # s for the child to start and open the port
+STOP_TIMEOUT = 2                            # s for the child to exit before it is terminated
+
+
+#What ComPortConnector.open() and negotiate() use of the controller, in the child
+class ChildInterface:
+
+    def __init__(self, timeout, start_ns, events):
+        self.timeout = timeout
+        self.start_ns = start_ns
+        self.events = events
+
+    def write(self, text, level=INFO):
+        self.events.send(("write", text, level))
+
+    def connection_changed(self, connected):    # reported by the ProcessConnector of the main process
+        pass
+
+
+# Child process: open the port, then read, parse and publish until stopped or lost.
+# capture: serial.cap path or None, capture_start: time.monotonic() of the controller
+def reader_main(portname, baudrate, protocol, binary_baudrate, binary_version, timeout, start_ns, capture, capture_start,
+                ring_name, control, events):
+    ring = SampleRing(ring_name)
+    link = ComPortConnector(portname, baudrate, ChildInterface(timeout, start_ns, events), None,
+                            protocol, binary_baudrate, binary_version)
+    capture = open(capture, "ab") if capture else None
+    try:
+        if not link.open(report=False):
+            events.send(("failed",))
+            return
+        events.send(("opened", link.baudrate))
+        if not read_loop(link, ring, control, events, capture, capture_start):
+            events.send(("lost",))
+    except (EOFError, OSError):             # the main process is gone
+        pass
+    finally:
+        link.close()
+        if capture:
+            capture.close()
+        ring.close()
+
+
+def read_loop(link, ring, control, events, capture, capture_start):   # False once the port is gone
+    ser, parser, clock, move = link.ser, link.parser, link.clock, 0
+    fileno = ser.fileno() if os.name == "posix" and hasattr(ser, "fileno") else None
+    waitables = [control] if fileno is None else [control, fileno]
+    while True:
+        ready = wait(waitables, POLL_INTERVAL if fileno is None else None)
+        while control.poll():
+            message = control.recv()
+            if message[0] == "stop":
+                return True
+            data, move = message[1], message[2]     # frames from now on belong to the new move
+            if capture:
+                capture.write(CAPTURE_HEADER.pack(time.monotonic() - capture_start, b"T", len(data)) + data)
+            try:
+                ser.write(data)
+            except (serial.SerialException, OSError):
+                return False
+        try:
+            waiting = ser.in_waiting
+            data = ser.read(waiting) if waiting else b""
+            read_ns = time.monotonic_ns()
+        except (serial.SerialException, OSError):
+            return False
+        if not data:
+            if fileno in ready:             # readable without data means hang-up
+                return False
+            continue
+        if capture:
+            capture.write(CAPTURE_HEADER.pack(time.monotonic() - capture_start, b"R", len(data)) + data)
+        frames = parser.feed(data)
+        record_time = clock.stamp(frames, parser.tails, read_ns, len(data))
+        ring.header[FRAMES], ring.header[MALFORMED] = parser.frames, parser.malformed
+        ring.header[LOST] = getattr(parser, "lost", 0)
+        if clock.device.offset is not None:
+            ring.header[CLOCK_OFFSET], ring.header[CLOCK_DRIFT] = clock.device.offset, round(clock.device.drift * 1e6)
+        if len(frames):
+            ring.write(to_records(move, frames["status"], frames["pulse"], frames["dro"], record_time))
+            if ring.header[NOTIFY]:         # the main process waits for data
+                ring.header[NOTIFY] = 0
+                events.send(("data",))
+
+
+#Link of the SerialEngine for a controller read by a child process: open()
+#starts the child, .ser is the event pipe (so the engine waits on it as on a
+#port), poll() stores what the child wrote to the ring and close() stops it.
+class ProcessConnector(ComPortConnector):
+
+    def __init__(self, portname, baudrate, UI, engine, protocol="ascii", binary_baudrate=115200,
+                 binary_version=BINARY_VERSION, capacity=1 << 20):
+        super().__init__(portname, baudrate, UI, engine, protocol, binary_baudrate, binary_version)
+        self.capacity = capacity            # samples in the ring
+        self.process = None
+        self.control = None
+        self.ring = None
+        self.cursor = 0                     # samples of the ring stored so far
+        self.overrun = 0                    # samples overwritten before they were stored
+
+    def open(self, report=True):            # Start the child, runs in the executor of the engine
+        context = multiprocessing.get_context("spawn")  # no fork of a process running Qt threads
+        capture = None
+        if self.interface.recorder and self.interface.parameter.get("capture_serial"):
+            capture = os.path.join(self.interface.recorder.directory, CAPTURE_NAME)
+        self.ring = SampleRing(capacity=self.capacity)
+        self.ring.header[NOTIFY] = 1        # notify the first data
+        self.cursor = 0
+        self.control, child_control = context.Pipe()
+        self.ser, child_events = context.Pipe(duplex=False)
+        self.process = context.Process(target=reader_main, name="acquisition %s" % self.portname, daemon=True,
+                                       args=(self.portname, self.baudrate, self.protocol, self.binary_baudrate,
+                                             self.binary_version, self.interface.timeout, self.interface.start_ns, capture,
+                                             self.interface.capture_start, self.ring.name, child_control, child_events))
+        self.process.start()
+        child_control.close()               # so that the pipes report EOF when the child exits
+        child_events.close()
+
+        message = None
+        try:
+            while self.ser.poll(STARTUP_TIMEOUT):
+                message = self.ser.recv()
+                if message[0] == "write":
+                    self.write(*message[1:])
+                elif message[0] in ("opened", "failed"):
+                    break
+        except (EOFError, OSError):
+            message = None
+        if not message or message[0] != "opened":
+            self.close()
+            if report:
+                self.write("Can't open port", ERROR)
+            return False
+        self.baudrate = message[1]
+        self.running = True
+        self.opened.set()
+        self.write("acquisition process %d started" % self.process.pid)
+        self.interface.connection_changed(True)
+        return True
+
+    def transmit(self, data):               # Engine thread, the child writes to the port
+        try:
+            self.control.send(("send", data, self.interface.record_index[0]))
+        except OSError:
+            pass                            # the child is gone, poll() notices
+
+    def poll(self, ready=True):             # Relay the events of the child and store the samples, False once it is gone
+        alive = True
+        try:
+            while self.ser.poll():
+                message = self.ser.recv()
+                if message[0] == "write":
+                    self.write(*message[1:])
+                elif message[0] == "lost":
+                    alive = False
+        except (EOFError, OSError):
+            alive = False
+        self.drain()
+        return alive
+
+    def drain(self):                        # Store what the ring holds, then ask the child for a notification
+        ring = self.ring
+        while True:
+            records, head, lost = ring.read(self.cursor)
+            if lost:
+                self.overrun += lost
+                self.write("acquisition ring overrun, %d samples lost" % lost, WARNING)
+            if len(records):                # store() takes one move at a time
+                for part in np.split(records, np.flatnonzero(np.diff(records["move"])) + 1):
+                    self.store(part)
+            self.cursor = head
+            self.parser.frames, self.parser.malformed = int(ring.header[FRAMES]), int(ring.header[MALFORMED])
+            self.parser.lost = int(ring.header[LOST]) + self.overrun
+            if ring.header[CLOCK_DRIFT] or ring.header[CLOCK_OFFSET]:   # for the diagnostics
+                self.clock.device.offset, self.clock.device.drift = int(ring.header[CLOCK_OFFSET]), int(ring.header[CLOCK_DRIFT]) / 1e6
+            ring.header[NOTIFY] = 1
+            if ring.head == head:           # nothing came in meanwhile, the next write notifies
+                return
+
+    def close(self):                        # Stop the child, called by the engine when it is lost or detached
+        if self.process:
+            try:
+                self.control.send(("stop",))
+            except OSError:
+                pass
+            self.process.join(STOP_TIMEOUT)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+            self.control.close()
+            self.process = self.control = None
+        if self.ring:
+            self.ring.close()
+            self.ring.unlink()
+            self.ring = None
+        super().close()                     # closes the event pipe as the port
@@ -0,0 +1,286 @@
+#############################################################################
+#Offline analytics over recorded sessions
+#Every SessionRecorder directory (one with an index.jsonl) under the given
+#paths is analysed by a pool of processes, one session per task, and the
+#results are merged into one report. Results are cached by the content hash
+#of the session files, so a re-run only analyses new or changed sessions:
+#
+#   python analytics.py record/ --workers 8 --out report.json --csv report.csv
+#
+#Metrics of a session, all computed on whole columns (DRO in counts of 0.01 mm,
+#pulses in motor steps). A move engages when the DRO leaves its start value by
+#more than the noise of both readings (2 * TOLERANCE); the pulses before it are
+#the take-up:
+#   linearity   dro = slope * pulse + offset[direction] over the engaged samples:
+#               slope, steps_per_count, residual rms and max
+#   backlash    take-up of the moves reversing the direction minus the take-up
+#               of moves in the same direction, per direction change ("+-", "-+")
+#   lost steps  engaged pulses not seen by the DRO: |dpulse| - |ddro| * steps_per_count
+#   ratio drift engaged steps per count of each move, its spread and trend per hour
+#   settling    around RF: overshoot past the final DRO, approach speed over the
+#               last samples, DRO motion after RF before the next move's first step
+#############################################################################
+
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from frame_parser import STATUS_FINISH
+from sample_store import SAMPLE_DTYPE
+from session_recorder import SessionReader, segment_name
+
+ANALYSIS_VERSION = 2                        # part of the cache key, bump when a metric changes
+TOLERANCE = 1                               # DRO counts of noise
+APPROACH_SAMPLES = 10                       # samples before RF for the approach speed
+MIN_TRAVEL = 10                             # DRO counts a move needs for its step-to-count ratio
+
+
+def find_sessions(paths):                   # Session directories under paths, sorted
+    sessions = set()
+    for path in paths:
+        for directory, _, files in os.walk(path):
+            if "index.jsonl" in files:
+                sessions.add(os.path.normpath(directory))
+    return sorted(sessions)
+
+
+def content_hash(directory):                # of the index and the segments, in order
+    digest = hashlib.blake2b(str(ANALYSIS_VERSION).encode(), digest_size=20)
+    names = ["index.jsonl"]
+    while os.path.exists(os.path.join(directory, segment_name(len(names) - 1))):
+        names.append(segment_name(len(names) - 1))
+    for name in names:
+        digest.update(name.encode())
+        with open(os.path.join(directory, name), "rb") as session_file:
+            while True:
+                block = session_file.read(1 << 20)
+                if not block:
+                    break
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def load(directory):                        # every record of a session, time in us
+    parts = list(SessionReader(directory).records())
+    return np.concatenate(parts) if parts else np.empty(0, dtype=SAMPLE_DTYPE)
+
+
+def stats(values, digits=3):                # mean and max of a metric over the moves
+    if len(values) == 0:
+        return {"mean": None, "max": None}
+    return {"mean": round(float(np.mean(values)), digits), "max": round(float(np.max(values)), digits)}
+
+
+def analyse(records):
+    move = records["move"].astype(np.int64)
+    pulse = records["pulse"].astype(np.int64)
+    dro = records["dro"].astype(np.int64)
+    t = records["time"].astype(np.int64)
+    n = len(records)
+    if n == 0:
+        return {"samples": 0, "moves": 0}
+
+    # moves as [start, end) runs of the move column, move 0 (before the first command) left out
+    starts = np.r_[0, np.flatnonzero(np.diff(move)) + 1]
+    ends = np.r_[starts[1:], n]
+    start_pulse = np.where(starts > 0, pulse[starts - 1], pulse[starts])    # sample before the command
+    start_dro = np.where(starts > 0, dro[starts - 1], dro[starts])
+    end_pulse, end_dro = pulse[ends - 1], dro[ends - 1]
+    direction = np.sign(end_pulse - start_pulse)
+    finished = records["status"][ends - 1] == STATUS_FINISH
+    valid = (move[starts] > 0) & (direction != 0)
+
+    # engagement: first sample of each move whose DRO is off the start by more than the noise of both readings
+    lengths = ends - starts
+    changed = np.flatnonzero(np.abs(dro - np.repeat(start_dro, lengths)) > 2 * TOLERANCE)
+    first = changed[np.minimum(np.searchsorted(changed, starts), len(changed) - 1)] if len(changed) else ends
+    engaged = valid & (first < ends) & (first >= starts)
+    first = np.where(engaged, first, ends - 1)
+    takeup = np.abs(pulse[first] - start_pulse)
+
+    # linearity over engaged samples, one slope and an offset per direction
+    sample_move = np.repeat(np.arange(len(starts)), lengths)
+    in_fit = engaged[sample_move] & (np.arange(n) >= first[sample_move])
+    sample_direction = direction[sample_move]
+    sxx = sxy = 0.0
+    means = {}
+    for d in (1, -1):
+        mask = in_fit & (sample_direction == d)
+        if mask.sum() >= 2:
+            x, y = pulse[mask].astype(float), dro[mask].astype(float)
+            means[d] = (x.mean(), y.mean())
+            sxx += ((x - means[d][0]) ** 2).sum()
+            sxy += ((x - means[d][0]) * (y - means[d][1])).sum()
+    result = {"samples": int(n), "moves": int(valid.sum()), "finished": int((finished & valid).sum()),
+              "duration_s": round((int(t[-1]) - int(t[0])) / 1e6, 3)}
+    if sxx <= 0 or sxy == 0:
+        return result
+    slope = sxy / sxx                       # DRO counts per step
+    steps_per_count = 1 / slope
+    offsets = {d: m[1] - slope * m[0] for d, m in means.items()}
+    residual = np.zeros(n)
+    for d, offset in offsets.items():
+        mask = in_fit & (sample_direction == d)
+        residual[mask] = dro[mask] - (slope * pulse[mask] + offset)
+    fitted = residual[in_fit]
+    result["linearity"] = {"slope": round(slope, 6), "steps_per_count": round(steps_per_count, 6),
+                           "residual_rms": round(float(np.sqrt(np.mean(fitted ** 2))), 3),
+                           "residual_max": round(float(np.abs(fitted).max()), 3)}
+
+    # backlash: take-up after a reversal beyond the take-up of a move in the same direction
+    index = np.flatnonzero(engaged)
+    previous = np.r_[0, direction[index][:-1]]
+    reversal = (previous != 0) & (previous != direction[index])
+    same = takeup[index][(previous == direction[index])]
+    baseline = float(np.median(same)) if len(same) else steps_per_count
+    backlash = {}
+    for name, d in (("+-", -1), ("-+", 1)):
+        steps = takeup[index][reversal & (direction[index] == d)] - baseline
+        backlash[name] = dict(stats(steps), count=int(len(steps)), mean_counts=round(float(np.mean(steps)) * slope, 3) if len(steps) else None)
+    result["backlash_steps"] = backlash
+
+    # lost steps and step-to-count ratio of the engaged part of each move
+    engaged_pulse = np.abs(end_pulse - pulse[first])[index]
+    engaged_dro = np.abs(end_dro - dro[first])[index]
+    lost = engaged_pulse - engaged_dro * steps_per_count
+    lost_tolerance = (2 * TOLERANCE + 1) * steps_per_count   # noise and a count of quantization at either end
+    result["lost_steps"] = {"total": round(float(lost[lost > lost_tolerance].sum()), 1), "max": round(float(max(lost.max(), 0)), 1),
+                            "moves": int((lost > lost_tolerance).sum())}
+    long_moves = engaged_dro >= MIN_TRAVEL
+    ratio = engaged_pulse[long_moves] / engaged_dro[long_moves]
+    if len(ratio):
+        hours = (t[ends[index][long_moves] - 1] - t[0]) / 3.6e9
+        trend = float(np.polyfit(hours, ratio, 1)[0]) if len(ratio) >= 3 and np.ptp(hours) > 0 else 0.0
+        k = max(1, len(ratio) // 10)
+        result["ratio"] = {"mean": round(float(ratio.mean()), 6), "std": round(float(ratio.std()), 6),
+                           "per_hour": round(trend, 6),
+                           "change_pct": round(float((ratio[-k:].mean() / ratio[:k].mean() - 1) * 100), 3)}
+
+    # settling around RF of the finished moves
+    done = np.flatnonzero(finished & valid)
+    if len(done):
+        peak_high = np.maximum.reduceat(dro, starts)[done]
+        peak_low = np.minimum.reduceat(dro, starts)[done]
+        overshoot = np.where(direction[done] > 0, peak_high - end_dro[done], end_dro[done] - peak_low)
+        back = np.maximum(ends[done] - 1 - APPROACH_SAMPLES, starts[done])
+        span = (t[ends[done] - 1] - t[back]) / 1e6
+        approach = np.abs(end_dro[done] - dro[back])[span > 0] / span[span > 0]
+        # samples of the next move before its first step: the carriage still moving after RF
+        nxt = done[done + 1 < len(starts)] + 1
+        rank = np.full(len(starts), -1)
+        rank[nxt] = np.arange(len(nxt))
+        owner = rank[sample_move]
+        before = sample_move - 1            # the finished move of each sample, masked by owner
+        still = (owner >= 0) & (pulse == end_pulse[before])
+        drift = np.zeros(len(nxt))
+        settle = np.zeros(len(nxt))
+        np.maximum.at(drift, owner[still], np.abs(dro - end_dro[before])[still])
+        np.maximum.at(settle, owner[still], (t - t[ends[before] - 1])[still] / 1e3)
+        result["settling"] = {"overshoot_counts": stats(overshoot), "approach_counts_per_s": stats(approach, 1),
+                              "after_rf_counts": stats(drift), "after_rf_ms": stats(settle),
+                              "moves_moving_after_rf": int((drift > TOLERANCE).sum())}
+    return result
+
+
+# Worker: analyse one session, or take its result from the cache
+def analyse_session(directory, cache=None):
+    started = time.perf_counter()
+    digest = content_hash(directory)
+    path = os.path.join(cache, digest + ".json") if cache else None
+    if path and os.path.exists(path):
+        with open(path, "r") as json_file:
+            metrics, cached = json.load(json_file), True
+    else:
+        metrics, cached = analyse(load(directory)), False
+        if path:
+            with open(path + ".tmp%d" % os.getpid(), "w") as json_file:
+                json.dump(metrics, json_file)
+            os.replace(path + ".tmp%d" % os.getpid(), path)    # readers never see half a file
+    return {"session": directory, "hash": digest, "cached": cached,
+            "seconds": round(time.perf_counter() - started, 3), "metrics": metrics}
+
+
+def flatten(prefix, value, row):            # nested metrics to "a.b.c" columns
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flatten(prefix + "." + key if prefix else key, item, row)
+    else:
+        row[prefix] = value
+    return row
+
+
+def summary(results):                       # per numeric column: mean, min, max and the session of the max
+    rows = [flatten("", r["metrics"], {}) for r in results]
+    columns = {}
+    for row in rows:
+        for key in row:
+            columns.setdefault(key, None)
+    merged = {}
+    for key in columns:
+        values = [(row[key], r["session"]) for row, r in zip(rows, results) if isinstance(row.get(key), (int, float))]
+        if values:
+            numbers = np.array([v for v, _ in values], dtype=float)
+            merged[key] = {"mean": round(float(numbers.mean()), 6), "min": float(numbers.min()), "max": float(numbers.max()),
+                           "max_session": values[int(numbers.argmax())][1]}
+    return merged
+
+
+def run(paths, workers=None, cache=None, log=print):
+    sessions = find_sessions(paths)
+    if cache:
+        os.makedirs(cache, exist_ok=True)
+    begin = time.perf_counter()
+    results, failed = [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(analyse_session, session, cache): session for session in sessions}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as error:      # a corrupt session (or a dead worker) fails alone, the others go on
+                failed.append({"session": futures[future], "error": "%s: %s" % (type(error).__name__, error)})
+                log("%d/%d %s failed: %s" % (len(results) + len(failed), len(sessions), futures[future], failed[-1]["error"]))
+                continue
+            results.append(result)
+            log("%d/%d %s%s" % (len(results) + len(failed), len(sessions), result["session"], " (cached)" if result["cached"] else ""))
+    results.sort(key=lambda r: r["session"])
+    failed.sort(key=lambda f: f["session"])
+    return {"meta": {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "version": ANALYSIS_VERSION,
+                     "workers": workers or os.cpu_count(), "sessions": len(sessions),
+                     "analysed": sum(not r["cached"] for r in results), "cached": sum(r["cached"] for r in results),
+                     "failed": len(failed), "seconds": round(time.perf_counter() - begin, 3)},
+            "summary": summary(results), "sessions": results, "failed": failed}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Analyse recorded sessions in parallel")
+    parser.add_argument("paths", nargs="+", help="session directories or directories holding them")
+    parser.add_argument("--workers", type=int, default=None, help="processes, default one per core")
+    parser.add_argument("--cache", default="./record/analytics_cache", help="results by content hash")
+    parser.add_argument("--no-cache", action="store_true", help="analyse every session again")
+    parser.add_argument("--out", default=None, help="write the JSON report here instead of stdout")
+    parser.add_argument("--csv", default=None, help="also write one row per session to this CSV")
+    args = parser.parse_args()
+
+    report = run(args.paths, args.workers, None if args.no_cache else args.cache, log=lambda text: print(text, file=sys.stderr))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as json_file:
+            json_file.write(text)
+    else:
+        print(text)
+    if args.csv:
+        rows = [flatten("", r["metrics"], {"session": r["session"], "hash": r["hash"]}) for r in report["sessions"]]
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        with open(args.csv, "w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+    print("%(sessions)d sessions, %(analysed)d analysed, %(cached)d cached, %(failed)d failed, %(seconds).1f s" % report["meta"],
+          file=sys.stderr)
@@ -0,0 +1,235 @@
+#############################################################################
+#Benchmarks of the acquisition and display hot paths
+#Runs headless (offscreen Qt platform); results are JSON, one entry per case
+#with the median and best time per operation over the repeats:
+#
+#   python benchmark.py --out baseline.json             # all cases
+#   python benchmark.py --quick --only parse,store      # a subset, smaller sizes
+#   python benchmark.py --baseline baseline.json --threshold 1.25
+#
+#With --baseline, every case is compared by its median and the exit code is 1
+#when one is slower than threshold times the baseline.
+#############################################################################
+
+import os
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import numpy as np
+
+
+def run(function, repeat=5, number=1, setup=None):
+    # Time `number` calls of function per repeat, returns s per call (median, best)
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        started = time.perf_counter()
+        for _ in range(number):
+            function(state) if setup else function()
+        times.append((time.perf_counter() - started) / number)
+    return float(np.median(times)), float(min(times))
+
+
+def result(median, best, unit="op", **extra):
+    return dict({"median_us": round(median * 1e6, 3), "best_us": round(best * 1e6, 3), "unit": unit}, **extra)
+
+
+def synthetic_stream(moves=100, steps=500):     # RR frames of alternating moves, each closed by RF
+    frames, pulse, dro = [], 0, 0
+    for move in range(moves):
+        sign = 1 if move % 2 == 0 else -1
+        for _ in range(steps):
+            pulse += sign
+            dro += sign
+            frames.append("RR%d;%d!" % (pulse, dro))
+        frames.append("RF%d;%d!" % (pulse, dro))
+    return "".join(frames).encode()
+
+
+# ComPortConnector.ser_in: parse, store, publish, on chunks of the serial reads
+# (64 bytes is about a read at 9600 baud, 4096 at 115200 under load)
+def bench_parse(quick):
+    from acquisition import Acquisition, ComPortConnector
+
+    data = synthetic_stream(40 if quick else 200)
+    frames = data.count(b"!")
+    results = {}
+    with Acquisition({"record_path": "", "record_capacity": 10**8}, log=lambda text: None) as acquisition:
+        for chunk in (16, 64, 512, 4096):
+            chunks = [data[i:i + chunk] for i in range(0, len(data), chunk)]
+
+            def setup():
+                controller = acquisition.add("bench")
+                connector = ComPortConnector("bench", 9600, controller, acquisition.engine)
+                connector.running = True
+                controller.connector = connector
+                controller.register_move(1, "L+000500#")
+                return connector
+
+            def feed(connector):
+                for c in chunks:
+                    connector.ser_in(c)
+
+            median, best = run(feed, repeat=3, setup=setup)
+            results["parse/chunk=%d" % chunk] = result(median / len(chunks), best / len(chunks), "chunk",
+                                                       frames_per_second=round(frames / median, 1))
+    return results
+
+
+# dro_pulse_record (SampleStore): growth in batches as ser_in stores them, RF
+# replace_last once per move, and the reads done at that size
+def bench_store(quick):
+    from sample_store import SampleStore, to_records
+    from frame_parser import STATUS_FINISH
+
+    results = {}
+    batch = to_records(1, 1, np.arange(32), np.arange(32), 0)
+    for size in (10**4, 10**5, 10**6) if quick else (10**4, 10**5, 10**6, 10**7):
+        calls = size // len(batch)
+
+        def fill(store):
+            for i in range(calls):
+                store.extend_records(batch)
+                if i % 16 == 15:            # a move of 512 samples ends
+                    store.replace_last(1, STATUS_FINISH, 0, 0, 0)
+
+        median, best = run(fill, repeat=1 if size >= 10**7 else 3, setup=lambda: SampleStore(size))
+        results["store/extend n=%d" % size] = result(median / size, best / size, "sample")
+
+        store = SampleStore(size)
+        fill(store)
+        median, best = run(lambda: store.replace_last(1, STATUS_FINISH, 0, 0, 0), number=1000)
+        results["store/replace_last n=%d" % size] = result(median, best)
+        median, best = run(lambda: store.latest(1000), number=100)
+        results["store/latest_1000 n=%d" % size] = result(median, best)
+        median, best = run(lambda: store.columns(), repeat=3)
+        results["store/columns n=%d" % size] = result(median, best)
+    return results
+
+
+def gallery():                              # WidgetGallery with its chart, created once
+    global _gallery
+    if "_gallery" not in globals():
+        from PyQt6.QtWidgets import QApplication
+        import main_ui
+        app = QApplication.instance() or QApplication(sys.argv[:1])
+        _gallery = main_ui.WidgetGallery()
+        _gallery.show()
+        if _gallery.p1 is None:             # built after the first show, see WidgetGallery.showEvent
+            _gallery.build_chart()
+        app.processEvents()
+    return _gallery
+
+
+# update_plot per frame: a frame brings 50 new samples (5000 samples/s at
+# 100 frames/s), "draw" adds the synchronous repaint of the window
+def bench_plot(quick):
+    from PyQt6.QtWidgets import QApplication
+    g = gallery()
+    results = {}
+    pulse, dro = np.arange(50, dtype=float), np.arange(50) / 100
+    for frame in (1000, 10000) if quick else (1000, 10000, 100000):
+        g.plot_time_frame = frame
+        station = g.add_station("bench")
+        median, best = run(lambda: g.update_plot(pulse, dro, station), repeat=5, number=20)
+        results["plot/update_plot frame=%d" % frame] = result(median, best, "frame")
+
+        def draw():
+            g.update_plot(pulse, dro, station)
+            g.repaint()
+            QApplication.processEvents()
+        median, best = run(draw, repeat=5, number=10)
+        results["plot/draw frame=%d" % frame] = result(median, best, "frame")
+    return results
+
+
+def bench_update_data(quick):               # DataFrame of the whole session
+    from sample_store import SampleStore, to_records
+    g = gallery()
+    results = {}
+    for size in (10**4, 10**5, 10**6) if quick else (10**4, 10**5, 10**6, 10**7):
+        station = g.add_station("bench")
+        station.dro_pulse_record = SampleStore(size)
+        station.dro_pulse_record.extend_records(to_records(1, 1, np.arange(size), np.arange(size), np.arange(size)))
+        g.select_station(g.stations.index(station))
+        g.update_data()                     # imports pandas outside of the timing
+        median, best = run(g.update_data, repeat=3)
+        results["update_data n=%d" % size] = result(median, best)
+        station.dro_pulse_record.clear()
+    return results
+
+
+def bench_move_command(quick):              # Parameters box to "SSDDDD"
+    g = gallery()
+    results = {}
+    for name, distance in (("valid", "12.34"), ("invalid", "120")):
+        g.tab3_line5Edit1.setText(distance)
+        median, best = run(g.move_command_generator, number=2000)
+        results["move_command_generator/%s" % name] = result(median, best)
+    return results
+
+
+BENCHMARKS = {"parse": bench_parse, "store": bench_store, "plot": bench_plot,
+              "update_data": bench_update_data, "move_command": bench_move_command}
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "commit": commit or None, "python": platform.python_version(),
+            "numpy": np.__version__, "machine": platform.machine(), "platform": platform.platform()}
+
+
+def compare(results, baseline, threshold):  # ratio of the medians, > threshold is a regression
+    comparison = {}
+    for name, value in results.items():
+        old = baseline.get("results", {}).get(name)
+        if old and old["median_us"] > 0:
+            ratio = value["median_us"] / old["median_us"]
+            comparison[name] = {"baseline_us": old["median_us"], "ratio": round(ratio, 3), "regression": ratio > threshold}
+    return comparison
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Benchmark the acquisition and display hot paths")
+    parser.add_argument("--only", default=None, help="comma separated: " + ",".join(BENCHMARKS))
+    parser.add_argument("--quick", action="store_true", help="smaller sizes, for a fast check")
+    parser.add_argument("--out", default=None, help="write the JSON here instead of stdout")
+    parser.add_argument("--baseline", default=None, help="JSON of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown counted as a regression")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))   # main_ui reads ./config/config.json
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    report = {"meta": dict(metadata(), quick=args.quick), "results": {}}
+    for name in names:
+        started = time.perf_counter()
+        report["results"].update(BENCHMARKS[name](args.quick))
+        print("%s: %.1f s" % (name, time.perf_counter() - started), file=sys.stderr)
+    if "_gallery" in globals():
+        _gallery.close()
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r") as json_file:
+            report["comparison"] = compare(report["results"], json.load(json_file), args.threshold)
+        regressions = [name for name, c in report["comparison"].items() if c["regression"]]
+        for name, c in report["comparison"].items():
+            print("%-40s %10.3f us  x%.2f%s" % (name, report["results"][name]["median_us"], c["ratio"],
+                                                "  REGRESSION" if c["regression"] else ""), file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as json_file:
+            json_file.write(text)
+    else:
+        print(text)
+    sys.exit(1 if regressions else 0)
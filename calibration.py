@@ -0,0 +1,92 @@
+#############################################################################
+#Online pulse-to-DRO calibration by incremental least squares
+#############################################################################
+
+import threading
+import numpy as np
+
+
+#Running mean and co-moments of (pulse, dro) of one move direction.
+#merge() folds in a whole batch with the parallel update of Chan et al., which
+#stays accurate with pulses in the millions where raw sums of squares would not.
+class RunningMoments:
+
+    def __init__(self):
+        self.n = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.cxx = 0.0                      # sum of (x - mean_x)**2
+        self.cxy = 0.0
+        self.cyy = 0.0
+
+    def merge(self, x, y):
+        m = len(x)
+        if m == 0:
+            return
+        mean_x, mean_y = x.mean(), y.mean()
+        dx, dy = x - mean_x, y - mean_y
+        n = self.n + m
+        delta_x, delta_y = mean_x - self.mean_x, mean_y - self.mean_y
+        weight = self.n * m / n
+        self.cxx += dx @ dx + delta_x * delta_x * weight
+        self.cxy += dx @ dy + delta_x * delta_y * weight
+        self.cyy += dy @ dy + delta_y * delta_y * weight
+        self.mean_x += delta_x * m / n
+        self.mean_y += delta_y * m / n
+        self.n = n
+
+    def remove(self, x, y):                 # Take one sample back out, the reverse of merging it
+        if self.n <= 1:
+            self.__init__()
+            return
+        n = self.n - 1
+        mean_x, mean_y = (self.n * self.mean_x - x) / n, (self.n * self.mean_y - y) / n
+        self.cxx = max(self.cxx - (x - mean_x) * (x - self.mean_x), 0.0)
+        self.cxy -= (x - mean_x) * (y - self.mean_y)
+        self.cyy = max(self.cyy - (y - mean_y) * (y - self.mean_y), 0.0)
+        self.mean_x, self.mean_y, self.n = mean_x, mean_y, n
+
+
+#Model: dro = slope * pulse + offset[direction], one slope for both directions.
+#The offsets of L+ and L- moves differ by the backlash: after a reversal the
+#motor turns while the carriage stands still. Costs O(1) memory and O(1) work
+#per sample; update() is called by the engine thread, estimates() from anywhere.
+class Calibration:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.moments = {1: RunningMoments(), -1: RunningMoments()}
+        self.direction = 0                  # direction of the last move
+        self.reversals = 0
+
+    def update(self, direction, pulse, dro):    # one batch of samples of a move in direction +1 / -1
+        with self.lock:
+            if self.direction and direction != self.direction:
+                self.reversals += 1
+            self.direction = direction
+            self.moments[direction].merge(np.asarray(pulse, dtype=float), np.asarray(dro, dtype=float))
+
+    def remove(self, direction, pulse, dro):   # a sample overwritten after update(), e.g. the RR replaced by RF
+        with self.lock:
+            self.moments[direction].remove(float(pulse), float(dro))
+
+    def estimates(self):
+        with self.lock:
+            groups = [m for m in self.moments.values() if m.n >= 2]
+            n = sum(m.n for m in self.moments.values())
+            sxx = sum(m.cxx for m in groups)
+            if sxx <= 0:
+                return None
+            slope = sum(m.cxy for m in groups) / sxx          # DRO counts (0.01 mm) per pulse
+            offsets = {d: m.mean_y - slope * m.mean_x for d, m in self.moments.items() if m.n}
+            residual = max(sum(m.cyy for m in groups) - slope * slope * sxx, 0.0)
+            backlash = offsets[-1] - offsets[1] if len(offsets) == 2 and self.reversals else None
+            return {
+                "steps_per_count": 1 / slope if slope else None,    # pulses per 0.01 mm
+                "offset": offsets.get(1, offsets.get(-1)),          # DRO counts at pulse 0, L+ moves
+                "residual_rms": (residual / n) ** 0.5,              # DRO counts
+                "backlash": backlash,                               # DRO counts (0.01 mm)
+                "backlash_steps": backlash / slope if backlash is not None and slope else None,
+                "samples": n,
+                "reversals": self.reversals,
+            }
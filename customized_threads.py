@@ -1,123 +1,93 @@
 import time
+import numpy as np
 import PyQt6.QtCore as QtCore
-import serial
-
-import queue as Queue
-
-#Thread for updating plot and text displayed on main UI within a defined period
-class PlotUpdater(QtCore.QRunnable):
-
-    def __init__(self, UI): # Initialise with serial port details
-        QtCore.QThread.__init__(self)
-        self.running = True
-        self.text_update_bool = False
-        self.plot_update_bool = False
-        self.pulse_lower = -90
-        self.pulse_upper = 90
-        self.dro_lower = -0.04
-        self.dro_upper = 0.04
-        self.latest_message = ""
-        self.interface = UI
-        
-
-    @QtCore.pyqtSlot()
-    def run(self):                          # Run serial reader thread
-
-        while self.running:                
-            
-            time.sleep(self.interface.plot_update_interval)
-            
-            if len(self.interface.dro_pulse_record)!=0:
-
-                if self.interface.dro_pulse_record[-1][1] == "Moving":
-                    self.text_update_bool = True
-                    self.plot_update_bool = True
-
-                elif self.interface.dro_pulse_record[-1][1] == "Finish":
-                    self.text_update_bool = False
-                    self.plot_update_bool = False
-
-                pulse_display = self.interface.dro_pulse_record[-1][2]
-                dro_display = self.interface.dro_pulse_record[-1][3]/100
-
-                self.pulse_lower = min(self.pulse_lower, pulse_display)
-                self.pulse_upper = max(self.pulse_upper, pulse_display)
-
-                self.dro_lower = min(self.dro_lower, dro_display)
-                self.dro_upper = max(self.dro_upper, dro_display)
-                
-                if self.text_update_bool:
-                    self.interface.update_text(round(pulse_display,2), round(dro_display,2))
-                if self.plot_update_bool:
-                    self.interface.update_plot(pulse_display, dro_display)
-  
-
-#Thread for monitoring data in and out from Arduino
-class ComPortConnector(QtCore.QRunnable): 
-
-    def __init__(self, portname, baudrate, UI): # Initialise with serial port details
-        QtCore.QThread.__init__(self)
-        self.portname, self.baudrate = portname, baudrate
-        self.txq = Queue.Queue()
-        self.running = True
-        self.latest_message = ""
-        self.ser = None
+from PyQt6.QtGui import QGuiApplication
+
+from frame_parser import STATUS_MOVING
+
+#Updates plot and text displayed on main UI, lives in the GUI thread.
+#The only way from the worker threads to the widgets: the "plot" subscriber
+#calls samples_ready (from the engine thread) when samples arrive in its empty
+#queue, Station.update_text keeps the latest Coordinate values and calls
+#post_text. The queued signals bring the GUI thread here, which redraws right
+#away or, within one frame of the last redraw, once the frame is over; a frame
+#is plot_interval or the screen refresh period, whichever is longer. Whatever
+#arrived in between is applied in one go, only the latest text is shown.
+#Nothing runs while nothing arrives.
+class PlotUpdater(QtCore.QObject):
+
+    samples_ready = QtCore.pyqtSignal()
+    state_ready = QtCore.pyqtSignal()
+
+    def __init__(self, UI):
+        super().__init__()
         self.interface = UI
- 
-    def ser_out(self, s):                   # Write outgoing data to serial port if open
-        self.txq.put(s)                     # ..using a queue to sync with reader thread
-         
-    def ser_in(self, s):                    # Write incoming serial data to screen
-
-        for ss in s:
-            if ss == '!':
-
-                if self.latest_message[0] == 'R':
-
-                    if self.latest_message[1] == 'R':
-                        msg = self.latest_message.replace("RR","")
-                        msg_array = msg.split(";")
-                        pulse_return = float(msg_array[0])
-                        dro_return = float(msg_array[1])
-                        self.interface.dro_pulse_record.append([self.interface.record_index[0], "Moving", pulse_return, dro_return, int(time.time()*1000) - self.interface.start_time])
-                        self.latest_message = ""
-
-                    elif self.latest_message[1] == 'F':
-                        msg = self.latest_message.replace("RF","")
-                        msg_array = msg.split(";")
-                        pulse_return = float(msg_array[0])
-                        dro_return = float(msg_array[1])
-                        self.interface.dro_pulse_record = self.interface.dro_pulse_record[:-1] #If last coordinates match RR, replace that with RM
-                        self.interface.dro_pulse_record.append([self.interface.record_idx, "Finish", pulse_return, dro_return, int(time.time()*1000) - self.interface.start_time])
-                        self.interface.update_text(pulse_return, dro_return)
-                        self.latest_message = "" 
-            else:
-                self.latest_message += ss
-
-    # Convert bytes to string
-    def to_string(self, d):
-        return d if type(d) is str else "".join([chr(b) for b in d])
-
-    @QtCore.pyqtSlot()
-    def run(self):                          # Run serial reader thread
-        try:
-            self.ser = serial.Serial(self.portname, self.baudrate, timeout=self.interface.timeout)
+        self.next_frame = 0
+        screen = QGuiApplication.primaryScreen()
+        refresh = screen.refreshRate() if screen else 0
+        self.frame_interval = max(UI.plot_update_interval, 1/refresh if refresh > 0 else 0)
+        self.text_shown = None              # (station, (pulse, dro)) in the Coordinate box
+        self.text_pending = False           # state_ready emitted, not run yet
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.run)
+        self.samples_ready.connect(self.schedule)
+        self.state_ready.connect(self.schedule)
+        self.subscriber = UI.sample_bus.subscribe("plot", max_samples=UI.plot_time_frame,   # older samples would scroll out anyway
+                                                  notify=self.samples_ready.emit)
+
+    def post_text(self):                    # Any thread, after changing Station.last_text; one signal per frame at most
+        if not self.text_pending:
+            self.text_pending = True
+            self.state_ready.emit()
+
+    def schedule(self):
+        if not self.timer.isActive():
+            self.timer.start(max(0, int((self.next_frame - time.monotonic())*1000)))
+
+    def stop(self):
+        self.timer.stop()
+        self.subscriber.close()
+
+    def run(self):                          # Redraw with every batch queued since the last frame
+
+        self.next_frame = time.monotonic() + self.frame_interval
+        self.text_pending = False           # before reading last_text, a later change signals again
+        batches = self.subscriber.get(0)
+        if batches:
+            self.update_plots(batches)
+        station = self.interface.station
+        if self.text_shown != (station, station.last_text):
+            self.text_shown = (station, station.last_text)
+            self.interface.update_text(*station.last_text, station)
+
+    def update_plots(self, batches):
+
+        diagnostics = self.interface.diagnostics
+        for batch in batches:
+            diagnostics.add("deliver", batch.time, len(batch.records))
+
+        for source in dict.fromkeys(batch.source for batch in batches):   # one update per station, in order
+            station = self.interface.station_by_name.get(source)
+            if station is None:
+                continue
+            own = [batch for batch in batches if batch.source == source]
+            new_samples = np.concatenate([batch.records for batch in own])
+            index = None                    # store index of every sample, the x of the chart
+            if all(batch.index is not None for batch in own):
+                index = np.concatenate([np.arange(batch.index, batch.index + len(batch.records)) for batch in own])
+            station.text_update_bool = new_samples["status"][-1] == STATUS_MOVING
+
+            pulse_display = new_samples["pulse"].astype(float)
+            dro_display = new_samples["dro"]/100
+
+            station.pulse_lower = min(station.pulse_lower, pulse_display.min())
+            station.pulse_upper = max(station.pulse_upper, pulse_display.max())
+
+            station.dro_lower = min(station.dro_lower, dro_display.min())
+            station.dro_upper = max(station.dro_upper, dro_display.max())
             
-            time.sleep(self.interface.timeout*1.2)
-            self.ser.flushInput()
-        except:
-            self.ser = None
-            self.interface.write("Can't open port")
-
-        if not self.ser:
-            self.running = False
-        while self.running:
-            s = self.ser.read(self.ser.in_waiting or 1)
-            if s:                                       # Get data from serial port
-                self.ser_in(self.to_string(s))               # ..and convert to string
-            if not self.txq.empty():
-                txd = str(self.txq.get())               # If Tx data in queue, write to serial port
-                self.ser.write(txd.encode())
-        if self.ser:                                    # Close serial port when thread finished
-            self.ser.close()
-            self.ser = None
\ No newline at end of file
+            if station.text_update_bool:      # already on the GUI thread, run() shows it
+                station.last_text = (int(new_samples["pulse"][-1]), int(new_samples["dro"][-1]))
+            self.interface.update_plot(pulse_display, dro_display, station, index)   # Plot the whole batch, Finish included
+            self.interface.update_calibration(station)
@@ -0,0 +1,94 @@
+#############################################################################
+#Low-overhead instrumentation of the acquisition and display hot path
+#############################################################################
+
+import time
+import json
+import numpy as np
+
+
+#Rolling histogram of the last `size` durations, in seconds. Written by one
+#thread only (no lock), read by the diagnostics panel.
+class RollingHistogram:
+
+    def __init__(self, size=4096):
+        self.values = np.zeros(size)
+        self.count = 0                      # durations recorded since the start
+
+    def add(self, seconds):
+        self.values[self.count % len(self.values)] = seconds
+        self.count += 1
+
+    def stats(self):                        # in ms
+        values = self.values[:min(self.count, len(self.values))]
+        if len(values) == 0:
+            return {"count": 0, "p50": None, "p99": None, "max": None}
+        p50, p99 = np.percentile(values, (50, 99)) * 1000
+        return {"count": self.count, "p50": round(float(p50), 4), "p99": round(float(p99), 4),
+                "max": round(float(values.max()) * 1000, 4)}
+
+
+#Stages, each timed by the thread that runs it:
+#   read     engine thread, serial read of one chunk          counts bytes
+#   parse    engine thread, FrameParser.feed of one chunk     counts frames
+#   store    engine thread, SampleStore append of one batch   counts samples
+#   deliver  publish to PlotUpdater picking the batch up      counts samples
+#   plot     GUI thread, update_plot of one station           counts redraws
+#   text     GUI thread, update_text                          counts updates
+class Diagnostics:
+
+    STAGES = ("read", "parse", "store", "deliver", "plot", "text")
+
+    def __init__(self):
+        self.clock = time.perf_counter      # monotonic, sub-microsecond resolution
+        self.reset()
+
+    def reset(self):
+        self.start = self.clock()
+        self.histograms = {stage: RollingHistogram() for stage in self.STAGES}
+        self.totals = dict.fromkeys(self.STAGES, 0)
+        self.last_totals = dict(self.totals)
+        self.last_time = self.start
+
+    def add(self, stage, started, amount=1):  # started: self.clock() when the stage began
+        self.histograms[stage].add(self.clock() - started)
+        self.totals[stage] += amount
+
+    # Rates are computed over the time since the previous snapshot, queues and
+    # drop counters come from the live objects of the UI
+    def snapshot(self, UI):
+        now = self.clock()
+        elapsed = max(now - self.last_time, 1e-9)
+        totals = dict(self.totals)
+        rates = {stage: (totals[stage] - self.last_totals[stage]) / elapsed for stage in self.STAGES}
+        self.last_totals, self.last_time = totals, now
+
+        stations = {}
+        for station in UI.stations:
+            connector = station.connector
+            stations[station.name] = {
+                "connected": station.connected,
+                "samples": len(station.dro_pulse_record),
+                "tx_queue": connector.txq.qsize() if connector else 0,
+                "parser_pending": len(connector.parser.pending) if connector else 0,
+                "malformed": connector.parser.malformed if connector else 0,
+                "lost_frames": getattr(connector.parser, "lost", 0) if connector else 0,
+                "latency_ms": connector.latency_stats() if connector else None,
+                "device_clock": connector.clock.device.stats() if connector else None,
+            }
+        return {
+            "time": time.time(),
+            "uptime_s": round(now - self.start, 3),
+            "bytes_per_second": round(rates["read"], 1),
+            "frames_per_second": round(rates["parse"], 1),
+            "samples_per_second": round(rates["store"], 1),
+            "redraws_per_second": round(rates["plot"], 1),
+            "totals": totals,
+            "stages_ms": {stage: self.histograms[stage].stats() for stage in self.STAGES},
+            "bus": {"published": UI.sample_bus.published, "subscribers": UI.sample_bus.stats()},
+            "stations": stations,
+        }
+
+    def export(self, UI, path):             # JSON snapshot for regression comparison
+        with open(path, "w") as json_file:
+            json.dump(self.snapshot(UI), json_file, indent=2)
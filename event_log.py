@@ -0,0 +1,134 @@
+#############################################################################
+#Structured event log: connection events, move commands, errors
+#Events go to a fixed-size ring in memory, to the message box in batches and
+#to a rotating file written by its own thread, so logging never waits for
+#the GUI or the disk:
+#   record/events.log, events.log.1 ... one line per event, oldest in the highest number
+#############################################################################
+
+import os
+import time
+import threading
+import queue as Queue
+from collections import deque, namedtuple
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+
+# time: time.time(), level: DEBUG ... ERROR, source: station name or "" for the UI
+Event = namedtuple("Event", "time level source message")
+
+
+def format_event(event):
+    stamp = time.strftime("%H:%M:%S", time.localtime(event.time)) + ".%03d" % (event.time % 1 * 1000)
+    return "%s %-7s %s%s" % (stamp, LEVEL_NAMES.get(event.level, event.level),
+                             event.source + ": " if event.source else "", event.message)
+
+
+#Thread appending the events to path in batches, rolled over to path.1 ...
+#path.<backups> once the file exceeds max_bytes
+class LogWriter(threading.Thread):
+
+    def __init__(self, path, max_bytes=1048576, backups=3, flush_interval=0.5):
+        super().__init__(daemon=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.queue = Queue.Queue()
+        self.running = True
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.log_file = open(path, "a", encoding="utf-8")
+
+    def put(self, event):                   # Any thread
+        self.queue.put(event)
+
+    def stop(self):
+        self.running = False
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            try:
+                events = [self.queue.get(timeout=self.flush_interval)]
+            except Queue.Empty:
+                events = []
+            while not self.queue.empty():   # everything queued since the last write
+                events.append(self.queue.get_nowait())
+            lines = [format_event(e) + "\n" for e in events if e is not None]
+            if lines:
+                self.write_lines(lines)
+            if not self.running and self.queue.empty():
+                break
+        self.log_file.close()
+
+    def write_lines(self, lines):           # One write per file, rolled over before max_bytes is passed
+        size, chunk = self.log_file.tell(), []
+        for line in lines:
+            length = len(line.encode())     # bytes on disk, not characters
+            if size and size + length > self.max_bytes:
+                self.log_file.write("".join(chunk))
+                self.roll_over()
+                size, chunk = 0, []
+            chunk.append(line)
+            size += length
+        self.log_file.write("".join(chunk))
+        self.log_file.flush()
+
+    def roll_over(self):
+        self.log_file.close()
+        for number in range(self.backups - 1, 0, -1):
+            if os.path.exists("%s.%d" % (self.path, number)):
+                os.replace("%s.%d" % (self.path, number), "%s.%d" % (self.path, number + 1))
+        if self.backups:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self.log_file = open(self.path, "a", encoding="utf-8")
+
+
+#Ring of the last `capacity` events. log() may be called from any thread;
+#the display takes the events logged since its last take() and is notified
+#(notify, e.g. a Qt signal emit) once when the first of them arrives.
+class EventLog:
+
+    def __init__(self, capacity=10000, writer=None, notify=None):
+        self.lock = threading.Lock()
+        self.events = deque(maxlen=capacity)
+        self.pending = []                   # events not taken by the display yet
+        self.max_pending = capacity         # older pending events are dropped, the display would scroll them out
+        self.writer = writer                # LogWriter or None
+        self.notify = notify
+        self.counts = dict.fromkeys(LEVEL_NAMES, 0)
+
+    def log(self, message, level=INFO, source=""):
+        event = Event(time.time(), level, source, str(message))
+        with self.lock:
+            self.events.append(event)
+            was_empty = not self.pending
+            self.pending.append(event)
+            if len(self.pending) > self.max_pending:
+                del self.pending[:len(self.pending) - self.max_pending]
+            self.counts[level] = self.counts.get(level, 0) + 1
+        if self.writer:
+            self.writer.put(event)
+        if was_empty and self.notify:       # outside the lock
+            self.notify()
+
+    def take(self, level=DEBUG, limit=None):    # newest `limit` events at or above level logged since the last take
+        with self.lock:
+            pending, self.pending = self.pending, []
+        pending = [e for e in pending if e.level >= level]
+        return pending[-limit:] if limit else pending
+
+    def snapshot(self, level=DEBUG):        # events in the ring at or above level
+        with self.lock:
+            return [e for e in self.events if e.level >= level]
+
+    def close(self):
+        if self.writer:
+            self.writer.stop()
+            self.writer = None
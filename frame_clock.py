@@ -0,0 +1,129 @@
+#############################################################################
+#Arrival times of the frames of a serial read
+#A read returns everything received since the one before, so a read time is
+#only an upper bound for the frames in it. Each frame is moved back from the
+#read time by the bytes that came after it, at bits_per_byte / baudrate each,
+#or closer together when the read holds more bytes than the line could carry
+#since the previous read (USB adapters that ignore the baud rate, ptys). Frames carrying the us counter of the
+#controller (FRAME_DTYPE "device") are timed by that counter instead, mapped
+#to the host clock by DeviceClock. Times are ns of time.monotonic_ns(), the
+#"time" column of the samples is us since the session start.
+#############################################################################
+
+import numpy as np
+from collections import deque
+
+COUNTER_BITS = 32                           # micros() of the Arduino, wraps every 71.6 minutes
+RESET_NS = 1_000_000_000                    # a frame this far off the mapping means the controller restarted
+MAX_DRIFT = 5.0                             # ns per us (0.5 %, a ceramic resonator), steeper fits are ignored
+
+
+#Maps the us counter of the controller to host ns. Transmission only delays
+#a frame, so host arrival - device time is smallest for the least delayed
+#frames: the minimum of each window of device time is kept, and drift and
+#offset are the line under all of them that runs closest to them (an edge of
+#their lower convex hull), so windows where every frame was late don't tilt
+#it. Frames faster than the line lower the offset immediately.
+class DeviceClock:
+
+    def __init__(self, window=1.0, windows=30):
+        self.window = int(window * 1e6)     # us of device time
+        self.minima = deque(maxlen=windows) # (device us, host - device ns) of the closed windows
+        self.current = None                 # [window number, device us, host - device ns] of the open window
+        self.counter = None                 # last raw counter value, for unwrapping
+        self.wraps = 0
+        self.reference = 0                  # device us at which offset applies
+        self.offset = None                  # host - device ns at reference
+        self.drift = 0.0                    # ns per us beyond 1000, i.e. 1e-3 is 1 ppm
+
+    def reset(self):
+        self.minima.clear()
+        self.current = self.offset = None
+        self.drift = 0.0
+
+    def unwrap(self, counter):              # raw counter values to us since the controller started
+        values = counter.astype(np.int64)
+        previous = values[0] if self.counter is None else self.counter
+        wraps = self.wraps + np.cumsum(np.diff(values, prepend=previous) < -(1 << (COUNTER_BITS - 1)))
+        self.counter, self.wraps = int(values[-1]), int(wraps[-1])
+        return values + (wraps << COUNTER_BITS)
+
+    def expected(self, device):             # host - device ns of the mapping at device us
+        return self.offset + np.rint(self.drift * (np.asarray(device) - self.reference)).astype(np.int64)
+
+    def to_host(self, device):              # device us -> host ns
+        return device * 1000 + self.expected(device)
+
+    # device: unwrapped us of the frames of a read, host: their arrival ns
+    def update(self, device, host):
+        delta = host - device * 1000
+        if self.offset is not None and abs(int(delta[-1] - self.expected(device[-1]))) > RESET_NS:
+            self.reset()
+        i = int(np.argmin(delta))
+        number = int(device[i]) // self.window
+        if self.current is not None and self.current[0] != number:
+            self.minima.append((self.current[1], self.current[2]))
+            self.current = None
+            self.fit()
+        if self.current is None or delta[i] < self.current[2]:
+            self.current = [number, int(device[i]), int(delta[i])]
+        if self.offset is None:
+            self.reference, self.offset = self.current[1], self.current[2]
+        else:                               # stay under the fastest frame seen
+            self.offset += min(0, self.current[2] - int(self.expected(self.current[1])))
+
+    def fit(self):
+        if len(self.minima) < 2:
+            return
+        hull = []                           # lower hull, the minima come in device order
+        for x, y in self.minima:
+            while len(hull) >= 2 and ((hull[-1][0] - hull[-2][0]) * (y - hull[-2][1])
+                                      - (hull[-1][1] - hull[-2][1]) * (x - hull[-2][0])) <= 0:
+                hull.pop()
+            hull.append((x, y))
+        if len(hull) < 2:
+            return
+        device, delta = np.array(self.minima, dtype=np.float64).T
+        x, y = np.array(hull, dtype=np.float64).T
+        slope = np.diff(y) / np.diff(x)
+        # sum of the distances of all minima above each edge, the closest edge wins
+        cost = delta.sum() - len(delta) * y[:-1] - slope * (device.sum() - len(delta) * x[:-1])
+        cost[np.abs(slope) > MAX_DRIFT] = np.inf
+        k = int(np.argmin(cost))
+        if np.isfinite(cost[k]):
+            self.reference = int(device[-1])
+            self.drift = float(slope[k])
+            self.offset = int(y[k] + slope[k] * (self.reference - x[k]))
+
+    def stats(self):
+        # drift_ppm: how much faster the counter runs than the host clock
+        return None if self.offset is None else {"drift_ppm": round(-self.drift * 1000, 3),
+                                                 "offset_ms": round(self.offset / 1e6, 3), "windows": len(self.minima)}
+
+
+class FrameClock:
+
+    def __init__(self, baudrate, start_ns=0, bits_per_byte=10):
+        self.bits_per_byte = bits_per_byte  # 8N1: start, 8 data and stop bit
+        self.set_baudrate(baudrate)
+        self.start_ns = start_ns            # time.monotonic_ns() of the session start
+        self.last_read = None               # ns of the previous read
+        self.device = DeviceClock()
+
+    def set_baudrate(self, baudrate):       # after the protocol switched the port
+        self.byte_ns = self.bits_per_byte * 1e9 / baudrate if baudrate else 0.0
+
+    # frames: FRAME_DTYPE of one read of length bytes, tails: bytes of the read after
+    # each frame, read_ns: time.monotonic_ns() when the read returned. Returns the sample times.
+    def stamp(self, frames, tails, read_ns, length):
+        byte_ns = self.byte_ns
+        if self.last_read is not None and length:
+            byte_ns = min(byte_ns, (read_ns - self.last_read) / length)
+        host = read_ns - (tails * byte_ns).astype(np.int64)
+        self.last_read = read_ns
+        timed = frames["device"] >= 0
+        if timed.any():
+            device = self.device.unwrap(frames["device"][timed])
+            self.device.update(device, host[timed])
+            host[timed] = self.device.to_host(device)
+        return (host - self.start_ns) // 1000
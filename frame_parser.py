@@ -0,0 +1,170 @@
+#############################################################################
+#Incremental parsers for the frames sent by Router_DRO_encoder_v1
+#ASCII (default): "RR<pulse>;<pos>!" while moving, "RF<pulse>;<pos>!" on finish,
+#"RR<pulse>;<pos>;<micros>!" with FRAME_MICROS set in the firmware
+#Binary (negotiated with "P<version><baud>#", see BinaryFrameParser)
+#############################################################################
+
+import re
+import struct
+import binascii
+import numpy as np
+
+STATUS_FINISH = 0 # same codes as print_cor() in the firmware
+STATUS_MOVING = 1
+
+STATUS_NAME = {STATUS_MOVING: "Moving", STATUS_FINISH: "Finish"}
+
+# One parsed frame, the caller adds move number and timestamp
+# device: micros() of the controller at the encoder edge, -1 if the frame has none
+FRAME_DTYPE = np.dtype([("status", "i1"), ("pulse", "i4"), ("dro", "i4"), ("device", "i8")])
+
+MAX_FRAME_LENGTH = 64 # longest valid frame is 37 bytes
+
+# one frame up to its "!" per match: the fields of a valid frame, only the whole text of a malformed one
+_SEGMENT = re.compile(rb"(R([RF])(-?\d{1,10});(-?\d{1,10})(?:;(\d{1,10}))?!|[^!]*!)")
+_STATUS = {b"R": STATUS_MOVING, b"F": STATUS_FINISH}
+_NO_FRAMES = np.empty(0, dtype=FRAME_DTYPE)
+_NO_TAILS = np.empty(0, dtype=np.int64)
+
+
+def _is_long(text):                         # pulse and position are a 32-bit long of the firmware, up to 10 digits
+    return len(text) < 10 or -2**31 <= int(text) < 2**31
+
+
+class FrameParser:
+
+    def __init__(self):
+        self.pending = b""                  # partial frame carried over to the next read
+        self.frames = 0                     # number of frames parsed successfully
+        self.malformed = 0                  # number of frames skipped
+        self.tails = _NO_TAILS              # per frame of the last feed: bytes of the chunk after it
+
+    def reset(self):
+        self.pending = b""
+
+    # Parse every complete frame of a chunk (bytes, bytearray or memoryview) in one
+    # pass of _SEGMENT. Returns an array of FRAME_DTYPE, empty if the chunk holds no
+    # complete frame (shared, don't write to it)
+    def feed(self, chunk):
+        data = self.pending + chunk if self.pending else bytes(chunk)
+        end = data.rfind(b"!") + 1
+        if not end:
+            if len(data) > MAX_FRAME_LENGTH:   # no terminator in sight, drop the garbage
+                data = b""
+                self.malformed += 1
+            self.pending = data
+            self.tails = _NO_TAILS
+            return _NO_FRAMES
+
+        self.pending = data[end:]
+        segments = _SEGMENT.findall(data, 0, end)
+        rows, tails = [], []
+        remaining = len(data)
+        for whole, status, pulse, dro, micros in segments:
+            remaining -= len(whole)
+            if status and _is_long(pulse) and _is_long(dro):
+                rows.append((_STATUS[status], int(pulse), int(dro), int(micros) if micros else -1))
+                tails.append(remaining)
+        self.malformed += len(segments) - len(rows)
+        if not rows:
+            self.tails = _NO_TAILS
+            return _NO_FRAMES
+        self.frames += len(rows)
+        self.tails = np.array(tails, dtype=np.int64)
+        return np.array(rows, dtype=FRAME_DTYPE)
+
+
+#Binary protocol, all fields little-endian
+#   sync 0xA5 0x5A | seq u16 | count u8 | count x record | crc u16
+#   record version 1: status u8, pulse i32, dro i32
+#          version 2: status u8, pulse i32, dro i32, micros u32
+#The CRC is CRC-16/XMODEM (binascii.crc_hqx with 0) over seq, count and the records
+BINARY_VERSION = 1                          # requested unless "binary_version" is configured
+BINARY_SYNC = b"\xa5\x5a"
+BINARY_RECORD = np.dtype([("status", "u1"), ("pulse", "<i4"), ("dro", "<i4")])
+BINARY_RECORDS = {1: BINARY_RECORD, 2: np.dtype(BINARY_RECORD.descr + [("device", "<u4")])}
+BINARY_HEADER = struct.Struct("<2sHB")
+BINARY_MAX_COUNT = 32                       # samples per frame, matches BATCH_SIZE of the firmware
+
+_ACK = re.compile(rb"RB(\d);(\d{1,7})!")
+
+
+def handshake_command(baudrate, version=BINARY_VERSION):   # Ask the firmware to switch protocol
+    return "P%d%06d#" % (version, baudrate)
+
+
+def parse_handshake(reply):                 # (version, baudrate) acknowledged by the firmware, or None
+    m = _ACK.search(bytes(reply))
+    return (int(m[1]), int(m[2])) if m else None
+
+
+def encode_binary_frame(seq, frames, version=BINARY_VERSION):  # Used by virtual_device.py, frames is a FRAME_DTYPE array
+    records = np.empty(len(frames), dtype=BINARY_RECORDS[version])
+    for name in records.dtype.names:
+        records[name] = frames[name]
+    body = struct.pack("<HB", seq & 0xFFFF, len(frames)) + records.tobytes()
+    return BINARY_SYNC + body + struct.pack("<H", binascii.crc_hqx(body, 0))
+
+
+class BinaryFrameParser:
+
+    def __init__(self, version=BINARY_VERSION):
+        self.record = BINARY_RECORDS[version]
+        self.pending = bytearray()
+        self.frames = 0                     # number of samples decoded
+        self.malformed = 0                  # frames dropped on a bad CRC or a bad header
+        self.lost = 0                       # frames missing according to the sequence numbers
+        self.seq = None
+        self.tails = np.empty(0, dtype=np.int64)    # per sample of the last feed: bytes of the chunk after its frame
+
+    def reset(self):
+        self.pending = bytearray()
+        self.seq = None
+
+    # Same contract as FrameParser.feed: returns every complete sample of the chunk
+    def feed(self, chunk):
+        data = self.pending
+        data += chunk
+        parts, ends = [], []
+        pos = 0
+        while True:
+            start = data.find(BINARY_SYNC, pos)
+            if start < 0:                   # keep a trailing sync byte, drop the rest
+                pos = len(data) - 1 if data[-1:] == BINARY_SYNC[:1] else len(data)
+                break
+            if start + BINARY_HEADER.size > len(data):
+                pos = start
+                break
+            _, seq, count = BINARY_HEADER.unpack_from(data, start)
+            end = start + BINARY_HEADER.size + count * self.record.itemsize + 2
+            if count == 0 or count > BINARY_MAX_COUNT:
+                self.malformed += 1
+                pos = start + 1
+                continue
+            if end > len(data):
+                pos = start
+                break
+            crc = int.from_bytes(data[end - 2:end], "little")
+            if binascii.crc_hqx(data[start + 2:end - 2], 0) != crc:
+                self.malformed += 1         # resynchronise on the next sync pattern
+                pos = start + 1
+                continue
+
+            if self.seq is not None:
+                self.lost += (seq - self.seq - 1) & 0xFFFF
+            self.seq = seq
+            parts.append(np.frombuffer(data, dtype=self.record, count=count, offset=start + BINARY_HEADER.size))
+            ends.append(end)
+            pos = end
+
+        frames = np.empty(sum(len(p) for p in parts), dtype=FRAME_DTYPE)
+        frames["device"] = -1
+        if parts:
+            records = np.concatenate(parts)
+            for name in records.dtype.names:
+                frames[name] = records[name]
+        self.tails = len(data) - np.repeat(np.array(ends, dtype=np.int64), [len(p) for p in parts])
+        self.pending = data[pos:]
+        self.frames += len(frames)
+        return frames
@@ -0,0 +1,103 @@
+#############################################################################
+#Shared asyncio I/O engine serving every serial link from one thread
+#############################################################################
+
+import os
+import asyncio
+import threading
+
+from event_log import WARNING
+
+
+#A link is a ComPortConnector: open(report) (blocking, runs in the executor),
+#poll(ready) (read and parse what is waiting), flush_tx() (write the queued
+#commands), close(), write(text, level) and a .ser attribute.
+#On POSIX the event loop waits on the port descriptors (add_reader), so nothing
+#runs until bytes arrive; ports without one (pySerial URL handlers, Windows) are
+#polled every poll_interval. A link that was up and goes away (cable pulled,
+#board reset) is reopened every reconnect_interval until it is detached.
+class SerialEngine(threading.Thread):
+
+    def __init__(self, poll_interval=0.002, reconnect_interval=1.0):
+        super().__init__(daemon=True)
+        self.poll_interval = poll_interval
+        self.reconnect_interval = reconnect_interval
+        self.loop = asyncio.new_event_loop()
+        self.tasks = {}                     # link -> task serving it, only touched on the loop
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.loop.close()
+
+    def call(self, callback, *args):        # Run callback on the engine thread, from any thread
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def attach(self, link, serve=None):    # serve: coroutine function run for the link instead of serve(), see replay.py
+        self.call(self.start_link, link, serve)
+
+    def detach(self, link):
+        self.call(self.cancel_link, link)
+
+    def stop(self):                         # Cancel every link, wait until the ports are closed
+        if self.loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+        self.join()
+
+    def start_link(self, link, serve=None):
+        if link not in self.tasks:
+            self.tasks[link] = self.loop.create_task((serve or self.serve)(link))
+
+    def cancel_link(self, link):
+        task = self.tasks.get(link)
+        if task:
+            task.cancel()
+
+    async def shutdown(self):
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    async def serve(self, link):            # Open, serve and reopen one link until cancelled
+        opening, report = None, True
+        try:
+            while True:
+                opening = self.loop.run_in_executor(None, link.open, report)
+                if await asyncio.shield(opening):
+                    report = False          # from now on the link is reopened when lost
+                    await self.transport(link)
+                    link.close()
+                    link.write("connection lost, reconnecting", WARNING)
+                elif report:
+                    return                  # never connected, e.g. a wrong port name
+                await asyncio.sleep(self.reconnect_interval)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if opening is not None and not opening.done():
+                await asyncio.wait([opening])   # don't leave a port opened behind our back
+            link.close()
+            self.tasks.pop(link, None)
+
+    async def transport(self, link):        # Returns once the port is gone
+        fileno = link.ser.fileno() if os.name == "posix" and hasattr(link.ser, "fileno") else None
+        if fileno is None:
+            while link.poll(ready=False):
+                link.flush_tx()
+                await asyncio.sleep(self.poll_interval)
+            return
+
+        lost = self.loop.create_future()
+        def readable():
+            if not link.poll() and not lost.done():
+                lost.set_result(None)
+        self.loop.add_reader(fileno, readable)
+        try:
+            await lost
+        finally:
+            self.loop.remove_reader(fileno)
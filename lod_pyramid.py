@@ -0,0 +1,128 @@
+#############################################################################
+#Min/max level-of-detail pyramid for drawing a whole session on the chart
+#############################################################################
+
+import threading
+import numpy as np
+
+CHUNK = 65536                               # entries per chunk of a level
+
+
+#Entries of one level in fixed-size chunks: growing never copies what is stored
+class _Level:
+
+    def __init__(self, columns, dtype):
+        self.columns = columns
+        self.dtype = dtype
+        self.chunks = []                    # (2, columns, CHUNK) arrays: min, max
+        self.length = 0
+
+    def set(self, first, mins, maxs):       # write entries first.. and cut the level after them
+        end = first + mins.shape[1]
+        while len(self.chunks) * CHUNK < end:
+            self.chunks.append(np.empty((2, self.columns, CHUNK), dtype=self.dtype))
+        done = 0
+        while first + done < end:
+            chunk, offset = divmod(first + done, CHUNK)
+            k = min(end - first - done, CHUNK - offset)
+            self.chunks[chunk][0, :, offset:offset + k] = mins[:, done:done + k]
+            self.chunks[chunk][1, :, offset:offset + k] = maxs[:, done:done + k]
+            done += k
+        self.length = end
+
+    def get(self, a, b):                    # mins and maxs of entries [a, b)
+        if b - a <= 0:
+            empty = np.empty((self.columns, 0), dtype=self.dtype)
+            return empty, empty
+        first, last = a // CHUNK, (b - 1) // CHUNK
+        if first == last:
+            part = self.chunks[first][:, :, a % CHUNK:(b - 1) % CHUNK + 1]
+        else:
+            part = np.concatenate([self.chunks[first][:, :, a % CHUNK:]] + self.chunks[first + 1:last]
+                                  + [self.chunks[last][:, :, :(b - 1) % CHUNK + 1]], axis=2)
+        return part[0], part[1]
+
+
+#Entry i of level k >= 1 holds the min and max of samples [i*factor**k, (i+1)*factor**k).
+#Level 0 (every sample) is not kept: it is read through source(x0, x1), e.g. from the
+#SampleStore, and level 1 is drawn where the source no longer holds the samples. Only
+#the samples of the last level-1 entry are kept, to recompute it. The last entry of
+#each level may be partial and is recomputed when new samples arrive, so extend()
+#only touches the tail of every level.
+class MinMaxPyramid:
+
+    def __init__(self, columns=2, factor=8, dtype=np.float32, source=None):
+        self.columns = columns
+        self.factor = factor
+        self.dtype = dtype
+        self.source = source                # source(x0, x1) -> (columns, n) samples [x0, x1), n < x1 - x0 if gone
+        self.lock = threading.Lock()
+        self.size = 0                       # samples added
+        self.levels = []                    # levels 1, 2, ...
+        self.tail = np.empty((columns, 0), dtype=dtype)   # samples of the last level-1 entry
+
+    # Append a batch, one array per column
+    def extend(self, *values):
+        values = np.vstack([np.atleast_1d(v) for v in values]).astype(self.dtype, copy=False)
+        if values.shape[1] == 0:
+            return
+        with self.lock:
+            if self.size % self.factor:     # the partial entry takes the new samples
+                values = np.hstack((self.tail, values))
+            start = self.size - self.size % self.factor
+            self.size += values.shape[1] - (self.size - start)
+            self.tail = values[:, (self.size - 1) // self.factor * self.factor - start:].copy()
+            self._update(start // self.factor, values)
+
+    # Overwrite the newest sample, e.g. when RF replaces the last RR
+    def replace_last(self, *values):
+        with self.lock:
+            if self.size == 0:
+                return
+            self.tail[:, -1] = values
+            self._update((self.size - 1) // self.factor, self.tail)
+
+    # Recompute level 1 from entry first, on samples starting at its first sample, then the levels above
+    def _update(self, first, samples):
+        starts = np.arange(0, samples.shape[1], self.factor)
+        mins, maxs = np.minimum.reduceat(samples, starts, axis=1), np.maximum.reduceat(samples, starts, axis=1)
+        level = 0
+        while True:
+            if level == len(self.levels):
+                self.levels.append(_Level(self.columns, self.dtype))
+            self.levels[level].set(first, mins, maxs)
+            length = self.levels[level].length
+            if length <= 1:
+                return
+            first //= self.factor           # first entry of the next level to recompute
+            below_mins, below_maxs = self.levels[level].get(first * self.factor, length)
+            starts = np.arange(0, below_mins.shape[1], self.factor)
+            mins, maxs = np.minimum.reduceat(below_mins, starts, axis=1), np.maximum.reduceat(below_maxs, starts, axis=1)
+            level += 1
+
+    # Points to draw samples [x0, x1) with at most about 2*max_points points per column.
+    # Returns x and one y array per column; min and max of every entry are interleaved
+    # so the curve covers the full vertical extent of the samples it stands for.
+    def query(self, x0, x1, max_points):
+        with self.lock:
+            x0 = int(max(0, np.floor(x0)))
+            x1 = int(min(self.size, np.ceil(x1) + 1))
+            if x1 <= x0:
+                return np.empty(0), np.empty((self.columns, 0), dtype=self.dtype)
+            if (x1 - x0) <= max(max_points, 1) and self.source is not None:
+                samples = self.source(x0, x1)
+                if samples.shape[1] == x1 - x0:
+                    return np.arange(x0, x1, dtype=float), samples.astype(self.dtype)
+            level = 1
+            while level < len(self.levels) and (x1 - x0) / self.factor ** level > max(max_points, 1):
+                level += 1
+
+            block = self.factor ** level
+            a, b = x0 // block, -(-x1 // block)
+            b = min(b, self.levels[level - 1].length)
+            mins, maxs = self.levels[level - 1].get(a, b)
+            x = (np.arange(a, b) * block + (block - 1) / 2).repeat(2)
+            y = np.empty((self.columns, 2 * (b - a)), dtype=self.dtype)
+            y[:, 0::2] = mins
+            y[:, 1::2] = maxs
+            return x, y
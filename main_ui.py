@@ -4,40 +4,54 @@
 #############################################################################
 
 #Library -----------------------------------------------------------------------
-import serial
-import matplotlib.pyplot as plt
-import pyqtgraph as pg
-from random import randint
-import numpy as np
-import pandas as pd
 import time
-from datetime import datetime
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-try:
-    import Queue
-except:
-    import queue as Queue
-import sys, time, serial
+IMPORT_START = time.perf_counter()      # start of the startup report, see startup_report
+
+import numpy as np
+import sys
 import json
+import os
+from datetime import datetime
 import PyQt6.QtCore as QtCore
 from PyQt6.QtCore import QDateTime, Qt, QTimer
 from PyQt6.QtWidgets import (QApplication, QCheckBox, QComboBox, QDateTimeEdit,
         QDial, QDialog, QGridLayout, QGroupBox, QHBoxLayout, QLabel, QLineEdit,
         QProgressBar, QPushButton, QRadioButton, QScrollBar, QSizePolicy,
-        QSlider, QSpinBox, QStyleFactory, QTableWidget, QTabWidget, QTextEdit,
+        QSlider, QSpinBox, QStyleFactory, QTableWidget, QTabWidget,
         QVBoxLayout, QWidget, QPlainTextEdit, QTableWidgetItem, QScrollArea,
-        QFormLayout, QHeaderView)
+        QFormLayout, QHeaderView, QFileDialog, QTableView)
 from PyQt6 import QtGui
 #Customized library-------------------------------------------------------------
 from animated_toggle import AnimatedToggle
-from customized_threads import PlotUpdater, ComPortConnector
+from customized_threads import PlotUpdater
+from acquisition import move_parameters, move_command, load_moves
+from move_program import MoveProgram, IDLE, RUNNING, PAUSED
+from motion_planner import MotionPlanner
+from replay import Replay
+from sample_bus import SampleBus
+from io_engine import SerialEngine
+from station import Station
+from diagnostics import Diagnostics
+from move_table import MoveTableModel
+from event_log import EventLog, LogWriter, LEVEL_NAMES, INFO, WARNING, format_event
+
+pg = None               # pyqtgraph, imported by build_chart once the window is shown
+IMPORT_END = time.perf_counter()
+
+
+def set_text(label, text):  # setText only on a change, returns whether it changed
+    if label.text() == text:
+        return False
+    label.setText(text)
+    return True
 
 
 #Thread for the main user interface
 class WidgetGallery(QDialog):
 
-    text_update = QtCore.pyqtSignal(str)
+    text_update = QtCore.pyqtSignal()           # first event logged since the message box was last filled
+    program_update = QtCore.pyqtSignal(int)     # row of a finished program move, -1 when the program ends
+    connection_update = QtCore.pyqtSignal(str, bool)    # station name, port open; from the engine thread
     
     def __init__(self, parent=None):
         
@@ -49,31 +63,45 @@ class WidgetGallery(QDialog):
 
         # Define start_time, used as ID for each measurement
         self.start_time = int(time.time() * 1000)
-        self.record_time = {} #define a dictionary, unordered_map, to record the time enabling hall sensor
-        self.dro_pulse_record = []
-        self.threadpool = QtCore.QThreadPool()
-        self.plot_updater = PlotUpdater(self)
-        self.threadpool.start(self.plot_updater)
-        self.plot_updater.running = True
-        self.record_index = [0]
+        self.start_ns = time.monotonic_ns() # origin of the sample times, us in the "time" column
+        self.sample_bus = SampleBus()       # every parsed sample of every station is published here
+        self.diagnostics = Diagnostics()    # stage timings shown in the Diagnostics tab
         self.timeout = self.config["parameter"]["timeout"]
         self.plot_update_interval = self.config["parameter"]["plot_interval"]
         self.plot_time_frame = self.config["parameter"]["plot_frame"]
+        self.plot_updater = PlotUpdater(self)   # redraws when samples arrive, in the GUI thread
+        self.engine = SerialEngine()        # one asyncio thread serves the ports of every station
+        self.engine.start()
 
-        self.ser_router = None
-        
-        self.connect_router = 0 # 0 disconnect, 1 connect
+        self.stations = []                  # one Station per controller, see add_station
+        self.station_by_name = {}
+        self.station = None                 # station shown in Coordinate and driven by Parameters
+        self.startup = {"imports": IMPORT_END - IMPORT_START}   # seconds since IMPORT_START, see startup_report
 
         self.setGeometry(30, 30, 300, 500)
 
-        self.text_update.connect(self.append_text)      # Connect text update to handler
+        # Event log: ring in memory, message box filled every log interval, rotating file
+        log = self.config["parameter"]["log"]
+        self.event_log = EventLog(log["capacity"], LogWriter(log["path"], log["max_bytes"], log["backups"]) if log["path"] else None,
+                                  notify=self.text_update.emit)
+        if self.event_log.writer:
+            self.event_log.writer.start()
+        self.log_timer = QTimer(self)
+        self.log_timer.setSingleShot(True)
+        self.log_timer.timeout.connect(self.append_text)
+        self.text_update.connect(lambda: self.log_timer.isActive() or self.log_timer.start(int(log["interval"]*1000)))
+        self.program_update.connect(self.update_program)
+        self.connection_update.connect(self.update_connection)
+        self.program = None                 # MoveProgram loaded in the Program tab
+        self.program_moves = []
+        self.program_plan = None            # segment table when program_moves come from the planner
         
         self.createTopGroupBox()
         self.createCenterLeftTabWidget()
         self.createCenterRightTabWidget()
         self.createBottomTabWidget()
 
-        self.tab3MiddleGroupBox.setDisabled(1)
+        self.add_station(self.top_line1_lineEdit1.text())
 
         title = self.config["description"]["title"]
         doc = self.config["description"]["content"]
@@ -90,8 +118,8 @@ class WidgetGallery(QDialog):
         mainLayout.setStretchFactor(self.CenterLeftTabWidget, 3)
         mainLayout.addWidget(self.CenterRightTabWidget)
         mainLayout.setStretchFactor(self.CenterRightTabWidget, 6)
-        mainLayout.addWidget(self.bottom_textEdit)
-        mainLayout.setStretchFactor(self.bottom_textEdit, 2)
+        mainLayout.addWidget(self.bottomTabWidget)
+        mainLayout.setStretchFactor(self.bottomTabWidget, 2)
 
         self.setLayout(mainLayout)
 
@@ -110,6 +138,14 @@ class WidgetGallery(QDialog):
         self.top_line1_lineEdit1 = QLineEdit("COM9")
         self.top_line1_toggle1 = AnimatedToggle()
         self.top_line1_toggle1.stateChanged.connect(lambda: self.button_clicked_main("connect_router"))
+        self.top_line1_comboBox1 = QComboBox()          # attached controllers
+        self.top_line1_comboBox1.currentIndexChanged.connect(lambda: self.button_clicked_main("select_station"))
+        self.top_line1_Button1 = QPushButton("Add")
+        self.top_line1_Button1.clicked.connect(lambda: self.button_clicked_main("add_station"))
+        self.top_line1_Button2 = QPushButton("Replay")  # recorded session as a new station, see replay.py
+        self.top_line1_Button2.clicked.connect(lambda: self.button_clicked_main("replay"))
+        self.top_line1_comboBox2 = QComboBox()          # replay speed
+        self.top_line1_comboBox2.addItems(["1x", "10x", "100x", "max"])
 
         #top layout line2
         layout = QHBoxLayout()
@@ -119,6 +155,14 @@ class WidgetGallery(QDialog):
         layout.setStretchFactor(self.top_line1_lineEdit1, 5)
         layout.addWidget(self.top_line1_toggle1)
         layout.setStretchFactor(self.top_line1_toggle1, 1)
+        layout.addWidget(self.top_line1_comboBox1)
+        layout.setStretchFactor(self.top_line1_comboBox1, 4)
+        layout.addWidget(self.top_line1_Button1)
+        layout.setStretchFactor(self.top_line1_Button1, 2)
+        layout.addWidget(self.top_line1_Button2)
+        layout.setStretchFactor(self.top_line1_Button2, 2)
+        layout.addWidget(self.top_line1_comboBox2)
+        layout.setStretchFactor(self.top_line1_comboBox2, 1)
         layout.addStretch(10)
   
         #layout.setRowStretch(5, 1)
@@ -189,6 +233,19 @@ class WidgetGallery(QDialog):
         self.tab1_Line2Label1 = QLabel("Motor: ")
         self.tab1_Line2Label2 = QLabel("0")
         self.tab1_Line2Label3 = QLabel(" pulse")
+        # Live pulse to DRO calibration, see calibration.py
+        self.tab1_Line3Label1 = QLabel("Steps: ")
+        self.tab1_Line3Label2 = QLabel("-")
+        self.tab1_Line3Label3 = QLabel(" pulse/0.01 mm")
+        self.tab1_Line4Label1 = QLabel("Offset: ")
+        self.tab1_Line4Label2 = QLabel("-")
+        self.tab1_Line4Label3 = QLabel(" 0.01 mm")
+        self.tab1_Line5Label1 = QLabel("Residual: ")
+        self.tab1_Line5Label2 = QLabel("-")
+        self.tab1_Line5Label3 = QLabel(" 0.01 mm RMS")
+        self.tab1_Line6Label1 = QLabel("Backlash: ")
+        self.tab1_Line6Label2 = QLabel("-")
+        self.tab1_Line6Label3 = QLabel(" 0.01 mm")
 
         coordinate_box = QGridLayout()
         coordinate_box.addWidget(self.tab1_Line1Label1, 0, 0, 1, 1)
@@ -197,6 +254,12 @@ class WidgetGallery(QDialog):
         coordinate_box.addWidget(self.tab1_Line2Label1, 1, 0, 1, 1)
         coordinate_box.addWidget(self.tab1_Line2Label2, 1, 1, 1, 1)
         coordinate_box.addWidget(self.tab1_Line2Label3, 1, 2, 1, 1)
+        for row, line in enumerate(((self.tab1_Line3Label1, self.tab1_Line3Label2, self.tab1_Line3Label3),
+                                    (self.tab1_Line4Label1, self.tab1_Line4Label2, self.tab1_Line4Label3),
+                                    (self.tab1_Line5Label1, self.tab1_Line5Label2, self.tab1_Line5Label3),
+                                    (self.tab1_Line6Label1, self.tab1_Line6Label2, self.tab1_Line6Label3)), 2):
+            for column, label in enumerate(line):
+                coordinate_box.addWidget(label, row, column, 1, 1)
 
         self.CoordinateGroupBox.setLayout(coordinate_box)
 
@@ -243,6 +306,39 @@ class WidgetGallery(QDialog):
 
         self.CenterLeftTabWidget.addTab(tab3, "&Move")
 
+        # Move program: moves from CSV/JSON dispatched back to back on the selected station
+        self.tab4_Button1 = QPushButton("Load")
+        self.tab4_Button2 = QPushButton("Start")
+        self.tab4_Button3 = QPushButton("Pause")
+        self.tab4_Button4 = QPushButton("Abort")
+        self.tab4_Button1.clicked.connect(lambda: self.button_clicked_main("program_load"))
+        self.tab4_Button2.clicked.connect(lambda: self.button_clicked_main("program_start"))
+        self.tab4_Button3.clicked.connect(lambda: self.button_clicked_main("program_pause"))
+        self.tab4_Button4.clicked.connect(lambda: self.button_clicked_main("program_abort"))
+        self.tab4_Button5 = QPushButton("Plan")        # ramped sub-moves for the stroke of the Parameters box
+        self.tab4_Button5.clicked.connect(lambda: self.button_clicked_main("program_plan"))
+        self.tab4_ComboBox1 = QComboBox()
+        self.tab4_ComboBox1.addItems(["+", "-"])
+        self.tab4_ProgressBar1 = QProgressBar()
+        self.tab4_Table1 = QTableWidget(0, len(MoveProgram.RESULT_COLUMNS))
+        self.tab4_Table1.setHorizontalHeaderLabels(MoveProgram.RESULT_COLUMNS)
+        self.tab4_Table1.verticalHeader().setVisible(False)
+
+        tab4_box = QGridLayout()
+        tab4_box.addWidget(self.tab4_Button1, 0, 0, 1, 1)
+        tab4_box.addWidget(self.tab4_Button2, 0, 1, 1, 1)
+        tab4_box.addWidget(self.tab4_Button3, 0, 2, 1, 1)
+        tab4_box.addWidget(self.tab4_Button4, 0, 3, 1, 1)
+        tab4_box.addWidget(self.tab4_Button5, 0, 4, 1, 1)
+        tab4_box.addWidget(self.tab4_ComboBox1, 0, 5, 1, 1)
+        tab4_box.addWidget(self.tab4_ProgressBar1, 0, 6, 1, 2)
+        tab4_box.addWidget(self.tab4_Table1, 1, 0, 1, 8)
+        tab4_box.setContentsMargins(1, 1, 1, 1)
+
+        tab4 = QWidget()
+        tab4.setLayout(tab4_box)
+        self.CenterLeftTabWidget.addTab(tab4, "&Program")
+
     def createCenterRightTabWidget(self):
 
         self.new_messages = []
@@ -260,39 +356,12 @@ class WidgetGallery(QDialog):
 
         #self.plot_thread1 = PlotThread(tab11)
 
-        self.time = np.array(range(self.plot_time_frame))
-        self.plot_dro = np.zeros(self.plot_time_frame, dtype = float)
-        self.plot_pulse = np.zeros(self.plot_time_frame, dtype = float)
-
-        pg.mkQApp()
-
-        pw = pg.PlotWidget()
-        pw.setBackground("w")
-        pw.show()
-        self.p1 = pw.plotItem
-        self.p1.setLabels(left='DRO')
-
-        ## create a new ViewBox, link the right axis to its coordinate system
-        self.p2 = pg.ViewBox()
-        self.p1.showAxis('right')
-        self.p1.scene().addItem(self.p2)
-        self.p1.getAxis('right').linkToView(self.p2)
-        self.p2.setXLink(self.p1)
-        self.p1.getAxis('right').setLabel('Pulse', color='black')
-
-        self.p2.setGeometry(self.p1.vb.sceneBoundingRect())
-
-        self.updateViews()
-        self.p1.vb.sigResized.connect(self.updateViews)
-
-        pen = pg.mkPen(color=(51, 82, 255), width=2, cosmetic=True)
-
-        self.p1.plot(self.plot_dro)
-        self.p2.addItem(pg.PlotCurveItem(self.plot_pulse, pen=pen))
+        self.plot_follow = True                 # False while the user browses the history
+        self.plot_overlay = False               # True draws every station, False only the selected one
+        self.p1 = self.p2 = None                # created by build_chart, right after the window is shown
 
         tab10_middle_box = QGridLayout()
-        tab10_middle_box.addWidget(pw, 0, 0, 1, 1)
-
+        tab10_middle_box.addWidget(QLabel("Loading chart..."), 0, 0, 1, 3)
         self.tab10MiddleGroupBox.setLayout(tab10_middle_box)
         
         tab10 = QWidget()
@@ -303,87 +372,538 @@ class WidgetGallery(QDialog):
         tab10.setLayout(tab10hbox)
 
         self.CenterRightTabWidget.addTab(tab10, "&Chart") 
+        self.tab10_middle_box = tab10_middle_box
+
+        # Diagnostics: hot path timings, rates, queue depths and drops, refreshed while visible
+        self.tab11_Table1 = QTableWidget(0, 2)
+        self.tab11_Table1.setHorizontalHeaderLabels(["Metric", "Value"])
+        self.tab11_Table1.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.tab11_Table1.verticalHeader().setVisible(False)
+        self.tab11_Button1 = QPushButton("Export")
+        self.tab11_Button2 = QPushButton("Reset")
+        self.tab11_Button1.clicked.connect(lambda: self.button_clicked_main("diagnostics_export"))
+        self.tab11_Button2.clicked.connect(lambda: self.button_clicked_main("diagnostics_reset"))
+
+        tab11 = QWidget()
+        tab11hbox = QGridLayout()
+        tab11hbox.addWidget(self.tab11_Table1, 0, 0, 1, 2)
+        tab11hbox.addWidget(self.tab11_Button1, 1, 0, 1, 1)
+        tab11hbox.addWidget(self.tab11_Button2, 1, 1, 1, 1)
+        tab11hbox.setContentsMargins(1, 1, 1, 1)
+        tab11.setLayout(tab11hbox)
+
+        self.CenterRightTabWidget.addTab(tab11, "&Diagnostics")
+        self.diagnostics_tab = tab11
+        self.diagnostics_timer = QTimer(self)
+        self.diagnostics_timer.timeout.connect(self.update_diagnostics)
+        self.diagnostics_timer.start(500)
+
+        # Moves: per-move summary of the selected station (move_index.py), sortable, refreshed while visible
+        self.tab12_Model1 = MoveTableModel(self)
+        self.tab12_Table1 = QTableView()
+        self.tab12_Table1.setModel(self.tab12_Model1)
+        self.tab12_Table1.setSortingEnabled(True)
+        self.tab12_Table1.verticalHeader().setVisible(False)
+        self.tab12_Label1 = QLabel("-")
+
+        tab12 = QWidget()
+        tab12hbox = QGridLayout()
+        tab12hbox.addWidget(self.tab12_Table1, 0, 0, 1, 1)
+        tab12hbox.addWidget(self.tab12_Label1, 1, 0, 1, 1)
+        tab12hbox.setContentsMargins(1, 1, 1, 1)
+        tab12.setLayout(tab12hbox)
+
+        self.CenterRightTabWidget.addTab(tab12, "&Moves")
+        self.moves_tab = tab12
+        self.moves_shown = None             # (station, MoveIndex.version) in the table
+        self.diagnostics_timer.timeout.connect(self.update_moves)
+        self.CenterRightTabWidget.currentChanged.connect(self.update_moves)
 
     #Message box 
     def createBottomTabWidget(self):
-        self.bottomTabWidget = QTabWidget()
-        self.bottom_textEdit = QTextEdit()
-        self.bottom_textEdit.setPlainText("message start\n")
-
-        bottom_layout = QHBoxLayout()
-        bottom_layout.addWidget(self.bottom_textEdit)
+        self.bottomTabWidget = QWidget()
+        self.bottom_textEdit = QPlainTextEdit()
+        self.bottom_textEdit.setReadOnly(True)
+        self.bottom_textEdit.setUndoRedoEnabled(False)  # no undo history of every append
+        self.bottom_textEdit.setMaximumBlockCount(self.config["parameter"]["log"]["lines"])  # oldest lines are dropped
+        self.bottom_textEdit.setPlainText("message start")
+        self.bottom_comboBox1 = QComboBox()             # lowest level shown
+        self.bottom_comboBox1.addItems([LEVEL_NAMES[level] for level in sorted(LEVEL_NAMES)])
+        self.bottom_comboBox1.setCurrentText(LEVEL_NAMES[INFO])
+        self.bottom_comboBox1.currentIndexChanged.connect(lambda: self.button_clicked_main("log_level"))
+
+        bottom_layout = QGridLayout()
+        bottom_layout.setContentsMargins(0, 0, 0, 0)
+        bottom_layout.addWidget(self.bottom_textEdit, 0, 0, 2, 1)
+        bottom_layout.addWidget(self.bottom_comboBox1, 0, 1, 1, 1)
+        bottom_layout.setColumnStretch(0, 1)
         self.bottomTabWidget.setLayout(bottom_layout)
 
-    def append_text(self, text):                # Text display update handler
-        cur = self.bottom_textEdit.textCursor()
-        cur.movePosition(cur.MoveOperation.End) # Move cursor to end of text
-        s = str(text)
+    @property
+    def log_level(self):
+        return sorted(LEVEL_NAMES)[self.bottom_comboBox1.currentIndex()]
+
+    def append_text(self):                      # Add the events logged since the last call, in one go
+        events = self.event_log.take(self.log_level, self.bottom_textEdit.maximumBlockCount())  # older would scroll out
+        lines = [format_event(e) for e in events]
+        if len(lines) == self.bottom_textEdit.maximumBlockCount():
+            self.bottom_textEdit.setPlainText("\n".join(lines))  # replaces every line, cheaper than scrolling them out
+        elif lines:
+            self.bottom_textEdit.appendPlainText("\n".join(lines))
+
 
-        cur.insertText(s+'\n')
-        self.bottom_textEdit.setTextCursor(cur)  
-        
     def closeEvent(self, event):                # Window closing
 
-        if self.ser_router:
-            self.ser_router.running = False              # Wait until serial thread terminates
-            self.ser_router.wait()
+        self.engine.stop()                               # Cancel every link, wait until the ports are closed
+        for station in self.stations:
+            station.connector = None
+            station.close()                              # Flush the samples still queued
+        self.save_calibration()
+        self.plot_updater.stop()
+        self.event_log.close()
             
-    def write(self, text):                      
-        self.text_update.emit(text)             # Send signal to synchronise call with main thread
+    def write(self, text, level=INFO, source=""):   # Any thread; shown within the log interval
+        self.event_log.log(text, level, source)
 
-    def update_plot(self, pulse, dro):
-        
-        self.time = np.append(self.time[1:], self.time[-1] + 1)
-        self.plot_dro = np.append(self.plot_dro[1:], dro)
-        self.plot_pulse = np.append(self.plot_pulse[1:], pulse)
+    def showEvent(self, event):             # Build the chart once the window is on screen
 
-        self.p1.clear()
-        self.p2.clear()
-        self.p1.plot(self.plot_dro)
-        self.p2.addItem(pg.PlotCurveItem(self.plot_pulse, pen='b'))
+        if "first_window" not in self.startup:
+            self.startup["first_window"] = time.perf_counter() - IMPORT_START
+            QTimer.singleShot(0, self.build_chart)
 
-    def update_text(self, pulse, dro):
-        
-        self.tab1_Line1Label2.setText(str(dro/100))
-        self.tab1_Line2Label2.setText(str(pulse))
+    def build_chart(self):                  # Import pyqtgraph and create the chart of the Chart tab
+
+        global pg
+        import pyqtgraph as pg
+        pg.mkQApp()
+
+        pw = pg.PlotWidget()
+        pw.setBackground("w")
+        pw.show()
+        self.p1 = pw.plotItem
+        self.p1.setLabels(left='DRO')
+
+        ## create a new ViewBox, link the right axis to its coordinate system
+        self.p2 = pg.ViewBox()
+        self.p1.showAxis('right')
+        self.p1.scene().addItem(self.p2)
+        self.p1.getAxis('right').linkToView(self.p2)
+        self.p2.setXLink(self.p1)
+        self.p1.getAxis('right').setLabel('Pulse', color='black')
+
+        self.p2.setGeometry(self.p1.vb.sceneBoundingRect())
+
+        self.updateViews()
+        self.p1.vb.sigResized.connect(self.updateViews)
+
+        # Curves are created once per station in create_curves, ranges are set by update_plot
+        self.p1.disableAutoRange()
+        self.p2.disableAutoRange()
+
+        # Zooming or panning with the mouse leaves the live window and draws from the pyramid
+        self.p1.vb.sigRangeChangedManually.connect(lambda: self.button_clicked_main("plot_history"))
+        self.p1.vb.sigXRangeChanged.connect(self.update_history_plot)
+
+        self.tab10_Button1 = QPushButton("Live")
+        self.tab10_Button2 = QPushButton("Session")
+        self.tab10_Button1.clicked.connect(lambda: self.button_clicked_main("plot_live"))
+        self.tab10_Button2.clicked.connect(lambda: self.button_clicked_main("plot_session"))
+        self.tab10_CheckBox1 = QCheckBox("Overlay")
+        self.tab10_CheckBox1.stateChanged.connect(lambda: self.button_clicked_main("plot_overlay"))
+
+        placeholder = self.tab10_middle_box.itemAtPosition(0, 0).widget()
+        self.tab10_middle_box.removeWidget(placeholder)
+        placeholder.deleteLater()
+        self.tab10_middle_box.addWidget(pw, 0, 0, 1, 3)
+        self.tab10_middle_box.addWidget(self.tab10_Button1, 1, 0, 1, 1)
+        self.tab10_middle_box.addWidget(self.tab10_Button2, 1, 1, 1, 1)
+        self.tab10_middle_box.addWidget(self.tab10_CheckBox1, 1, 2, 1, 1)
+
+        for station in self.stations:
+            self.create_curves(station)
+        self.update_curve_visibility()
+        self.startup["chart"] = time.perf_counter() - IMPORT_START
+        self.startup_report()
+
+    def startup_report(self):               # Import and time-to-first-window report, checked against startup_budget
+
+        report = {key: round(value, 3) for key, value in self.startup.items()}
+        report["deferred_modules"] = [m for m in ("pandas", "matplotlib") if m not in sys.modules]
+        budget = self.config["parameter"].get("startup_budget")
+        text = "startup: imports %.2f s, first window %.2f s, chart %.2f s" % (report["imports"], report["first_window"], report["chart"])
+        if budget and report["first_window"] > budget:
+            text += ", over the budget of %.2f s" % budget
+        self.write(text, WARNING if budget and report["first_window"] > budget else INFO)
+        if "--startup-report" in sys.argv:
+            print(json.dumps(report))
+            QTimer.singleShot(0, self.close)
+        return report
+
+    # pulse and dro are batches of new samples, x their index in the SampleStore (default: after the last one)
+    def update_plot(self, pulse, dro, station=None, x=None):
+
+        started = self.diagnostics.clock()
+        station = station or self.station
+        pulse, dro = np.atleast_1d(pulse), np.atleast_1d(dro)
+        last = station.plot_buffer.view()[0][-1]
+        if x is None:
+            x = np.arange(last + 1, last + 1 + len(pulse))
+        else:
+            keep = np.r_[x[1:] != x[:-1], True]     # RF replaced the sample before it
+            x, pulse, dro = x[keep], pulse[keep], dro[keep]
+            if len(x) and x[0] == last:
+                station.plot_buffer.replace_last(x[0], dro[0], pulse[0])
+                x, pulse, dro = x[1:], pulse[1:], dro[1:]
+        station.plot_buffer.extend(x, dro, pulse)
+        station.extend_history()
+        if self.plot_follow and station.dro_curve is not None:
+            plot_time, plot_dro, plot_pulse = station.plot_buffer.view()
+            station.dro_curve.setData(plot_time, plot_dro, skipFiniteCheck=True)
+            station.pulse_curve.setData(plot_time, plot_pulse, skipFiniteCheck=True)
+            if station is self.station:
+                self.set_plot_range(plot_time)
+        self.diagnostics.add("plot", started)
+
+    def set_plot_range(self, plot_time):    # Use the bounds tracked per station instead of autorange
+
+        if self.p1 is None:
+            return
+        shown = self.stations if self.plot_overlay else [self.station]
+        self.p1.setXRange(plot_time[0], plot_time[-1], padding=0)
+        self.p1.setYRange(min(s.dro_lower for s in shown), max(s.dro_upper for s in shown))
+        self.p2.setYRange(min(s.pulse_lower for s in shown), max(s.pulse_upper for s in shown))
+
+    def update_history_plot(self):          # Redraw the visible x-range at about one point per pixel
+
+        if self.plot_follow or self.p1 is None:
+            return
+        x0, x1 = self.p1.vb.viewRange()[0]
+        for station in self.stations:
+            plot_time, (plot_dro, plot_pulse) = station.plot_pyramid.query(x0, x1, max(int(self.p1.vb.width()), 100))
+            station.dro_curve.setData(plot_time, plot_dro, skipFiniteCheck=True)
+            station.pulse_curve.setData(plot_time, plot_pulse, skipFiniteCheck=True)
+
+    def update_text(self, pulse, dro, station=None):   # GUI thread only; dro in counts of 0.01 mm
+
+        if station is not None and station is not self.station:
+            return
+        started = self.diagnostics.clock()
+        changed = set_text(self.tab1_Line1Label2, str(dro/100))
+        changed |= set_text(self.tab1_Line2Label2, str(pulse))
+        if changed:
+            self.diagnostics.add("text", started)
+
+    def update_connection(self, name, connected):   # Port of a station opened or closed, from connection_update
+
+        if name == self.station.name:
+            self.update_parameters_box()
+
+    def update_parameters_box(self):        # Manual moves only on an open port, outside of programs and replays
+
+        station = self.station
+        self.tab3MiddleGroupBox.setDisabled(not station.connected or self.program_busy(station)
+                                            or station.portname.startswith("replay:"))
+
+    def program_busy(self, station=None):   # True while a program runs (on station, if given)
+
+        program = self.program
+        return (program is not None and program.state != IDLE and not program.done.is_set()
+                and (station is None or program.controller is station))
+
+    def update_program(self, row):          # Program progress, from program_update
+
+        program = self.program
+        if row >= 0:
+            for column, key in enumerate(MoveProgram.RESULT_COLUMNS):
+                self.tab4_Table1.setItem(row, column, QTableWidgetItem(str(program.results[row][key])))
+            self.tab4_ProgressBar1.setValue(program.progress[0])
+            return
+        self.update_parameters_box()
+        self.tab4_Button3.setText("Pause")
+        self.write("program %s, %d of %d moves in %.1f s" % (program.state, *program.progress, time.monotonic() - program.started))
+        if self.program_plan is not None and program.moves is self.program_moves:
+            self.write("planned against measured: %s" % self.planner().compare(self.program_plan, program.results))
+
+    def show_program(self):                 # List the loaded program, results are filled in by update_program
+
+        self.tab4_Table1.clearContents()
+        self.tab4_Table1.setRowCount(len(self.program_moves))
+        for row, move in enumerate(self.program_moves):
+            self.tab4_Table1.setItem(row, 0, QTableWidgetItem(str(row + 1)))
+            self.tab4_Table1.setItem(row, 1, QTableWidgetItem("L%s %s %s mm" % ("-" if move["direction"] in ("-", -1) else "+", move["speed"], move["distance"])))
+        self.tab4_ProgressBar1.setRange(0, len(self.program_moves))
+        self.tab4_ProgressBar1.setValue(0)
+        self.write("program loaded: %d moves" % len(self.program_moves))
+
+    def planner(self):                      # MotionPlanner from config, scaled by the calibration of the station
+
+        estimates = self.station.calibration.estimates() or {}
+        return MotionPlanner(steps_per_count=estimates.get("steps_per_count") or 1.0, **self.config["parameter"]["planner"])
+
+    def update_calibration(self, station):  # Show the calibration of the selected station
+
+        if station is not self.station:
+            return
+        estimates = station.calibration.estimates() or {}
+        for label, key, digits in ((self.tab1_Line3Label2, "steps_per_count", 4), (self.tab1_Line4Label2, "offset", 2),
+                                   (self.tab1_Line5Label2, "residual_rms", 3), (self.tab1_Line6Label2, "backlash", 2)):
+            value = estimates.get(key)
+            set_text(label, "-" if value is None else str(round(value, digits)))
+
+    def save_calibration(self):             # Persist the estimates of every station to config.json
+
+        calibration = {}
+        for station in self.stations:
+            estimates = station.calibration.estimates()
+            if estimates:
+                calibration[station.name] = dict(estimates, port=station.portname, time=datetime.now().strftime("%d%m%Y_%H%M%S"))
+        if not calibration:
+            return
+        self.config.setdefault("calibration", {}).update(calibration)
+        with open("./config/config.json", "w") as json_file:
+            json.dump(self.config, json_file, indent=4)
+
+    def update_diagnostics(self):           # Fill the Diagnostics table, only while it is shown
+
+        if self.CenterRightTabWidget.currentWidget() is not self.diagnostics_tab:
+            return
+        rows = []
+        def flatten(prefix, value):
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    flatten(prefix + "." + key if prefix else key, item)
+            else:
+                rows.append((prefix, "-" if value is None else str(value)))
+        flatten("", self.diagnostics.snapshot(self))
+
+        self.tab11_Table1.setRowCount(len(rows))
+        for row, (name, value) in enumerate(rows):
+            for column, text in enumerate((name, value)):
+                item = self.tab11_Table1.item(row, column)
+                if item is None:
+                    self.tab11_Table1.setItem(row, column, QTableWidgetItem(text))
+                elif item.text() != text:
+                    item.setText(text)
+
+    def update_moves(self):                 # Refresh the Moves table when the index of the selected station changed
+
+        if self.CenterRightTabWidget.currentWidget() is not self.moves_tab:
+            return
+        index = self.station.move_index
+        if self.moves_shown == (self.station, index.version):
+            return
+        self.moves_shown = (self.station, index.version)
+        self.tab12_Model1.refresh(index)
+        table = self.tab12_Model1.table
+        if len(table) == 0:
+            set_text(self.tab12_Label1, "-")
+            return
+        worst, longest = table[np.argmax(table["overshoot"])], table[np.argmax(table["duration"])]
+        set_text(self.tab12_Label1, "%s: %d moves, worst overshoot %d x 0.01 mm (move %d), longest %.3f s (move %d)"
+                 % (self.station.name, len(table), worst["overshoot"], worst["move"], longest["duration"], longest["move"]))
+
+    def add_station(self, portname):        # New controller with its own port, store, move counter and curves
+
+        station = Station("S%d" % (len(self.stations) + 1), portname, self)
+        if self.p1 is not None:
+            self.create_curves(station, len(self.stations))
+
+        self.stations.append(station)
+        self.station_by_name[station.name] = station
+        self.plot_updater.subscriber.max_samples = self.plot_time_frame * len(self.stations)
+        self.top_line1_comboBox1.addItem("%s: %s" % (station.name, portname))
+        self.select_station(len(self.stations) - 1)
+        return station
+
+    def create_curves(self, station, index=None):
+
+        index = self.stations.index(station) if index is None else index
+        if index:
+            color = pg.intColor(index, hues=8)
+            dro_pen = pg.mkPen(color=color, width=1, cosmetic=True)
+            pulse_pen = pg.mkPen(color=color, width=2, cosmetic=True, style=Qt.PenStyle.DashLine)
+        else:
+            dro_pen = None
+            pulse_pen = pg.mkPen(color=(51, 82, 255), width=2, cosmetic=True)
+
+        plot_time, plot_dro, plot_pulse = station.plot_buffer.view()
+        station.dro_curve = self.p1.plot(plot_time, plot_dro, pen=dro_pen)
+        station.pulse_curve = pg.PlotCurveItem(plot_time, plot_pulse, pen=pulse_pen)
+        self.p2.addItem(station.pulse_curve)
+
+    def select_station(self, index):        # Show a station in Coordinate, Parameters and Chart
+
+        self.station = self.stations[index]
+        for widget in (self.top_line1_comboBox1, self.top_line1_toggle1):
+            widget.blockSignals(True)
+        self.top_line1_comboBox1.setCurrentIndex(index)
+        self.top_line1_toggle1.setChecked(self.station.connector is not None)
+        for widget in (self.top_line1_comboBox1, self.top_line1_toggle1):
+            widget.blockSignals(False)
+        self.top_line1_lineEdit1.setText(self.station.portname)
+        self.update_parameters_box()
+        self.CoordinateGroupBox.setTitle("Coordinate (%s)" % self.station.name)
+        self.update_text(*self.station.last_text)
+        self.update_calibration(self.station)
+        self.update_curve_visibility()
+
+    def update_curve_visibility(self):
+
+        if self.p1 is None:
+            return
+        for station in self.stations:
+            shown = self.plot_overlay or station is self.station
+            station.dro_curve.setVisible(shown)
+            station.pulse_curve.setVisible(shown)
+        if self.plot_follow:
+            self.set_plot_range(self.station.plot_buffer.view()[0])
+
+    # Properties of the selected station, used by the move commands and update_data
+    @property
+    def dro_pulse_record(self):
+        return self.station.dro_pulse_record
+
+    @property
+    def record_index(self):
+        return self.station.record_index
+
+    @property
+    def record_time(self):
+        return self.station.record_time
+
+    @property
+    def ser_router(self):
+        return self.station.connector
 
     def button_clicked_main(self, action):
 
         match action:               
                 
             case "connect_router":
-                if self.connect_router == 0:
-                    self.ser_router = ComPortConnector(self.top_line1_lineEdit1.text(), 9600, self)
-                    self.threadpool.start(self.ser_router)
-                    if self.ser_router.ser:
-                        self.write("connect router")
-                        self.connect_router = 1
-                        self.tab3MiddleGroupBox.setDisabled(0)
-
-                    else:
-                        self.write("can't connect router, please try to reconnect...")
-
-                elif self.connect_router == 1:
-                    self.ser_router.running = False
-                    self.write("disconnect router")
-                    self.connect_router = 0
+                station = self.station
+                if station.connector is None:
+                    station.portname = self.top_line1_lineEdit1.text()
+                    self.top_line1_comboBox1.setItemText(self.stations.index(station), "%s: %s" % (station.name, station.portname))
+                    station.connect()                   # the Parameters box is enabled by update_connection once open
+
+                else:
+                    station.disconnect()
                     self.tab3MiddleGroupBox.setDisabled(1)
+
+            case "add_station":
+                self.add_station(self.top_line1_lineEdit1.text())
+
+            case "replay":
+                path, _ = QFileDialog.getOpenFileName(self, "Replay", "",
+                                                      "Recorded session (serial.cap index.jsonl);;Raw serial bytes (*)")
+                if not path:
+                    return
+                source = os.path.dirname(path) if os.path.basename(path) == "index.jsonl" else path
+                speed = self.top_line1_comboBox2.currentText()
+                station = self.add_station("replay:" + source)
+                station.text_update_bool = True
+                Replay(station, source, 0 if speed == "max" else float(speed.rstrip("x"))).start()
+                self.select_station(self.stations.index(station))
+
+            case "select_station":
+                self.select_station(self.top_line1_comboBox1.currentIndex())
                 
             case "X+move":
-                self.record_index[0] += 1
-                self.record_time[self.record_index[0]] = datetime.now().strftime("%d%m%Y_%H%M%S")
-                command = "L+" + self.move_command_generator() + "#"
-                self.ser_router.ser_out(command)
-                self.plot_updater.text_update_bool = True
-                self.plot_updater.plot_update_bool = True
+                self.manual_move("+")
                 
             case "X-move":
-                self.record_index[0] += 1
-                self.record_time[self.record_index[0]] = datetime.now().strftime("%d%m%Y_%H%M%S")
-                command = "L-" + self.move_command_generator() + "#"
-                self.ser_router.ser_out(command)
-                self.plot_updater.text_update_bool = True
-                self.plot_updater.plot_update_bool = True
+                self.manual_move("-")
+
+            case "plot_history":
+                self.plot_follow = False
+                self.update_history_plot()
+
+            case "plot_live":
+                self.plot_follow = True
+                for station in self.stations:
+                    plot_time, plot_dro, plot_pulse = station.plot_buffer.view()
+                    station.dro_curve.setData(plot_time, plot_dro, skipFiniteCheck=True)
+                    station.pulse_curve.setData(plot_time, plot_pulse, skipFiniteCheck=True)
+                self.set_plot_range(self.station.plot_buffer.view()[0])
+
+            case "plot_session":
+                self.plot_follow = False
+                shown = self.stations if self.plot_overlay else [self.station]
+                self.p1.setYRange(min(s.dro_lower for s in shown), max(s.dro_upper for s in shown))
+                self.p2.setYRange(min(s.pulse_lower for s in shown), max(s.pulse_upper for s in shown))
+                self.p1.setXRange(0, max(s.plot_pyramid.size for s in shown), padding=0)   # also redraws through sigXRangeChanged
+
+            case "plot_overlay":
+                self.plot_overlay = self.tab10_CheckBox1.isChecked()
+                self.update_curve_visibility()
+
+            case "program_load":
+                path, _ = QFileDialog.getOpenFileName(self, "Load move program", "", "Move program (*.csv *.json)")
+                if not path:
+                    return
+                try:
+                    self.program_moves = load_moves(path)
+                except (OSError, ValueError) as error:
+                    self.write("can't load program: %s" % error, WARNING)
+                    return
+                self.program_plan = None
+                self.show_program()
+
+            case "program_plan":
+                if self.program_busy():
+                    return
+                parameters = self.move_command_generator()
+                if parameters == "invalid":
+                    return
+                planner = self.planner()
+                counts = int(parameters[2:])
+                self.program_plan = planner.plan(counts)
+                self.program_moves = planner.moves(self.program_plan, self.tab4_ComboBox1.currentText())
+                self.show_program()
+                single = planner.table([planner.speed_for(planner.start_rate)], [counts])
+                self.write("planned %d sub-moves, predicted %.2f s (one move at the start rate %.2f s)"
+                           % (len(self.program_plan), planner.duration(self.program_plan), planner.duration(single)))
+
+            case "program_start":
+                if self.program_busy():
+                    return
+                if not self.program_moves or not self.station.connected:
+                    self.write("load a program and connect the router first", WARNING)
+                    return
+                self.program = MoveProgram(self.station, self.program_moves,
+                                           on_result=lambda program, result: self.program_update.emit(result["index"] - 1),
+                                           on_done=lambda program: self.program_update.emit(-1))
+                self.tab4_ProgressBar1.setValue(0)
+                self.tab3MiddleGroupBox.setDisabled(1)     # no manual moves in between
+                self.program.start()
+
+            case "program_pause":
+                if self.program is None:
+                    return
+                if self.program.state == PAUSED:
+                    self.program.resume()
+                    self.tab4_Button3.setText("Pause")
+                elif self.program.state == RUNNING:
+                    self.program.pause()
+                    self.tab4_Button3.setText("Resume")
+
+            case "program_abort":
+                if self.program:
+                    self.program.abort()
+
+            case "diagnostics_export":
+                path, _ = QFileDialog.getSaveFileName(self, "Export diagnostics", "diagnostics_%d.json" % self.start_time, "JSON (*.json)")
+                if path:
+                    self.diagnostics.export(self, path)
+                    self.write("diagnostics saved to " + path)
+
+            case "log_level":                   # Refill the message box from the ring
+                self.event_log.take()
+                events = self.event_log.snapshot(self.log_level)[-self.bottom_textEdit.maximumBlockCount():]
+                self.bottom_textEdit.setPlainText("\n".join(format_event(e) for e in events))
+
+            case "diagnostics_reset":
+                self.diagnostics.reset()
 
             case "Homing":
                 #To Do: Need a touch limit sensor
@@ -425,49 +945,33 @@ class WidgetGallery(QDialog):
                 lay.addWidget(content)
                 dialog.exec()
 
-    def move_command_generator(self):
+    def move_command_generator(self):       # Speed and stroke of the Parameters box, encoded by acquisition.move_parameters
         
-        match str(self.tab3_line4ComboBox1.currentText()):
-            case 'High':
-                speed = "00"
-            case 'Middle':
-                speed = "50"
-            case 'Low':
-                speed = "90"
-
-        distance = float(self.tab3_line5Edit1.text())
-        if distance<0 or distance>99:
-            print("invalid stroke: out of range")
+        try:
+            return move_parameters(str(self.tab3_line4ComboBox1.currentText()), self.tab3_line5Edit1.text())
+        except ValueError as error:
+            self.write(str(error), WARNING)
             return "invalid"
-        distance = str(int(distance*100)) #Unit of DRO is 0.01 mm, while unit of use input is 1 mm
-        match len(distance):
-            case 1:
-                distance = "000" + distance
-            case 2:
-                distance = "00" + distance
-            case 3:
-                distance = "0" + distance
-            case 4:
-                distance = distance
-
-        return speed + distance
 
-    def update_data(self):
+    def manual_move(self, direction):       # X+ / X-: nothing is sent when the Parameters box is invalid
 
-        self.df = pd.DataFrame(columns = ['DRO','Pulse','Time','No'])
-        time_series, dro_series, pulse_series, no_series = [], [], [], []
+        try:
+            command = move_command(direction, str(self.tab3_line4ComboBox1.currentText()), self.tab3_line5Edit1.text())
+        except ValueError as error:
+            self.write(str(error), WARNING)
+            return
+        self.station.send(command)
+        self.station.text_update_bool = True
 
-        for data in self.dro_pulse_record:
+    def update_data(self):
 
-            no_series.append(data[0])
-            pulse_series.append(data[2])
-            dro_series.append(data[3]/100)
-            time_series.append(data[4])
+        import pandas as pd                 # only needed here, keeps it off the startup path
+        record = self.dro_pulse_record.columns()
 
-        self.df['No'] = no_series
-        self.df['Pulse'] = pulse_series
-        self.df['DRO'] = dro_series
-        self.df['Time'] = time_series
+        self.df = pd.DataFrame({'DRO': record["dro"]/100,
+                                'Pulse': record["pulse"],
+                                'Time': record["time"]/1000,   # ms
+                                'No': record["move"]})
 
     ## Handle view resizing for plotting DRO and Pulse in the same plot
     def updateViews(self):
@@ -0,0 +1,112 @@
+#############################################################################
+#Host-side trapezoidal motion profile planner
+#The firmware steps at one period for the whole move: pulse_high_time +
+#pulse_low_time + the two-digit speed field, in us. A long stroke is split
+#into sub-moves whose speed fields follow an accelerate / cruise / decelerate
+#profile, each sub-move being an ordinary "L±SSDDDD#" command.
+#The firmware declares "uint8_t x_pulse_low_time = 300", which holds 300 % 256
+#= 44: the step period is 144-243 us, and that is what is modelled here.
+#############################################################################
+
+import numpy as np
+
+SEGMENT_DTYPE = np.dtype([("speed", "i4"),          # speed field, 0 (fast) - 99 (slow)
+                          ("counts", "i4"),         # DRO counts (0.01 mm) of the sub-move
+                          ("steps", "f8"),          # expected motor steps
+                          ("period", "f8"),         # s per step
+                          ("duration", "f8"),       # s, including the firmware start delay
+                          ("start", "f8")])         # s from the first command
+
+
+class MotionPlanner:
+
+    def __init__(self,
+        pulse_high_time=100,                # us, x_pulse_high_time of the firmware
+        pulse_low_time=44,                  # us, x_pulse_low_time of the firmware as it runs (300 in a uint8_t)
+        start_delay=0.5,                    # s, delay(500) before every (sub-)move
+        steps_per_count=1.0,                # motor steps per 0.01 mm, e.g. from the calibration
+        start_rate=4219.0,                  # steps/s the motor starts at without stalling, speed field 94
+        max_rate=6944.0,                    # steps/s the motor may reach once ramped up, speed field 0
+        acceleration=4000.0,                # steps/s^2
+        segments=8                          # sub-moves of a full profile, before merging
+        ):
+        self.pulse_high_time = pulse_high_time
+        self.pulse_low_time = pulse_low_time
+        self.start_delay = start_delay
+        self.steps_per_count = steps_per_count
+        self.start_rate = start_rate
+        self.max_rate = max_rate
+        self.acceleration = acceleration
+        self.segments = segments
+
+    def period(self, speed):                # s per step at a speed field
+        return (self.pulse_high_time + self.pulse_low_time + np.asarray(speed)) * 1e-6
+
+    def speed_for(self, rate):              # slowest speed field still reaching rate (steps/s), vectorized
+        speed = np.ceil(1e6 / np.asarray(rate, dtype=float) - self.pulse_high_time - self.pulse_low_time - 1e-9)
+        return np.clip(speed, 0, 99).astype(int)
+
+    def table(self, speeds, counts):        # segment table of sub-moves
+        segments = np.zeros(len(counts), dtype=SEGMENT_DTYPE)
+        segments["speed"] = speeds
+        segments["counts"] = counts
+        segments["steps"] = segments["counts"] * self.steps_per_count
+        segments["period"] = self.period(segments["speed"])
+        segments["duration"] = self.start_delay + segments["steps"] * segments["period"]
+        segments["start"] = np.cumsum(segments["duration"]) - segments["duration"]
+        return segments
+
+    # Segment table for a stroke of counts (0.01 mm). The ramped plan is only
+    # returned when it beats one move at the start rate, every sub-move pays
+    # the start delay of the firmware.
+    def plan(self, counts):
+        counts = int(counts)
+        single = self.table([self.speed_for(self.start_rate)], [counts])
+        n = int(min(self.segments, counts))
+        if n < 2:
+            return single
+
+        bounds = np.rint(np.linspace(0, counts, n + 1)).astype(int)
+        x = bounds * self.steps_per_count   # in steps
+        total = x[-1]
+        # v(x) = min(max_rate, sqrt(v0^2 + 2ax), sqrt(v0^2 + 2a(D-x))), lowest at a segment end
+        rate = np.minimum.reduce([np.full_like(x, self.max_rate, dtype=float),
+                                  np.sqrt(self.start_rate**2 + 2*self.acceleration*x),
+                                  np.sqrt(self.start_rate**2 + 2*self.acceleration*(total - x))])
+        speeds = self.speed_for(np.minimum(rate[:-1], rate[1:]))
+        lengths = np.diff(bounds)
+
+        # Merge neighbours with the same speed field, one command each
+        starts = np.flatnonzero(np.r_[True, speeds[1:] != speeds[:-1]])
+        merged = np.add.reduceat(lengths, starts)
+        ramped = self.table(speeds[starts], merged)
+        return ramped if ramped["duration"].sum() < single["duration"].sum() else single
+
+    @staticmethod
+    def duration(segments):                 # predicted s for the whole stroke
+        return float(segments["duration"].sum())
+
+    @staticmethod
+    def moves(segments, direction):         # MoveProgram moves, the commands are encoded here
+        sign = "-" if direction in ("-", -1) else "+"
+        return [{"direction": sign, "speed": int(s["speed"]), "distance": int(s["counts"]) / 100, "dwell": 0,
+                 "command": "L%s%02d%04d#" % (sign, s["speed"], s["counts"])} for s in segments]
+
+    # Predicted against measured, per sub-move and in total. results are the
+    # MoveProgram results of the planned moves: duration is command to RF,
+    # stepping is first RR to RF from the sample timestamps.
+    def compare(self, segments, results):
+        n = min(len(segments), len(results))
+        measured = np.array([r["duration"] for r in results[:n]], dtype=float)
+        stepping = np.array([r["stepping"] for r in results[:n]], dtype=float)
+        pulses = np.array([abs(r["end_pulse"] - r["start_pulse"]) for r in results[:n]], dtype=float)
+        predicted = segments["duration"][:n]
+        return {
+            "predicted": round(float(predicted.sum()), 4),
+            "measured": round(float(measured.sum()), 4),
+            "error": round(float(measured.sum() - predicted.sum()), 4),
+            "stepping_predicted": round(float((segments["steps"][:n] * segments["period"][:n]).sum()), 4),
+            "stepping_measured": round(float(stepping.sum()), 4),
+            "lost_steps": round(float((pulses - segments["steps"][:n]).sum()), 1),   # pulses beyond the expected steps
+            "segments": n,
+        }
@@ -0,0 +1,130 @@
+#############################################################################
+#Per-move summary index, kept up to date as the samples arrive
+#One row per move number, so move-level questions (worst overshoot, slowest
+#move, ...) never scan the samples: the connector updates the row of the
+#current move with each stored batch, O(1) per sample.
+#############################################################################
+
+import threading
+import numpy as np
+
+from frame_parser import STATUS_FINISH
+
+SUMMARY_DTYPE = np.dtype([("move", "u4"),
+                          ("direction", "i1"),      # +1 L+, -1 L-, 0 unknown (samples before the first command)
+                          ("speed", "i2"),          # speed field of the command, -1 unknown
+                          ("distance", "i4"),       # commanded stroke, DRO counts (0.01 mm), -1 unknown
+                          ("start_pulse", "i4"),    # before the command, else the first sample
+                          ("end_pulse", "i4"),
+                          ("start_dro", "i4"),
+                          ("end_dro", "i4"),
+                          ("min_dro", "i4"),
+                          ("max_dro", "i4"),
+                          ("start_time", "i8"),     # us since the session start
+                          ("end_time", "i8"),
+                          ("samples", "u4"),
+                          ("first", "i8"),          # global index of the first sample in the SampleStore
+                          ("last", "i8"),           # global index of the last sample
+                          ("finished", "?"),        # RF received
+                          ("commanded", "?")])      # start values are from the sample before the command
+
+# Columns of table(): the stored ones plus these, computed per query
+DERIVED = ("overshoot", "error", "duration")
+
+
+class MoveIndex:
+
+    def __init__(self, capacity=1024):
+        self.lock = threading.Lock()
+        self.rows = np.zeros(capacity, dtype=SUMMARY_DTYPE)
+        self.count = 0                      # rows in use: highest move number + 1
+        self.version = 0                    # changes with every update, for views to skip refreshes
+
+    def _row(self, move):                   # row of a move, the table grows by doubling
+        if move >= len(self.rows):
+            rows = np.zeros(max(move + 1, 2 * len(self.rows)), dtype=SUMMARY_DTYPE)
+            rows[:self.count] = self.rows[:self.count]
+            self.rows = rows
+        if move >= self.count:
+            self.rows["move"][self.count:move + 1] = np.arange(self.count, move + 1)
+            self.rows["speed"][self.count:move + 1] = -1
+            self.rows["distance"][self.count:move + 1] = -1
+            self.count = move + 1
+        return self.rows[move]
+
+    # A command was sent, command: "L±SSDDDD#", last: SampleStore.last() before it
+    def begin(self, move, direction, command=None, last=None):
+        with self.lock:
+            row = self._row(move)
+            self.version += 1
+            row["direction"] = direction
+            if last is not None:
+                row["start_pulse"], row["start_dro"] = last[2], last[3]
+                row["commanded"] = True
+            if command and len(command) >= 8 and command[2:8].isdigit():
+                row["speed"] = int(command[2:4])
+                row["distance"] = int(command[4:8])
+
+    # records: SAMPLE_DTYPE batch of one move just stored, end: SampleStore.total
+    # after storing it; with replace_last its first record replaced the newest sample
+    def update(self, records, replace_last, end):
+        n = len(records)
+        if n == 0:
+            return
+        with self.lock:
+            row = self._row(int(records["move"][0]))
+            self.version += 1
+            dro = records["dro"]
+            low, high = int(dro.min()), int(dro.max())
+            if row["samples"] == 0 or (replace_last and row["samples"] == 1):
+                if not row["commanded"]:
+                    row["start_pulse"], row["start_dro"] = records["pulse"][0], dro[0]
+                row["start_time"], row["first"] = records["time"][0], end - n
+                row["min_dro"] = min(low, int(row["start_dro"]))
+                row["max_dro"] = max(high, int(row["start_dro"]))
+                row["samples"] = 0
+            else:
+                row["min_dro"] = min(int(row["min_dro"]), low)
+                row["max_dro"] = max(int(row["max_dro"]), high)
+                if replace_last:
+                    row["samples"] -= 1
+            row["samples"] += n
+            row["end_pulse"], row["end_dro"] = records["pulse"][-1], dro[-1]
+            row["end_time"], row["last"] = records["time"][-1], end - 1
+            if (records["status"] == STATUS_FINISH).any():
+                row["finished"] = True
+
+    def __len__(self):
+        return self.count
+
+    def row(self, move):                    # summary of one move as a dict, None if unknown
+        table = self.table(move, move + 1)
+        return {name: table[name][0].item() for name in table.dtype.names} if len(table) else None
+
+    # Rows [start, end) with samples, as a new structured array with the DERIVED columns:
+    #   overshoot  DRO travel past the commanded stroke at the peak, counted in the
+    #              direction the DRO moved (the command direction if it ended where it began)
+    #   error      DRO travel at the end minus the commanded stroke, as in MoveProgram
+    #   duration   s from the first to the last sample
+    def table(self, start=0, end=None):
+        with self.lock:
+            rows = self.rows[start:self.count if end is None else min(end, self.count)]
+            rows = rows[rows["samples"] > 0]
+        dtype = np.dtype(SUMMARY_DTYPE.descr + [("overshoot", "i4"), ("error", "i4"), ("duration", "f8")])
+        table = np.zeros(len(rows), dtype=dtype)
+        for name in SUMMARY_DTYPE.names:
+            table[name] = rows[name]
+        known = rows["distance"] >= 0
+        start_dro = rows["start_dro"].astype(np.int64)
+        travel = rows["end_dro"] - start_dro
+        sign = np.where(travel != 0, np.sign(travel), rows["direction"])
+        peak = np.where(sign < 0, start_dro - rows["min_dro"], rows["max_dro"] - start_dro)
+        table["overshoot"] = np.where(known, peak - rows["distance"], 0)
+        table["error"] = np.where(known, np.abs(travel) - rows["distance"], 0)
+        table["duration"] = (rows["end_time"] - rows["start_time"]) / 1e6
+        return table
+
+    def worst(self, column="overshoot", n=10):  # the n moves with the largest value of a column
+        table = self.table()
+        order = np.argsort(table[column], kind="stable")[::-1][:n]
+        return table[order]
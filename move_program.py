@@ -0,0 +1,123 @@
+#############################################################################
+#Move programs: a sequence of moves dispatched back to back on one controller
+#############################################################################
+
+import time
+import threading
+
+from acquisition import move_command
+
+IDLE, RUNNING, PAUSED, ABORTED, DONE = "idle", "running", "paused", "aborted", "done"
+
+
+#Runs on the engine thread of the controller: the next command is sent from
+#the finish callback of the previous move (after its dwell, scheduled on the
+#event loop), so no GUI round trip or polling sits between two moves.
+#moves: list of {direction, speed, distance, dwell} as from acquisition.load_moves,
+#a "command" entry (e.g. from motion_planner) is sent as it is.
+#on_result(runner, result) is called on the engine thread after every move,
+#on_done(runner) once the program is done or aborted.
+class MoveProgram:
+
+    RESULT_COLUMNS = ("index", "command", "move", "start_pulse", "end_pulse", "start_dro", "end_dro",
+                      "error", "duration", "stepping", "samples")
+
+    def __init__(self, controller, moves, on_result=None, on_done=None):
+        self.controller = controller
+        self.engine = controller.owner.engine
+        self.moves = moves
+        self.commands = [m.get("command") or move_command(m["direction"], m["speed"], m["distance"]) for m in moves]  # validates
+        self.on_result = on_result
+        self.on_done = on_done
+        self.results = []                   # one dict per finished move
+        self.state = IDLE
+        self.current = None                 # [index, move number, sent time, start sample] of the move in progress
+        self.dwell = None                   # asyncio handle of the dwell after the last move, while it runs
+        self.done = threading.Event()
+        self.started = None
+
+    @property
+    def progress(self):                     # finished moves, total moves
+        return len(self.results), len(self.moves)
+
+    def start(self):
+        self.started = time.monotonic()
+        self.state = RUNNING
+        self.controller.on_finish = self.finished
+        self.engine.call(self.dispatch)
+
+    def pause(self):                        # the move in progress still completes
+        if self.state == RUNNING:
+            self.state = PAUSED
+
+    def resume(self):                       # a dwell still running is waited out, the next move follows it
+        if self.state == PAUSED:
+            self.state = RUNNING
+            self.engine.call(self.dispatch)
+
+    def abort(self):                        # no further commands; the firmware has no stop command
+        if self.state in (IDLE, RUNNING, PAUSED):
+            self.state = ABORTED
+            self.engine.call(self.dispatch)
+
+    def wait(self, timeout=None):           # True once the program is done or aborted
+        return self.done.wait(timeout)
+
+    def dispatch(self):                     # Send the next move if the program may go on
+        if self.current is not None or self.done.is_set():
+            return
+        if self.dwell is not None:
+            if self.state != ABORTED:
+                return                      # end_dwell() dispatches
+            self.dwell.cancel()
+            self.dwell = None
+        index = len(self.results)
+        if self.state == ABORTED or index == len(self.moves):
+            if self.state != ABORTED:
+                self.state = DONE
+            self.controller.on_finish = None
+            self.done.set()
+            if self.on_done:
+                self.on_done(self)
+            return
+        if self.state != RUNNING or not self.controller.connected:
+            return
+        start = self.controller.dro_pulse_record.last()
+        self.current = [index, None, time.monotonic(), start]
+        self.current[1] = self.controller.send(self.commands[index])
+
+    def finished(self, move):               # Finish callback of the controller, engine thread
+        if self.current is None or move != self.current[1]:
+            return
+        index, move, sent, start = self.current
+        samples = self.controller.dro_pulse_record.move(move)
+        start_pulse, start_dro = (start[2], start[3]) if start else (0, 0)
+        end_pulse = int(samples["pulse"][-1]) if len(samples["pulse"]) else start_pulse
+        end_dro = int(samples["dro"][-1]) if len(samples["dro"]) else start_dro
+        target = int(self.commands[index][4:8])
+        result = {
+            "index": index + 1,
+            "command": self.commands[index],
+            "move": move,
+            "start_pulse": start_pulse,
+            "end_pulse": end_pulse,
+            "start_dro": start_dro,
+            "end_dro": end_dro,
+            "error": abs(end_dro - start_dro) - target,     # DRO counts past the commanded stroke
+            "duration": round(time.monotonic() - sent, 4), # s, command to RF, includes the firmware start delay
+            "stepping": (int(samples["time"][-1]) - int(samples["time"][0])) / 1e6 if len(samples["time"]) else 0.0,   # s, first RR to RF
+            "samples": len(samples["pulse"]),
+        }
+        self.results.append(result)
+        self.current = None
+        if self.on_result:
+            self.on_result(self, result)
+        dwell = self.moves[index].get("dwell") or 0
+        if dwell:
+            self.dwell = self.engine.loop.call_later(dwell, self.end_dwell)
+        else:
+            self.dispatch()
+
+    def end_dwell(self):
+        self.dwell = None
+        self.dispatch()
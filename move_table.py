@@ -0,0 +1,60 @@
+#############################################################################
+#Sortable view of the per-move summary index (move_index.py)
+#The model holds a snapshot of MoveIndex.table() and a sort order from one
+#argsort, so refreshing and sorting cost the same for 10 or 10000 moves;
+#the view only asks for the cells on screen.
+#############################################################################
+
+import numpy as np
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+COLUMNS = ("move", "direction", "speed", "distance", "start_pulse", "end_pulse", "start_dro", "end_dro",
+           "overshoot", "error", "duration", "samples", "first", "last", "finished")
+
+
+class MoveTableModel(QAbstractTableModel):
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.table = None                   # MoveIndex.table() of the last refresh
+        self.order = np.empty(0, dtype=int) # row of table shown at each view row
+        self.sort_column = 0
+        self.sort_order = Qt.SortOrder.AscendingOrder
+
+    def refresh(self, index):               # Take a new snapshot of a MoveIndex, keeping the sort
+        self.beginResetModel()
+        self.table = index.table()
+        self.order = self.sorted_order()
+        self.endResetModel()
+
+    def sorted_order(self):
+        if self.table is None:
+            return np.empty(0, dtype=int)
+        order = np.argsort(self.table[COLUMNS[self.sort_column]], kind="stable")
+        return order[::-1] if self.sort_order == Qt.SortOrder.DescendingOrder else order
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.order)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole or not index.isValid():
+            return None
+        value = self.table[COLUMNS[index.column()]][self.order[index.row()]].item()
+        return "%.3f" % value if isinstance(value, float) else str(value)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return COLUMNS[section]
+        return None
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        self.sort_column, self.sort_order = column, order
+        self.order = self.sorted_order()
+        self.layoutChanged.emit()
+
+    def move_at(self, row):                 # move number shown at a view row
+        return int(self.table["move"][self.order[row]])
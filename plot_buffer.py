@@ -0,0 +1,56 @@
+#############################################################################
+#Fixed-capacity circular buffer feeding the real-time chart
+#############################################################################
+
+import numpy as np
+
+
+#Every sample is written twice, at i and i + capacity, so the latest window
+#is always one contiguous slice and can be handed to setData without a copy
+class PlotRingBuffer:
+
+    def __init__(self, capacity, columns=3, dtype=float):
+        self.capacity = int(capacity)
+        self.columns = columns
+        self.buffer = np.zeros((columns, 2 * self.capacity), dtype=dtype)
+        self.head = 0                       # position of the next write
+        self.size = 0                       # number of valid samples, up to capacity
+        self.count = 0                      # total samples written since creation
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+        self.count = 0
+
+    # Append a batch, one array per column, only the last capacity samples are kept
+    def extend(self, *values):
+        values = np.vstack([np.atleast_1d(v) for v in values]).astype(self.buffer.dtype, copy=False)
+        k = values.shape[1]
+        if k == 0:
+            return
+        self.count += k
+        if k > self.capacity:
+            values = values[:, -self.capacity:]
+            k = self.capacity
+
+        cap, head = self.capacity, self.head
+        first = min(k, cap - head)
+        self.buffer[:, head:head + first] = values[:, :first]
+        self.buffer[:, head + cap:head + cap + first] = values[:, :first]
+        rest = k - first
+        if rest:
+            self.buffer[:, :rest] = values[:, first:]
+            self.buffer[:, cap:cap + rest] = values[:, first:]
+
+        self.head = (head + k) % cap
+        self.size = min(self.size + k, cap)
+
+    def replace_last(self, *values):        # Overwrite the newest sample, e.g. when RF replaces the last RR
+        if self.size:
+            last = (self.head - 1) % self.capacity
+            self.buffer[:, last] = self.buffer[:, last + self.capacity] = values
+
+    # Contiguous view (columns x size) of the samples in chronological order
+    def view(self):
+        end = self.head + self.capacity
+        return self.buffer[:, end - self.size:end]
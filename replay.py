@@ -0,0 +1,191 @@
+#############################################################################
+#Session replay through the live pipeline
+#Recorded serial traffic or samples are fed to ComPortConnector.ser_in on the
+#engine thread, so parsing, storage, the SampleBus, PlotUpdater and the
+#display see exactly what they see from a controller.
+#
+#   python replay.py record/1729000000000/S1/serial.cap --speed 10
+#   python replay.py record/1729000000000/S1 --speed max
+#############################################################################
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import argparse
+import numpy as np
+
+from frame_parser import STATUS_FINISH
+from session_recorder import SessionReader
+from acquisition import ComPortConnector, Acquisition, CAPTURE_NAME, CAPTURE_HEADER
+from event_log import WARNING, ERROR
+
+CHUNK = 64                                  # bytes per event of a raw byte dump
+COALESCE = 65536                            # bytes handed to ser_in at once when replaying as fast as possible
+
+
+# Events (time in s, "rx" bytes | "tx" (direction, command)) of a capture written by ComPortConnector
+def capture_events(path):
+    with open(path, "rb") as capture_file:
+        data = capture_file.read()
+    offset = 0
+    while offset + CAPTURE_HEADER.size <= len(data):
+        t, kind, length = CAPTURE_HEADER.unpack_from(data, offset)
+        offset += CAPTURE_HEADER.size
+        payload = data[offset:offset + length]
+        offset += length
+        if kind == b"R":
+            yield t, "rx", payload
+        else:                               # one event per move command of the write
+            for command in payload.split(b"#"):
+                if command[:1] == b"L":
+                    yield t, "tx", (-1 if command[1:2] == b"-" else 1, command.decode(errors="replace") + "#")
+
+
+# Events of a plain dump of received bytes, timed by the baud rate (10 bits a byte)
+def raw_events(path, baudrate):
+    with open(path, "rb") as raw_file:
+        data = raw_file.read()
+    for offset in range(0, len(data), CHUNK):
+        yield offset * 10 / baudrate, "rx", data[offset:offset + CHUNK]
+
+
+# Events of a SessionRecorder directory: samples are encoded back to ASCII frames,
+# one event per move and millisecond, without the us counter of the controller. An RF sample replaced the RR before it,
+# so it is preceded by a copy of itself as RR for ser_in to replace.
+def session_events(directory):
+    reader = SessionReader(directory)
+    start, pulse = None, 0
+    for move in reader.moves():
+        records = reader.move(move)
+        if len(records) == 0:
+            continue
+        if start is None:
+            start = int(records["time"][0])
+        if move:                            # samples before the first command belong to move 0
+            direction = -1 if int(records["pulse"][-1]) < pulse else 1
+            yield (int(records["time"][0]) - start) / 1e6, "tx", (direction, None)
+        pulse = int(records["pulse"][-1])
+        bounds = np.flatnonzero(np.diff(records["time"] // 1000)) + 1
+        for group in np.split(records, bounds):
+            frames = []
+            for status, p, d in zip(group["status"].tolist(), group["pulse"].tolist(), group["dro"].tolist()):
+                if status == STATUS_FINISH:
+                    frames.append("RR%d;%d!RF%d;%d!" % (p, d, p, d))
+                else:
+                    frames.append("RR%d;%d!" % (p, d))
+            yield (int(group["time"][-1]) - start) / 1e6, "rx", "".join(frames).encode()
+
+
+def events(source, baudrate=9600):          # Pick the reader from the kind of source
+    if os.path.isdir(source):
+        if os.path.exists(os.path.join(source, CAPTURE_NAME)):
+            return capture_events(os.path.join(source, CAPTURE_NAME))
+        return session_events(source)
+    if source.endswith(".cap"):
+        return capture_events(source)
+    return raw_events(source, baudrate)
+
+
+#Plays a source into a controller. speed: 1 real time, N for N times faster,
+#0 (or None) as fast as possible. Served by the engine like a port, so
+#Controller.disconnect() stops it; wait() returns the report.
+class Replay:
+
+    def __init__(self, controller, source, speed=1.0):
+        self.controller = controller
+        self.source = source
+        self.speed = speed or 0
+        self.connector = ComPortConnector("replay:" + source, controller.parameter["baudrate"], controller, controller.owner.engine)
+        self.done = threading.Event()
+        self.report = None
+
+    def start(self):
+        self.controller.connector = self.connector
+        self.controller.owner.engine.attach(self.connector, self.run)
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.report
+
+    async def run(self, connector):
+        controller, engine = self.controller, self.controller.owner.engine
+        diagnostics = controller.diagnostics
+        connector.running = True            # no port, ser_in is fed directly
+        connector.opened.set()
+        samples_before, frames_before = len(controller.dro_pulse_record), connector.parser.frames
+        received, begin, last = 0, time.monotonic(), 0.0
+        origin = time.monotonic_ns()        # samples are timed as recorded, whatever the speed
+        pending = []                        # (t, rx data) not parsed yet, more than one chunk only at max speed
+
+        def feed():
+            data = b"".join(chunk for _, chunk in pending)
+            if data:
+                connector.ser_in(data, origin + int(pending[-1][0] * 1e9))
+            pending.clear()
+            return len(data)
+
+        try:
+            source = events(self.source, connector.baudrate)
+            while True:
+                started = diagnostics.clock()   # "read": getting the next event from the capture or segments
+                event = next(source, None)
+                if event is None:
+                    break
+                t, kind, data = event
+                if kind == "rx":
+                    diagnostics.add("read", started, len(data))
+                last = t
+                if self.speed:
+                    wait = begin + t / self.speed - time.monotonic()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                if kind == "rx":
+                    pending.append((t, data))
+                    if self.speed or sum(len(chunk) for _, chunk in pending) >= COALESCE:
+                        received += feed()
+                    continue
+                received += feed()          # samples of a move are stored under its own number
+                connector.expect(data[1], controller.register_move(*data))
+                await asyncio.sleep(0)      # let other links and the display in between moves
+            received += feed()
+        except asyncio.CancelledError:
+            controller.write("replay stopped", WARNING)
+        except (OSError, ValueError) as error:
+            controller.write("can't replay %s: %s" % (self.source, error), ERROR)
+        finally:
+            elapsed = max(time.monotonic() - begin, 1e-9)
+            samples = len(controller.dro_pulse_record) - samples_before
+            self.report = {
+                "source": self.source,
+                "speed": self.speed or "max",
+                "seconds": round(elapsed, 3),
+                "recorded_seconds": round(last, 3),
+                "realtime_factor": round(last / elapsed, 2),
+                "bytes": received,
+                "frames": connector.parser.frames - frames_before,
+                "samples": samples,
+                "samples_per_second": round(samples / elapsed, 1),
+                "bytes_per_second": round(received / elapsed, 1),
+            }
+            connector.close()
+            engine.tasks.pop(connector, None)
+            controller.write("replay: %s" % json.dumps(self.report))
+            self.done.set()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Replay a capture, raw dump or recorded session without the UI")
+    parser.add_argument("source", help="serial.cap, raw byte dump or SessionRecorder directory")
+    parser.add_argument("--speed", default="max", help="1 for real time, N for N times faster, max")
+    parser.add_argument("--baud", type=int, default=9600, help="timing of raw byte dumps")
+    args = parser.parse_args()
+
+    with Acquisition({"record_path": "", "baudrate": args.baud}, log=lambda text: None) as acquisition:
+        replay = Replay(acquisition.add("replay"), args.source, 0 if args.speed == "max" else float(args.speed))
+        replay.start()
+        print(json.dumps(replay.wait()))
+    sys.exit(0)
@@ -0,0 +1,127 @@
+#############################################################################
+#Publish/subscribe bus distributing the parsed samples to every consumer
+#############################################################################
+
+import time
+import threading
+from collections import deque, namedtuple
+
+# records: SAMPLE_DTYPE array shared by every subscriber (never copied by the bus)
+# replace_last: the first record replaces the last record of the previous batch (RF frame)
+# source: name of the station (controller) that produced the samples
+# time: time.perf_counter() when published, to measure the delivery latency
+# index: global SampleStore index of the first record, None if not stored
+Batch = namedtuple("Batch", "records replace_last source time index", defaults=(None, None, None))
+
+DROP_OLDEST = "drop_oldest"                 # keep the newest max_samples samples
+COALESCE = "coalesce"                       # keep only the newest sample
+
+
+def skip(index, n):                         # store index of a batch once its first n records are dropped
+    return None if index is None else index + n
+
+
+#Each subscriber has its own queue of batches, so a slow one never holds up
+#the publisher or the other subscribers
+class Subscriber:
+
+    def __init__(self, bus, name, max_samples=None, overflow=DROP_OLDEST, source=None, notify=None):
+        self.bus = bus
+        self.name = name
+        self.notify = notify                # called when samples arrive in the empty queue, e.g. a Qt signal emit
+        self.source = source                # only receive batches of this station, None for all
+        self.max_samples = max_samples      # None keeps everything (e.g. the recorder)
+        self.overflow = overflow
+        self.condition = threading.Condition()
+        self.batches = deque()
+        self.pending = 0                    # samples queued, i.e. the lag behind the publisher
+        self.received = 0                   # samples handed over by get()
+        self.dropped = 0                    # samples lost to the overflow policy
+        self.closed = False
+
+    def put(self, batch):
+        if self.source is not None and batch.source != self.source:
+            return
+        with self.condition:
+            if self.closed:
+                return
+            was_empty = not self.batches
+            self.batches.append(batch)
+            self.pending += len(batch.records)
+            if self.max_samples is not None and self.pending > self.max_samples:
+                self.trim()
+            self.condition.notify()
+        if was_empty and self.notify:       # once per get(), outside the lock
+            self.notify()
+
+    def trim(self):
+        if self.overflow == COALESCE:
+            newest = self.batches[-1]
+            self.dropped += self.pending - 1
+            self.batches.clear()
+            self.batches.append(newest._replace(records=newest.records[-1:], replace_last=False,
+                                                index=skip(newest.index, len(newest.records) - 1)))
+            self.pending = 1
+            return
+        while self.pending > self.max_samples:
+            extra = self.pending - self.max_samples
+            records = self.batches[0].records
+            if len(records) <= extra:
+                self.batches.popleft()
+                self.pending -= len(records)
+                self.dropped += len(records)
+            else:                           # keep the tail of the oldest batch, a slice not a copy
+                self.batches[0] = self.batches[0]._replace(records=records[extra:], replace_last=False,
+                                                           index=skip(self.batches[0].index, extra))
+                self.pending -= extra
+                self.dropped += extra
+
+    # Wait until samples arrive (timeout in seconds, None waits forever), then
+    # return every queued batch. Returns an empty list on timeout or once closed.
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.batches and not self.closed:
+                self.condition.wait(timeout)
+            batches = list(self.batches)
+            self.batches.clear()
+            self.received += self.pending
+            self.pending = 0
+            return batches
+
+    def close(self):                        # wake up a blocked get() for good
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.bus.unsubscribe(self)
+
+    def stats(self):
+        return {"lag": self.pending, "received": self.received, "dropped": self.dropped}
+
+
+class SampleBus:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.published = 0
+
+    def subscribe(self, name, max_samples=None, overflow=DROP_OLDEST, source=None, notify=None):
+        subscriber = Subscriber(self, name, max_samples, overflow, source, notify)
+        with self.lock:
+            self.subscribers = self.subscribers + [subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s is not subscriber]
+
+    def publish(self, records, replace_last=False, source=None, index=None):
+        if len(records) == 0:
+            return
+        batch = Batch(records, replace_last, source, time.perf_counter(), index)
+        self.published += len(records)
+        for subscriber in self.subscribers:   # copy-on-write list, no lock needed here
+            subscriber.put(batch)
+
+    def stats(self):                        # lag and drop counters of every subscriber
+        return {s.name: s.stats() for s in self.subscribers}
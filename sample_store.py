@@ -0,0 +1,166 @@
+#############################################################################
+#Thread-safe columnar store for the samples collected during a session
+#############################################################################
+
+import threading
+from collections import deque
+import numpy as np
+
+# Columns of one sample: move number, status code, pulse, DRO (0.01 mm) and time
+# (us since the session start, see frame_clock.py)
+SAMPLE_DTYPE = np.dtype([("move", "u4"), ("status", "i1"), ("pulse", "i4"), ("dro", "i4"), ("time", "i8")])
+COLUMNS = SAMPLE_DTYPE.names
+
+
+def to_records(move, status, pulse, dro, time):     # Pack columns (or scalars) into SAMPLE_DTYPE records
+    values = np.broadcast_arrays(move, status, pulse, dro, time)
+    records = np.empty(values[0].size, dtype=SAMPLE_DTYPE)
+    for name, v in zip(COLUMNS, values):
+        records[name] = v.reshape(-1)
+    return records
+
+
+#Samples live in fixed-size chunks, one typed array per column. Appending never
+#copies old data, and the oldest chunks are dropped once capacity is reached.
+#Every sample keeps a global index (0 for the first sample of the session),
+#which readers use as a cursor.
+class SampleStore:
+
+    def __init__(self, capacity=2000000, chunk_size=65536):
+        self.chunk_size = int(chunk_size)
+        self.max_chunks = max(2, -(-int(capacity) // self.chunk_size))
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.chunks = deque()
+            self.first_chunk = 0            # global chunk number of chunks[0]
+            self.total = 0                  # samples appended since the session started
+            self.moves = {}                 # move number -> [first index, end index]
+
+    def __len__(self):                      # number of samples still held in memory
+        return self.total - self.first
+
+    @property
+    def first(self):                        # global index of the oldest sample held
+        return self.first_chunk * self.chunk_size
+
+    def _new_chunk(self):
+        self.chunks.append({name: np.empty(self.chunk_size, dtype=SAMPLE_DTYPE[name]) for name in COLUMNS})
+        if len(self.chunks) > self.max_chunks:
+            self.chunks.popleft()
+            self.first_chunk += 1
+            first = self.first
+            for move in [m for m, (_, end) in self.moves.items() if end <= first]:
+                del self.moves[move]
+
+    def _index_move(self, move, start, end):
+        span = self.moves.get(move)
+        if span is None:
+            self.moves[move] = [start, end]
+        else:
+            span[1] = end
+
+    # Append a batch of samples, scalars are broadcast over the batch
+    def extend(self, move, status, pulse, dro, time):
+        values = np.broadcast_arrays(move, status, pulse, dro, time)
+        n = values[0].size
+        if n == 0:
+            return
+        values = [v.reshape(-1) for v in values]
+        with self.lock:
+            done = 0
+            while done < n:
+                offset = self.total % self.chunk_size
+                if offset == 0:
+                    self._new_chunk()
+                chunk = self.chunks[-1]
+                k = min(n - done, self.chunk_size - offset)
+                for name, v in zip(COLUMNS, values):
+                    chunk[name][offset:offset + k] = v[done:done + k]
+                self.total += k
+                done += k
+            start = self.total - n
+            moves = values[0]
+            if moves[0] == moves[-1]:           # usual case, the whole batch belongs to one move
+                self._index_move(int(moves[0]), start, self.total)
+            else:
+                for move_no in np.unique(moves).tolist():
+                    idx = np.flatnonzero(moves == move_no)
+                    self._index_move(move_no, start + int(idx[0]), start + int(idx[-1]) + 1)
+
+    def extend_records(self, records):     # Append a SAMPLE_DTYPE array
+        self.extend(*(records[name] for name in COLUMNS))
+
+    def append(self, move, status, pulse, dro, time):
+        self.extend(move, status, pulse, dro, time)
+
+    # Overwrite the newest sample in place, e.g. when RF replaces the last RR
+    def replace_last(self, move, status, pulse, dro, time):
+        with self.lock:
+            if self.total == self.first:
+                empty = True
+            else:
+                empty = False
+                last = self.total - 1
+                chunk = self.chunks[-1]             # the newest sample is always in the newest chunk
+                offset = last % self.chunk_size
+                old_move = int(chunk["move"][offset])
+                for name, v in zip(COLUMNS, (move, status, pulse, dro, time)):
+                    chunk[name][offset] = v
+                if old_move != move:
+                    span = self.moves[old_move]
+                    span[1] -= 1
+                    if span[1] <= span[0]:
+                        del self.moves[old_move]
+                    self._index_move(move, last, last + 1)
+        if empty:
+            self.extend(move, status, pulse, dro, time)
+
+    # Columns of the samples [start, end), a view when they sit in one chunk
+    def _range(self, start, end):
+        start = max(start, self.first)
+        end = min(end, self.total)
+        if end <= start:
+            return {name: np.empty(0, dtype=SAMPLE_DTYPE[name]) for name in COLUMNS}
+        first_chunk = start // self.chunk_size - self.first_chunk
+        last_chunk = (end - 1) // self.chunk_size - self.first_chunk
+        a, b = start % self.chunk_size, (end - 1) % self.chunk_size + 1
+        if first_chunk == last_chunk:
+            chunk = self.chunks[first_chunk]
+            return {name: chunk[name][a:b] for name in COLUMNS}
+        parts = [self.chunks[first_chunk]] + [self.chunks[k] for k in range(first_chunk + 1, last_chunk)]
+        result = {}
+        for name in COLUMNS:
+            pieces = [parts[0][name][a:]] + [c[name] for c in parts[1:]] + [self.chunks[last_chunk][name][:b]]
+            result[name] = np.concatenate(pieces)
+        return result
+
+    def range(self, start, end):
+        with self.lock:
+            return self._range(start, end)
+
+    def latest(self, n):                    # the newest n samples
+        with self.lock:
+            return self._range(self.total - n, self.total)
+
+    def move(self, move):                   # all samples of one move
+        with self.lock:
+            span = self.moves.get(move)
+            return self._range(*span) if span else self._range(0, 0)
+
+    def since(self, cursor):                # samples after a reader's cursor, and the new cursor
+        with self.lock:
+            return self._range(cursor, self.total), self.total
+
+    def columns(self):                      # every sample still held in memory
+        with self.lock:
+            return self._range(self.first, self.total)
+
+    def last(self):                         # newest sample as a tuple, None when empty
+        with self.lock:
+            if self.total == self.first:
+                return None
+            offset = (self.total - 1) % self.chunk_size
+            return tuple(self.chunks[-1][name][offset].item() for name in COLUMNS)
@@ -0,0 +1,192 @@
+#############################################################################
+#Append-only recorder streaming the session samples to disk
+#Layout of a session directory:
+#   segment_00000.bin ... fixed-size SAMPLE_DTYPE records, rolled over every segment_records
+#   index.jsonl           {"time_unit": "us"} first, then one line per move time stamp
+#                         and per written span of a move (no time_unit: times in ms)
+#############################################################################
+
+import os
+import json
+import threading
+import queue as Queue
+import numpy as np
+
+from sample_store import SAMPLE_DTYPE
+
+RECORD_SIZE = SAMPLE_DTYPE.itemsize
+TIME_UNIT = "us"                            # of the "time" column, older sessions were recorded in ms
+
+
+def segment_name(number):
+    return "segment_%05d.bin" % number
+
+
+#Thread writing the samples in batches, fed by a SampleBus subscriber so the
+#acquisition thread never waits for the disk
+class SessionRecorder(threading.Thread):
+
+    def __init__(self, directory, subscriber, segment_records=1048576, flush_interval=0.2):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.subscriber = subscriber        # should keep every sample (max_samples=None)
+        self.segment_records = int(segment_records)
+        self.flush_interval = flush_interval
+        self.markq = Queue.Queue()
+        self.running = True
+        self.written = 0                    # samples written since the session started
+        os.makedirs(directory, exist_ok=True)
+
+        self.segment = -1
+        self.segment_count = 0
+        self.segment_file = None
+        self.last_record = None             # (segment, byte offset) of the newest record on disk, for RF
+        self.index_file = open(os.path.join(directory, "index.jsonl"), "a")
+        if self.index_file.tell() == 0:
+            self.index_file.write(json.dumps({"time_unit": TIME_UNIT}) + "\n")
+
+    def mark_move(self, move, record_time):    # record_time is the string kept in WidgetGallery.record_time
+        self.markq.put({"move": move, "time": record_time})
+
+    def stop(self):
+        self.running = False
+        self.subscriber.close()
+        self.join()
+
+    def run(self):
+        while True:
+            batches = self.subscriber.get(self.flush_interval)   # everything queued since the last write
+            index_lines = []
+            while not self.markq.empty():
+                index_lines.append(self.markq.get_nowait())
+            self.write_batches(batches, index_lines)
+            if not self.running and not batches:
+                break
+        self.close()
+
+    def write_batches(self, batches, index_lines):
+        pending = []
+        for batch in batches:
+            records = batch.records
+            if batch.replace_last:
+                if pending:                 # batches are shared with other subscribers, patch a copy
+                    pending[-1] = pending[-1].copy()
+                    pending[-1][-1] = records[0]
+                    records = records[1:]
+                elif self.last_record:
+                    self.patch_last(records[:1])
+                    records = records[1:]
+            if len(records):
+                pending.append(records)
+
+        if pending:
+            self.write_records(np.concatenate(pending), index_lines)
+        if index_lines:
+            self.index_file.write("".join(json.dumps(line) + "\n" for line in index_lines))
+            self.index_file.flush()
+
+    def write_records(self, records, index_lines):
+        done = 0
+        while done < len(records):
+            if self.segment_file is None:
+                self.roll_over()
+            k = min(len(records) - done, self.segment_records - self.segment_count)
+            part = records[done:done + k]
+            self.segment_file.write(part.tobytes())
+
+            moves = part["move"]            # one span line per move found in this part
+            bounds = np.flatnonzero(np.diff(moves)) + 1
+            for a, b in zip(np.r_[0, bounds], np.r_[bounds, k]):
+                index_lines.append({"move": int(moves[a]), "segment": self.segment,
+                                    "offset": (self.segment_count + int(a)) * RECORD_SIZE, "count": int(b - a)})
+
+            self.segment_count += k
+            self.written += k
+            done += k
+            self.last_record = (self.segment, (self.segment_count - 1) * RECORD_SIZE)
+            if self.segment_count >= self.segment_records:
+                self.roll_over()
+        self.segment_file.flush()
+
+    # Overwrite the newest record on disk (RF replacing the last RR), also when
+    # the segment holding it was rolled over since
+    def patch_last(self, record):
+        segment, offset = self.last_record
+        if segment == self.segment:
+            self.segment_file.seek(offset)
+            self.segment_file.write(record.tobytes())
+            self.segment_file.seek(0, os.SEEK_END)
+        else:
+            with open(os.path.join(self.directory, segment_name(segment)), "r+b") as segment_file:
+                segment_file.seek(offset)
+                segment_file.write(record.tobytes())
+
+    def roll_over(self):                    # Close the full segment and start the next one
+        if self.segment_file:
+            self.segment_file.close()
+        self.segment += 1
+        self.segment_count = 0
+        self.segment_file = open(os.path.join(self.directory, segment_name(self.segment)), "wb")
+
+    def close(self):
+        if self.segment_file:
+            self.segment_file.close()
+            self.segment_file = None
+        self.index_file.close()
+
+
+#Read back a recorded session through memory maps, nothing is parsed up front
+class SessionReader:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.record_time = {}               # move -> time stamp string
+        self.spans = {}                     # move -> [[segment, offset, count], ...]
+        self.time_unit = "ms"
+        with open(os.path.join(directory, "index.jsonl"), "r") as index_file:
+            for line in index_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:          # last line may be cut short by a crash
+                    continue
+                if "time_unit" in entry:
+                    self.time_unit = entry["time_unit"]
+                elif "time" in entry:
+                    self.record_time[entry["move"]] = entry["time"]
+                else:
+                    spans = self.spans.setdefault(entry["move"], [])
+                    if spans and spans[-1][0] == entry["segment"] and spans[-1][1] + spans[-1][2] * RECORD_SIZE == entry["offset"]:
+                        spans[-1][2] += entry["count"]
+                    else:
+                        spans.append([entry["segment"], entry["offset"], entry["count"]])
+        self.segments = {}
+
+    def segment(self, number):              # memory map of one segment, opened on first use
+        if number not in self.segments:
+            path = os.path.join(self.directory, segment_name(number))
+            count = os.path.getsize(path) // RECORD_SIZE
+            self.segments[number] = np.memmap(path, dtype=SAMPLE_DTYPE, mode="r", shape=(count,)) if count else np.empty(0, dtype=SAMPLE_DTYPE)
+        return self.segments[number]
+
+    def moves(self):
+        return sorted(self.spans)
+
+    def move(self, move):                   # records of one move, a view unless it spans segments
+        parts = [self.segment(seg)[offset // RECORD_SIZE:offset // RECORD_SIZE + count]
+                 for seg, offset, count in self.spans.get(move, [])]
+        if len(parts) == 1:
+            return self.in_us(parts[0])
+        return self.in_us(np.concatenate(parts)) if parts else np.empty(0, dtype=SAMPLE_DTYPE)
+
+    def in_us(self, records):               # records of a session in ms are copied and converted
+        if self.time_unit == TIME_UNIT:
+            return records
+        records = np.array(records)
+        records["time"] *= 1000
+        return records
+
+    def records(self):                      # every record of the session, one segment at a time
+        number = 0
+        while os.path.exists(os.path.join(self.directory, segment_name(number))):
+            yield self.in_us(self.segment(number))
+            number += 1
@@ -0,0 +1,85 @@
+#############################################################################
+#Single-producer single-consumer ring of samples in shared memory
+#The acquisition process (acquisition_process.py) writes SAMPLE_DTYPE records,
+#the GUI process copies them out of the same memory. No lock: only the
+#producer moves the head, only the consumer its cursor, and the slots are
+#written before the head that publishes them. Before writing, the producer
+#sets RESERVE to the head it is writing up to, so a consumer that was lapped
+#while copying can tell which of its samples may be overwritten.
+#
+#   [header: 16 x int64][capacity x SAMPLE_DTYPE]
+#############################################################################
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from sample_store import SAMPLE_DTYPE
+
+# header fields; FRAMES, MALFORMED and LOST mirror the parser of the producer,
+# CLOCK_OFFSET (ns) and CLOCK_DRIFT (ppb) its DeviceClock, NOTIFY is set by a
+# consumer waiting for data and cleared by the producer, RESERVE is the head
+# of the write in progress
+CAPACITY, HEAD, FRAMES, MALFORMED, LOST, NOTIFY, CLOCK_OFFSET, CLOCK_DRIFT, RESERVE = range(9)
+HEADER_FIELDS = 16                          # room for more fields
+HEADER_SIZE = HEADER_FIELDS * 8
+
+
+class SampleRing:
+
+    # name None creates a new ring, else attaches to the one of the other process
+    def __init__(self, name=None, capacity=1 << 20):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity * SAMPLE_DTYPE.itemsize)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.header = np.ndarray(HEADER_FIELDS, dtype=np.int64, buffer=self.shm.buf)
+        if name is None:
+            self.header[:] = 0
+            self.header[CAPACITY] = capacity
+        self.capacity = int(self.header[CAPACITY])
+        self.slots = np.ndarray(self.capacity, dtype=SAMPLE_DTYPE, buffer=self.shm.buf, offset=HEADER_SIZE)
+        self.name = self.shm.name
+
+    @property
+    def head(self):                         # samples written since the ring was created
+        return int(self.header[HEAD])
+
+    def write(self, records):               # Producer: reserve, copy in, then publish by moving the head
+        head, n = self.head, len(records)
+        self.header[RESERVE] = head + n     # slots of the samples before head + n - capacity get overwritten
+        if n > self.capacity:               # only the newest fit
+            head, records = head + n - self.capacity, records[n - self.capacity:]
+            n = self.capacity
+        start = head % self.capacity
+        first = min(n, self.capacity - start)
+        self.slots[start:start + first] = records[:first]
+        self.slots[:n - first] = records[first:]
+        self.header[HEAD] = head + n
+
+    # Consumer: a copy of the samples from cursor up to the head and the new
+    # cursor; lost counts the samples overwritten before or while they were
+    # copied, those are left out. Always a copy, never views of the slots: the
+    # producer may overwrite a slot as soon as the head has passed it, so only
+    # samples copied before RESERVE reached them are known to be whole, and the
+    # caller can keep them while the ring moves on.
+    def read(self, cursor):
+        head = self.head
+        lost = max(0, head - cursor - self.capacity)
+        cursor += lost
+        start, end = cursor % self.capacity, cursor % self.capacity + head - cursor
+        if end <= self.capacity:
+            records = self.slots[start:end].copy()
+        else:
+            records = np.concatenate((self.slots[start:], self.slots[:end - self.capacity]))
+        overwritten = min(int(self.header[RESERVE]) - self.capacity - cursor, len(records))
+        if overwritten > 0:                 # lapped during the copy
+            records = records[overwritten:]
+            lost += overwritten
+        return records, head, lost
+
+    def close(self):
+        self.header = self.slots = None     # views must go before the buffer can be released
+        self.shm.close()
+
+    def unlink(self):                       # Owner, once both sides are done
+        self.shm.unlink()
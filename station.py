@@ -0,0 +1,62 @@
+#############################################################################
+#One motor/DRO controller attached to the UI
+#A Controller of acquisition.py plus its chart state; messages and the
+#Coordinate text go to the WidgetGallery
+#############################################################################
+
+import numpy as np
+
+from acquisition import Controller
+from event_log import INFO
+from plot_buffer import PlotRingBuffer
+from lod_pyramid import MinMaxPyramid
+
+
+class Station(Controller):
+
+    def __init__(self, name, portname, UI):
+        super().__init__(name, portname, UI)
+        self.interface = UI
+
+        # Chart state, the curves are created by WidgetGallery
+        frame = UI.plot_time_frame
+        # x of both charts is the global index of the sample in dro_pulse_record
+        self.plot_buffer = PlotRingBuffer(frame)    # rows: x, dro, pulse
+        self.plot_buffer.extend(np.arange(-frame, 0), np.zeros(frame), np.zeros(frame))
+        self.plot_pyramid = MinMaxPyramid(source=self.history_samples)   # rows: dro, pulse; whole session for zooming out
+        self.history_cursor = 0                     # samples of dro_pulse_record in plot_pyramid
+        self.on_connection = lambda connected: UI.connection_update.emit(self.name, connected)
+        self.dro_curve = None
+        self.pulse_curve = None
+        self.text_update_bool = False
+        self.pulse_lower = -90
+        self.pulse_upper = 90
+        self.dro_lower = -0.04
+        self.dro_upper = 0.04
+
+    def write(self, text, level=INFO):      # Any thread, to the event log of the UI
+        self.interface.write(text, level, self.name)
+
+    # GUI thread: add what was stored since the last call to the pyramid. Read from the
+    # SampleStore, not the "plot" subscriber, which drops samples when the GUI falls behind.
+    # The last sample added is read again, RF may have replaced it since.
+    def extend_history(self):
+        cursor = self.history_cursor
+        records, self.history_cursor = self.dro_pulse_record.since(max(cursor - 1, 0))
+        dro, pulse = records["dro"]/100, records["pulse"].astype(float)
+        start = self.history_cursor - len(dro)      # store index of records[0]
+        if cursor and start == cursor - 1:
+            self.plot_pyramid.replace_last(dro[0], pulse[0])
+            dro, pulse = dro[1:], pulse[1:]
+        elif start > cursor:                # evicted before it was drawn, held at the next value to keep x
+            dro, pulse = np.r_[np.full(start - cursor, dro[0]), dro], np.r_[np.full(start - cursor, pulse[0]), pulse]
+        if len(dro):
+            self.plot_pyramid.extend(dro, pulse)
+
+    def history_samples(self, x0, x1):      # level 0 of plot_pyramid, only what the store still holds
+        records = self.dro_pulse_record.range(x0, x1)
+        return np.vstack((records["dro"]/100, records["pulse"]))
+
+    def update_text(self, pulse, dro):      # Any thread; the GUI shows the latest values on its next frame
+        self.last_text = (pulse, dro)
+        self.interface.plot_updater.post_text()
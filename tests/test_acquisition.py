@@ -0,0 +1,24 @@
+import time
+
+from acquisition import Acquisition
+from virtual_device import VirtualDevice
+
+
+def test_wait_returns_once_that_move_has_finished():
+    device = VirtualDevice(0, start_delay=0.2, frame_rate=20000, jitter=3, seed=1)
+    device.start()
+    try:
+        with Acquisition({"record_path": ""}, log=lambda text: None) as acquisition:
+            controller = acquisition.add(device.port)
+            assert controller.wait(timeout=0)       # nothing sent yet
+            assert controller.connect(timeout=10)
+            moves = [controller.move(direction, 0, 0.05) for direction in ("+", "-", "+")]
+            assert moves == [1, 2, 3]
+            assert controller.wait(1, timeout=10)
+            # the RF edges of move 1 don't count for the moves after it
+            assert not controller.wait(3, timeout=0.1) and 3 not in controller.finished
+            assert controller.wait(timeout=10)      # the last move sent
+            time.sleep(0.1)
+            assert controller.finished == {1, 2, 3}
+    finally:
+        device.close()
@@ -0,0 +1,45 @@
+import json
+
+from acquisition import Acquisition
+from virtual_device import VirtualDevice
+import analytics
+
+
+def record(path, noise):                    # 20 moves of 3 counts, two in each direction in turn
+    device = VirtualDevice(0, start_delay=0.01, backlash=20, noise=noise, frame_rate=20000, seed=3)
+    device.start()
+    try:
+        with Acquisition({"record_path": str(path)}, log=lambda text: None) as acquisition:
+            controller = acquisition.add(device.port)
+            assert controller.connect(timeout=10)
+            for i in range(20):
+                controller.move(1 if (i // 2) % 2 == 0 else -1, 0, 3)
+                assert controller.wait(timeout=30)
+    finally:
+        device.close()
+    sessions = analytics.find_sessions([str(path)])
+    assert len(sessions) == 1
+    return sessions[0]
+
+
+def test_noisy_dro_does_not_engage_the_move_early(tmp_path):
+    metrics = analytics.analyse(analytics.load(record(tmp_path, noise=0.3)))
+    # compared with the start value exactly, a count of noise engaged the reversals during
+    # the take-up: 7.2 and 9.25 steps of the 20 and 116.5 steps lost
+    for change in ("+-", "-+"):
+        assert 19 <= metrics["backlash_steps"][change]["mean"] <= 20
+    assert metrics["lost_steps"]["total"] == 0
+
+
+def test_a_corrupt_session_is_reported_and_the_others_analysed(tmp_path):
+    good = record(tmp_path / "good", noise=0.0)
+    bad = tmp_path / "bad" / "S1"
+    bad.mkdir(parents=True)
+    (bad / "index.jsonl").write_text(json.dumps({"segment": 0, "offset": 0, "count": 1}) + "\n")   # no "move"
+    (bad / analytics.segment_name(0)).write_bytes(b"\0" * 64)
+
+    report = analytics.run([str(tmp_path)], workers=1, cache=None, log=lambda text: None)
+    assert [r["session"] for r in report["sessions"]] == [good]
+    assert report["meta"]["failed"] == 1
+    assert report["failed"][0]["session"] == str(bad)
+    assert report["failed"][0]["error"].startswith("KeyError")
@@ -0,0 +1,37 @@
+import numpy as np
+
+from acquisition import Acquisition, ComPortConnector
+from calibration import RunningMoments
+
+
+def test_remove_undoes_merge():
+    rng = np.random.default_rng(0)
+    x, y = rng.normal(1e6, 500, 1000), rng.normal(3, 2, 1000)
+    moments = RunningMoments()
+    moments.merge(x, y)
+    moments.remove(x[-1], y[-1])
+    expected = RunningMoments()
+    expected.merge(x[:-1], y[:-1])
+    for name in ("n", "mean_x", "mean_y", "cxx", "cxy", "cyy"):
+        assert np.isclose(getattr(moments, name), getattr(expected, name), rtol=1e-9)
+
+
+def test_calibration_counts_the_stored_samples():
+    # RF frames replace the RR before them, also when that RR came in an earlier read
+    frames, pulse = [], 0
+    for move in range(6):
+        sign = 1 if move % 2 == 0 else -1
+        for _ in range(50):
+            pulse += sign
+            frames.append(b"RR%d;%d!" % (pulse, pulse))
+        frames.append(b"RF%d;%d!" % (pulse, pulse))
+    with Acquisition({"record_path": ""}, log=lambda text: None) as acquisition:
+        controller = acquisition.add("S1")
+        connector = ComPortConnector("test", 9600, controller, acquisition.engine)
+        connector.running = True
+        controller.connector = connector
+        for move in range(6):
+            controller.register_move(1 if move % 2 == 0 else -1)
+            for frame in frames[move * 51:(move + 1) * 51]:
+                connector.ser_in(frame)     # one frame per read
+        assert controller.calibration.estimates()["samples"] == len(controller.dro_pulse_record) == 6 * 50
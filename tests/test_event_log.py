@@ -0,0 +1,15 @@
+import os
+
+from event_log import LogWriter
+
+
+def test_roll_over_counts_encoded_bytes(tmp_path):
+    path = str(tmp_path / "events.log")
+    writer = LogWriter(path, max_bytes=100, backups=2)
+    line = "±" * 20 + "\n"                 # 21 characters, 41 bytes in UTF-8
+    writer.write_lines([line] * 7)
+    writer.log_file.close()
+    sizes = [os.path.getsize(p) for p in (path, path + ".1", path + ".2")]
+    assert all(size <= 100 for size in sizes)
+    assert sizes == [41, 82, 82]            # two lines a file, counted as characters four would fit
+    assert not os.path.exists(path + ".3")
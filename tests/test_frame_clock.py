@@ -0,0 +1,67 @@
+import time
+
+import numpy as np
+import serial
+
+from frame_clock import DeviceClock, FrameClock
+from frame_parser import FrameParser
+from virtual_device import VirtualDevice
+
+
+def test_unwrap_the_counter_across_2_32():
+    clock = DeviceClock()
+    first = clock.unwrap(np.array([2**32 - 3000, 2**32 - 1000, 500], dtype=np.int64))   # wraps within a read
+    second = clock.unwrap(np.array([1500, 3 * 2**30], dtype=np.int64))
+    third = clock.unwrap(np.array([20], dtype=np.int64))                               # and between reads
+    assert first.tolist() == [2**32 - 3000, 2**32 - 1000, 2**32 + 500]
+    assert second.tolist() == [2**32 + 1500, 2**32 + 3 * 2**30]
+    assert third.tolist() == [2**33 + 20]
+
+
+def test_offset_and_drift_under_random_delays():
+    rng = np.random.default_rng(2)
+    clock = DeviceClock()
+    drift_ppm, offset_ns = 300, 7_000_000_000
+    device = np.arange(0, 20_000_000, 2000)             # 20 s of frames, 2 ms apart
+    host = offset_ns + np.rint(device * 1000 / (1 + drift_ppm * 1e-6)).astype(np.int64)
+    host += rng.exponential(300_000, len(device)).astype(np.int64)     # transmission delays, 0.3 ms mean
+    for part in np.array_split(np.arange(len(device)), 400):           # reads of about 25 frames
+        clock.update(device[part], host[part])
+    assert abs(clock.stats()["drift_ppm"] - drift_ppm) < 5
+    exact = offset_ns + device * 1000 / (1 + drift_ppm * 1e-6)
+    assert np.abs(clock.to_host(device) - exact).max() < 100_000      # 0.1 ms
+    assert (clock.to_host(device) - host <= 100_000).all()            # nothing mapped after it arrived
+
+
+def test_emulator_counter_near_the_wrap_with_drift():
+    drift_ppm = 500
+    device = VirtualDevice(0, start_delay=0, frame_rate=2000, micros=True, clock_drift=drift_ppm,
+                           counter_start=2**32 - 1_500_000, seed=1)   # wraps 1.5 s in
+    device.start()
+    ser = serial.Serial(device.port, 115200, timeout=0.05)
+    parser, clock = FrameParser(), FrameClock(0)
+    try:
+        ser.write(b"L+009000#")             # 4.5 s of frames
+        stamped, counters = [], []
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            data = ser.read(ser.in_waiting or 1)
+            if not data:
+                continue
+            frames = parser.feed(data)
+            if len(frames):
+                stamped.append(clock.stamp(frames, parser.tails, time.monotonic_ns(), len(data)))
+                counters.append(frames["device"])
+                if frames["status"][-1] == 0:
+                    break
+    finally:
+        ser.close()
+        device.close()
+    stamped, counters = np.concatenate(stamped), np.concatenate(counters)
+    assert counters.min() < 1_000_000 < 2**32 - 1_500_000 <= counters.max()   # the counter wrapped
+    assert np.all(np.diff(stamped) >= 0)    # and the times went on
+    assert abs(clock.device.stats()["drift_ppm"] - drift_ppm) < 50
+    # edge times of the emulator: (counter - counter_start) / (1 + drift) after its boot, in us since start_ns=0
+    unwrapped = np.where(counters < 2**31, counters + 2**32, counters) - (2**32 - 1_500_000)
+    true = (device.boot * 1e9 + unwrapped * 1000 / (1 + drift_ppm * 1e-6)) / 1000
+    assert np.abs(stamped - true).max() < 2000    # within 2 ms of the encoder edge
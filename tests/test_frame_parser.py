@@ -0,0 +1,83 @@
+import numpy as np
+
+from frame_parser import (FrameParser, BinaryFrameParser, FRAME_DTYPE, STATUS_MOVING, STATUS_FINISH,
+        encode_binary_frame, handshake_command, parse_handshake)
+
+
+def test_frames_split_across_reads_and_their_tails():
+    parser = FrameParser()
+    frames = parser.feed(b"RR1;2!RR3")
+    assert frames[["status", "pulse", "dro"]].tolist() == [(STATUS_MOVING, 1, 2)]
+    assert parser.tails.tolist() == [3]             # "RR3" follows it
+    frames = parser.feed(b";4!RF5;6;700!xx")
+    assert frames[["status", "pulse", "dro", "device"]].tolist() == [(STATUS_MOVING, 3, 4, -1), (STATUS_FINISH, 5, 6, 700)]
+    assert parser.tails.tolist() == [12, 2]         # bytes of the read after each frame
+    assert parser.pending == b"xx"
+    assert (parser.frames, parser.malformed) == (3, 0)
+
+
+def test_malformed_frames_are_counted_and_skipped():
+    parser = FrameParser()
+    frames = parser.feed(b"RR1;2!garbage!RX3;4!RR5;6!RR7!")
+    assert frames["pulse"].tolist() == [1, 5]
+    assert (parser.frames, parser.malformed) == (2, 3)
+    assert len(parser.feed(b"x" * 100)) == 0        # no terminator in sight
+    assert parser.malformed == 4 and parser.pending == b""
+
+
+def test_ten_digit_values_of_the_firmware_long():
+    parser = FrameParser()
+    frames = parser.feed(b"RR2147483647;-2147483648!RR-1000000000;1234567890;4294967295!")
+    assert frames[["pulse", "dro", "device"]].tolist() == [(2147483647, -2147483648, -1),
+                                                           (-1000000000, 1234567890, 4294967295)]
+    assert frames.dtype["pulse"] == np.dtype("i4")
+    assert len(parser.feed(b"RR2147483648;0!RR0;-2147483649!RR12345678901;0!")) == 0   # out of the range of a long
+    assert parser.malformed == 3
+
+
+def binary_frames(start, n):
+    frames = np.zeros(n, dtype=FRAME_DTYPE)
+    frames["status"] = STATUS_MOVING
+    frames["pulse"] = np.arange(start, start + n)
+    frames["dro"] = -frames["pulse"]
+    frames["device"] = frames["pulse"] * 100
+    return frames
+
+
+def test_binary_crc_failure_resyncs_on_the_next_sync():
+    parser = BinaryFrameParser()
+    bad = bytearray(encode_binary_frame(0, binary_frames(0, 4)))
+    bad[8] ^= 0xFF                          # a pulse byte of the first record
+    good = encode_binary_frame(1, binary_frames(4, 4))
+    frames = parser.feed(b"\x00\xa5" + bytes(bad) + b"noise" + good)
+    assert frames["pulse"].tolist() == [4, 5, 6, 7]
+    assert frames["device"].tolist() == [-1] * 4    # version 1 carries no micros()
+    assert (parser.frames, parser.malformed, parser.lost) == (4, 1, 0)
+
+
+def test_binary_sequence_gaps_count_as_lost():
+    parser = BinaryFrameParser(2)
+    data = b"".join(encode_binary_frame(seq, binary_frames(seq, 1), 2) for seq in (0xFFFE, 0xFFFF, 2, 5))
+    frames = parser.feed(data)
+    assert frames["pulse"].tolist() == [0xFFFE, 0xFFFF, 2, 5]
+    assert frames["device"].tolist() == [0xFFFE * 100, 0xFFFF * 100, 200, 500]
+    assert parser.lost == 2 + 2             # 0 and 1 across the wrap, then 3 and 4
+
+
+def test_binary_frame_split_across_reads():
+    parser = BinaryFrameParser()
+    data = encode_binary_frame(0, binary_frames(0, 3)) + encode_binary_frame(1, binary_frames(3, 2))
+    assert len(parser.feed(data[:1])) == 0 and len(parser.feed(data[1:4])) == 0
+    frames = parser.feed(data[4:30])        # the first frame is 5 + 3 * 9 + 2 = 34 bytes
+    assert len(frames) == 0 and len(parser.pending) == 30
+    frames = parser.feed(data[30:40])
+    assert frames["pulse"].tolist() == [0, 1, 2] and parser.tails.tolist() == [6] * 3
+    frames = parser.feed(data[40:])
+    assert frames["pulse"].tolist() == [3, 4] and parser.tails.tolist() == [0, 0]
+    assert (parser.malformed, parser.lost) == (0, 0)
+
+
+def test_handshake_acknowledgement():
+    assert handshake_command(115200, 2) == "P2115200#"
+    assert parse_handshake(b"RR1;2!RB2;115200!") == (2, 115200)
+    assert parse_handshake(b"RR1;2!") is None
@@ -0,0 +1,56 @@
+import numpy as np
+
+import lod_pyramid
+from lod_pyramid import MinMaxPyramid
+
+
+def brute(values, level, factor=8):         # min and max of every level entry
+    block = factor ** level
+    starts = np.arange(0, values.shape[1], block)
+    return np.minimum.reduceat(values, starts, axis=1), np.maximum.reduceat(values, starts, axis=1)
+
+
+def test_levels_match_the_samples_in_any_batching(monkeypatch):
+    monkeypatch.setattr(lod_pyramid, "CHUNK", 16)   # levels span several chunks
+    rng = np.random.default_rng(1)
+    values = rng.normal(size=(2, 3000)).astype(np.float32)
+    pyramid = MinMaxPyramid()
+    done = 0
+    for n in rng.integers(1, 40, 200).tolist() + [3000]:
+        pyramid.extend(*values[:, done:done + n])
+        done = min(done + n, 3000)
+    assert pyramid.size == 3000
+    for level in range(1, len(pyramid.levels) + 1):
+        mins, maxs = brute(values, level)
+        got = pyramid.levels[level - 1].get(0, pyramid.levels[level - 1].length)
+        assert np.array_equal(got[0], mins) and np.array_equal(got[1], maxs)
+    x, y = pyramid.query(0, 3000, 100)      # 3000 / 8**2 entries of level 2
+    assert len(x) == 2 * 47 and y.min() == values.min() and y.max() == values.max()
+
+
+def test_replace_last_updates_every_level():
+    values = np.arange(2 * 100, dtype=np.float32).reshape(2, 100)
+    pyramid = MinMaxPyramid()
+    pyramid.extend(*values[:, :64])         # the newest sample ends a level-1 entry
+    pyramid.replace_last(-5, 500)
+    values[:, 63] = (-5, 500)
+    pyramid.extend(*values[:, 64:])
+    pyramid.replace_last(7, 7)
+    values[:, 99] = 7
+    for level in range(1, len(pyramid.levels) + 1):
+        mins, maxs = brute(values, level)
+        got = pyramid.levels[level - 1].get(0, pyramid.levels[level - 1].length)
+        assert np.array_equal(got[0], mins) and np.array_equal(got[1], maxs)
+
+
+def test_level_zero_is_read_from_the_source_while_it_holds_the_samples():
+    values = np.arange(2 * 1000, dtype=np.float32).reshape(2, 1000)
+    held = [0]                              # first sample the source still holds
+    pyramid = MinMaxPyramid(source=lambda x0, x1: values[:, max(x0, held[0]):x1])
+    pyramid.extend(*values)
+    assert not hasattr(pyramid, "mins")     # no copy of the samples
+    x, y = pyramid.query(100, 150, 200)
+    assert x.tolist() == list(range(100, 151)) and np.array_equal(y, values[:, 100:151])
+    held[0] = 500                           # evicted: drawn from level 1
+    x, y = pyramid.query(100, 150, 200)
+    assert x[0] == 12 * 8 + 3.5 and y[0, 0] == 96 and y[0, 1] == 103
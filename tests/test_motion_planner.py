@@ -0,0 +1,38 @@
+import os
+import re
+
+import numpy as np
+
+from motion_planner import MotionPlanner
+
+FIRMWARE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "Lib", "Router_DRO_encoder_v1", "Router_DRO_encoder_v1.ino")
+C_TYPES = {"uint8_t": 8, "uint16_t": 16, "int": 16, "long": 32}     # AVR widths
+
+
+def firmware_value(name):                   # the value a global of the firmware holds at run time
+    with open(FIRMWARE) as source:
+        kind, value = re.search(r"\b(\w+)\s+%s\s*=\s*(\d+)\s*;" % name, source.read()).groups()
+    return int(value) & ((1 << C_TYPES[kind]) - 1)
+
+
+def test_pulse_times_are_the_ones_the_firmware_runs_with():
+    planner = MotionPlanner()
+    assert planner.pulse_high_time == firmware_value("x_pulse_high_time") == 100
+    assert planner.pulse_low_time == firmware_value("x_pulse_low_time") == 44
+
+
+def test_step_period_and_speed_field():
+    planner = MotionPlanner()
+    # move(): delayMicroseconds(pulse_high_time) + delayMicroseconds(pulse_low_time + delay_time)
+    assert np.allclose(planner.period([0, 50, 99]), [144e-6, 194e-6, 243e-6])
+    assert planner.speed_for(1 / 194e-6) == 50
+    assert planner.speed_for(10000) == 0        # faster than the firmware can step
+    assert planner.speed_for(1000) == 99        # slower than it can step
+
+
+def test_plan_covers_the_stroke():
+    planner = MotionPlanner()
+    segments = planner.plan(4000)
+    assert segments["counts"].sum() == 4000
+    assert np.all((segments["speed"] >= 0) & (segments["speed"] <= 99))
@@ -0,0 +1,77 @@
+import time
+import types
+
+from io_engine import SerialEngine
+from move_program import MoveProgram, DONE
+from sample_store import SampleStore
+
+
+class Controller:                           # what MoveProgram uses of acquisition.Controller, sends are recorded
+
+    def __init__(self, engine):
+        self.owner = types.SimpleNamespace(engine=engine)
+        self.on_finish = None
+        self.connected = True
+        self.dro_pulse_record = SampleStore(1000)
+        self.sent = []
+
+    def send(self, command):
+        self.sent.append(time.monotonic())
+        return len(self.sent)
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_pause_during_a_dwell_keeps_the_dwell_and_dispatches_once():
+    engine = SerialEngine()
+    engine.start()
+    try:
+        controller = Controller(engine)
+        moves = [{"direction": 1, "speed": 0, "distance": 1, "dwell": 0.3},
+                 {"direction": -1, "speed": 0, "distance": 1, "dwell": 0}]
+        program = MoveProgram(controller, moves)
+        program.start()
+        assert wait_for(lambda: len(controller.sent) == 1)
+        finished = time.monotonic()
+        engine.call(program.finished, 1)    # RF of the first move, its dwell starts
+        time.sleep(0.05)
+        program.pause()
+        program.resume()                    # within the dwell
+        assert wait_for(lambda: len(controller.sent) == 2)
+        assert controller.sent[1] - finished >= 0.3
+        engine.call(program.finished, 2)
+        assert program.wait(2.0) and program.state == DONE
+        time.sleep(0.35)                    # nothing left scheduled sends again
+        assert len(controller.sent) == 2
+    finally:
+        engine.stop()
+
+
+def test_late_rf_frames_neither_finish_the_next_move_nor_join_it():
+    from acquisition import Acquisition
+    from frame_parser import STATUS_MOVING
+    from virtual_device import VirtualDevice
+    device = VirtualDevice(0, start_delay=0.05, frame_rate=20000, jitter=2, seed=1)
+    device.start()
+    try:
+        with Acquisition({"record_path": ""}, log=lambda text: None) as acquisition:
+            controller = acquisition.add(device.port)
+            assert controller.connect(timeout=10)
+            moves = [{"direction": direction, "speed": 0, "distance": 0.05, "dwell": 0} for direction in (1, -1, 1, -1)]
+            program = MoveProgram(controller, moves)
+            program.start()
+            assert program.wait(10) and program.state == DONE
+            time.sleep(0.1)                 # the RF edges after the last move
+            for result in program.results:
+                assert result["samples"] > 1 and abs(result["end_dro"] - result["start_dro"]) >= 5
+            assert [result["move"] for result in program.results] == [1, 2, 3, 4]
+            assert controller.finished == {1, 2, 3, 4}
+            for move in (2, 3, 4):          # the RF edges in its start delay stay with the move before
+                assert controller.dro_pulse_record.move(move)["status"][0] == STATUS_MOVING
+    finally:
+        device.close()
@@ -0,0 +1,61 @@
+import numpy as np
+
+from sample_bus import SampleBus, COALESCE
+from sample_store import to_records
+
+
+def batch(start, n, move=1):
+    index = np.arange(start, start + n)
+    return to_records(move, 1, index, index, index)
+
+
+def test_each_subscriber_applies_its_own_overflow_policy():
+    bus = SampleBus()
+    everything = bus.subscribe("recorder")
+    newest = bus.subscribe("plot", max_samples=5)
+    latest = bus.subscribe("text", max_samples=1, overflow=COALESCE)
+    bus.publish(batch(0, 4))
+    bus.publish(batch(4, 4), replace_last=True)
+    bus.publish(batch(8, 3))
+
+    batches = everything.get(0)
+    assert [len(b.records) for b in batches] == [4, 4, 3] and batches[1].replace_last
+    assert everything.stats() == {"lag": 0, "received": 11, "dropped": 0}
+
+    assert newest.stats() == {"lag": 5, "received": 0, "dropped": 6}
+    batches = newest.get(0)
+    assert np.concatenate([b.records for b in batches])["pulse"].tolist() == [6, 7, 8, 9, 10]
+    assert not batches[0].replace_last      # its first sample was not the one replaced
+    assert newest.stats() == {"lag": 0, "received": 5, "dropped": 6}
+
+    batches = latest.get(0)
+    assert len(batches) == 1 and batches[0].records["pulse"].tolist() == [10]
+    assert latest.stats() == {"lag": 0, "received": 1, "dropped": 10}
+    assert bus.published == 11
+    assert set(bus.stats()) == {"recorder", "plot", "text"}
+
+
+def test_source_filter_and_notify_once_per_get():
+    bus = SampleBus()
+    calls = []
+    subscriber = bus.subscribe("S2 plot", source="S2", notify=lambda: calls.append(1))
+    bus.publish(batch(0, 2), source="S1")
+    bus.publish(batch(0, 3), source="S2")
+    bus.publish(batch(3, 3), source="S2")
+    assert len(calls) == 1
+    assert [b.source for b in subscriber.get(0)] == ["S2", "S2"]
+    bus.publish(batch(6, 1), source="S2")
+    assert len(calls) == 2
+    subscriber.get(0)
+    subscriber.close()
+    assert bus.subscribers == [] and subscriber.get() == []    # returns at once
+
+
+def test_store_index_follows_the_dropped_samples():
+    bus = SampleBus()
+    newest = bus.subscribe("plot", max_samples=5)
+    latest = bus.subscribe("text", max_samples=1, overflow=COALESCE)
+    bus.publish(batch(0, 4), index=0)
+    bus.publish(batch(4, 4), index=4)
+    assert [(b.index, b.records["pulse"][0]) for b in newest.get(0)] == [(3, 3), (4, 4)]
+    assert [(b.index, b.records["pulse"][0]) for b in latest.get(0)] == [(7, 7)]
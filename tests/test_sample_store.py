@@ -0,0 +1,50 @@
+import numpy as np
+
+from sample_store import SampleStore, SAMPLE_DTYPE, to_records
+
+
+def fill(store, move, start, n):            # pulse and DRO are the global index of the sample
+    index = np.arange(start, start + n)
+    store.extend(move, 1, index, index, index * 10)
+
+
+def test_replace_last_overwrites_in_place_and_moves_the_sample():
+    store = SampleStore(capacity=100, chunk_size=4)
+    store.replace_last(1, 0, 5, 5, 50)      # empty: appended
+    assert len(store) == 1 and store.last() == (1, 0, 5, 5, 50)
+    fill(store, 1, 1, 3)
+    store.replace_last(1, 0, 7, 8, 90)
+    assert store.total == 4 and store.last() == (1, 0, 7, 8, 90)
+    assert store.move(1)["pulse"].tolist() == [5, 1, 2, 7]
+    fill(store, 2, 4, 1)
+    store.replace_last(3, 0, 9, 9, 99)      # the newest sample now belongs to move 3
+    assert store.move(2)["pulse"].tolist() == [] and 2 not in store.moves
+    assert store.move(3)["pulse"].tolist() == [9]
+
+
+def test_oldest_chunks_are_evicted_at_capacity():
+    store = SampleStore(capacity=8, chunk_size=4)   # two chunks
+    fill(store, 1, 0, 6)
+    fill(store, 2, 6, 6)
+    assert store.total == 12 and store.first == 4 and len(store) == 8
+    assert store.columns()["pulse"].tolist() == list(range(4, 12))
+    assert 1 in store.moves and store.move(1)["pulse"].tolist() == [4, 5]   # the rest of move 1 is gone
+    fill(store, 2, 12, 4)
+    assert store.first == 8 and 1 not in store.moves
+    assert store.range(0, 10)["pulse"].tolist() == [8, 9]
+    columns, cursor = store.since(2)
+    assert columns["pulse"].tolist() == list(range(8, 16)) and cursor == 16
+
+
+def test_reads_across_chunks():
+    store = SampleStore(capacity=100, chunk_size=4)
+    fill(store, 1, 0, 10)
+    latest = store.latest(7)
+    assert latest["pulse"].tolist() == list(range(3, 10))
+    assert latest["time"].dtype == SAMPLE_DTYPE["time"]
+    assert store.latest(100)["pulse"].tolist() == list(range(10))
+    assert store.latest(2)["pulse"].base is not None    # inside one chunk: a view
+    columns = store.columns()
+    assert columns["dro"].tolist() == list(range(10))
+    records = to_records(*(columns[name] for name in SAMPLE_DTYPE.names))
+    assert records.dtype == SAMPLE_DTYPE and records["time"][-1] == 90
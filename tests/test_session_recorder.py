@@ -0,0 +1,63 @@
+import numpy as np
+
+from frame_parser import STATUS_FINISH, STATUS_MOVING
+from sample_bus import Batch
+from sample_store import COLUMNS, SampleStore, to_records
+from session_recorder import SessionRecorder, SessionReader
+
+
+class Subscriber:                           # hands the recorder prepared batches, as SampleBus would
+
+    def __init__(self):
+        self.batches = []
+
+    def get(self, timeout=None):
+        batches, self.batches = self.batches, []
+        return batches
+
+    def close(self):
+        pass
+
+
+def moving(move, pulses):
+    pulses = np.asarray(pulses)
+    return to_records(move, STATUS_MOVING, pulses, pulses, pulses * 1000)
+
+
+def finish(move, pulse):
+    return to_records(move, STATUS_FINISH, [pulse], [pulse], [pulse * 1000 + 1])
+
+
+def record(tmp_path, writes, segment_records):
+    # writes: lists of batches, each list handed to one write_batches() call
+    recorder = SessionRecorder(str(tmp_path), Subscriber(), segment_records=segment_records)
+    store = SampleStore()
+    for batches in writes:
+        for batch in batches:
+            if batch.replace_last:
+                store.replace_last(*batch.records[0])
+                store.extend_records(batch.records[1:])
+            else:
+                store.extend_records(batch.records)
+        recorder.write_batches(batches, [])
+    recorder.close()
+    columns = store.columns()
+    in_memory = to_records(*(columns[name] for name in COLUMNS))
+    return np.concatenate(list(SessionReader(str(tmp_path)).records())), in_memory
+
+
+def test_rf_replaces_the_last_sample_of_a_full_segment(tmp_path):
+    # the RR that fills segment 0 is replaced by an RF written after the roll-over
+    on_disk, in_memory = record(tmp_path, [[Batch(moving(1, range(4)), False)],
+                                           [Batch(finish(1, 3), True)],
+                                           [Batch(moving(2, range(4, 6)), False)]], segment_records=4)
+    assert len(on_disk) == len(in_memory) == 6
+    assert (on_disk == in_memory).all()
+    assert on_disk["status"][3] == STATUS_FINISH
+
+
+def test_rf_in_the_same_write_as_its_rr_across_segments(tmp_path):
+    on_disk, in_memory = record(tmp_path, [[Batch(moving(1, range(6)), False), Batch(finish(1, 5), True)]],
+                                segment_records=4)
+    assert (on_disk == in_memory).all()
+    assert list(on_disk["status"]) == [STATUS_MOVING] * 5 + [STATUS_FINISH]
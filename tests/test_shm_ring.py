@@ -0,0 +1,55 @@
+import multiprocessing
+
+import numpy as np
+
+from sample_store import to_records
+from shm_ring import SampleRing, RESERVE
+
+
+def samples(first, n):                      # pulse holds the sample number
+    index = np.arange(first, first + n)
+    return to_records(1, 1, index, index, index)
+
+
+def test_read_drops_samples_overwritten_during_the_copy():
+    ring = SampleRing(capacity=8)
+    try:
+        ring.write(samples(0, 8))
+        # the producer reserved 3 more samples and is overwriting slots 0-2 while we copy
+        ring.header[RESERVE] = ring.head + 3
+        records, head, lost = ring.read(0)
+        assert (head, lost) == (8, 3)
+        assert list(records["pulse"]) == [3, 4, 5, 6, 7]
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def produce(name, stop):                    # child process: write numbered samples as fast as possible
+    ring = SampleRing(name)
+    n = 0
+    while not stop.is_set():
+        ring.write(samples(n, 7))
+        n += 7
+    ring.close()
+
+
+def test_reader_lapped_by_a_fast_writer_never_gets_overwritten_samples():
+    context = multiprocessing.get_context("spawn")
+    ring = SampleRing(capacity=64)
+    stop = context.Event()
+    producer = context.Process(target=produce, args=(ring.name, stop))
+    producer.start()
+    try:
+        cursor, seen = 0, 0
+        while seen < 300000:
+            records, head, lost = ring.read(cursor)
+            # exactly the samples cursor + lost .. head, nothing the writer came around to
+            assert list(records["pulse"]) == list(range(cursor + lost, head))
+            seen += head - cursor
+            cursor = head
+    finally:
+        stop.set()
+        producer.join()
+        ring.close()
+        ring.unlink()
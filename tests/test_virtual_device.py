@@ -0,0 +1,37 @@
+from virtual_device import VirtualDevice, measure
+
+
+def run(binary):
+    device = VirtualDevice(0, start_delay=0, frame_rate=20000, seed=1)
+    device.start()
+    try:
+        return measure(device, moves=4, distance=2000, baudrate=115200, binary=binary)
+    finally:
+        device.close()
+
+
+def test_binary_frames_are_smaller_per_sample_than_ascii():
+    ascii, binary = run(False), run(True)
+    assert binary["protocol"] == "binary" and binary["malformed"] == 0
+    assert binary["frames"] == ascii["frames"]
+    # full frames: 7 bytes of framing per 8 records of 9 bytes, 9.9 bytes a sample
+    assert binary["bytes_per_sample"] < 10 < ascii["bytes_per_sample"]
+
+
+def test_unknown_protocol_version_is_rejected_and_ascii_kept():
+    from acquisition import Acquisition
+    from frame_parser import FrameParser
+    device = VirtualDevice(0, start_delay=0, frame_rate=20000, seed=1)
+    device.start()
+    messages = []
+    try:
+        with Acquisition({"record_path": "", "protocol": "binary", "binary_version": 9}, log=messages.append) as acquisition:
+            controller = acquisition.add(device.port)
+            assert controller.connect(timeout=10)
+            assert type(controller.connector.parser) is FrameParser and device.protocol == 0
+            controller.move("+", 0, 1)
+            assert controller.wait(timeout=10)
+            assert len(controller.dro_pulse_record) > 0
+    finally:
+        device.close()
+    assert any("not acknowledged" in message for message in messages)
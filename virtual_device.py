@@ -0,0 +1,306 @@
+#############################################################################
+#Software emulator of Lib/Router_DRO_encoder_v1 on a Linux pseudo-terminal
+#Accepts "L+SSDDDD#" / "L-SSDDDD#" move commands and answers with RR/RF frames,
+#so ComPortConnector can be load-tested without the Arduino
+#
+#   python virtual_device.py --baud 0 --frame-rate 50000
+#   python virtual_device.py --measure 20
+#############################################################################
+
+import os
+import sys
+import tty
+import time
+import select
+import argparse
+import threading
+import numpy as np
+
+from frame_parser import (FRAME_DTYPE, STATUS_MOVING, STATUS_FINISH, BINARY_RECORDS,
+        encode_binary_frame)
+
+BATCH_SIZE = 8                              # samples per binary frame, as in the firmware
+
+
+class VirtualDevice(threading.Thread):
+
+    def __init__(self,
+        baudrate=9600,                      # 0 writes as fast as the pty allows
+        pulse_high_time=100,                # us, x_pulse_high_time of the firmware
+        pulse_low_time=44,                  # us, x_pulse_low_time of the firmware (300 in a uint8_t)
+        start_delay=0.5,                    # s, delay(500) before the motor starts
+        counts_per_step=1.0,                # DRO counts (0.01 mm) per motor step
+        backlash=0,                         # steps lost when the direction reverses
+        noise=0.0,                          # standard deviation of the DRO reading, in counts
+        frame_rate=None,                    # frames per second, overrides the step timing
+        time_scale=1.0,                     # >1 runs the motor faster than real time
+        micros=False,                       # ASCII frames carry micros(), as with FRAME_MICROS 1
+        clock_drift=0.0,                    # ppm the micros() counter runs fast
+        counter_start=0,                    # micros() at start, e.g. close to the wrap at 2**32
+        jitter=0,                           # DRO edges (+1 and back) after a move and in the start delay of the next
+        seed=None
+        ):
+        super().__init__(daemon=True)
+        self.baudrate = baudrate
+        self.pulse_high_time = pulse_high_time
+        self.pulse_low_time = pulse_low_time
+        self.start_delay = start_delay
+        self.counts_per_step = counts_per_step
+        self.backlash = backlash
+        self.noise = noise
+        self.frame_rate = frame_rate
+        self.time_scale = time_scale
+        self.micros = micros
+        self.clock_drift = clock_drift
+        self.counter_start = counter_start
+        self.jitter = jitter
+        self.boot = time.monotonic()        # micros() counts from here
+        self.rng = np.random.default_rng(seed)
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)  # path to hand to ComPortConnector / serial.Serial
+
+        self.running = True
+        self.command = b""
+        self.pulse = 0                      # accumulated pulses, like the firmware
+        self.motor = 0.0                    # motor position in steps
+        self.carriage = 0.0                 # position seen by the DRO, lags by the backlash
+        self.encoder = 0                    # last reported DRO count
+        self.stopped = False                # a move has finished, is_move of the firmware is 0
+        self.protocol = 0                   # 0 ASCII, else the binary version of the "P" handshake
+        self.seq = 0
+        self.batch = np.empty(0, dtype=FRAME_DTYPE)  # binary samples waiting for a full frame
+        self.frames = 0
+        self.bytes_sent = 0
+        self.send_start = None
+
+    def close(self):
+        self.running = False
+        self.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def run(self):
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.05)
+            if not readable:
+                continue
+            self.command += os.read(self.master, 1024)
+            while b"#" in self.command:     # moves are executed one after the other, like loop()
+                command, self.command = self.command.split(b"#", 1)
+                if command[:1] == b"L" and len(command) >= 8:
+                    self.move(command)
+                elif command[:1] == b"P" and len(command) >= 8:
+                    self.handshake(command)
+
+    # Step period of the firmware move() loop, in seconds
+    def step_period(self, speed):
+        if self.frame_rate:
+            return max(self.counts_per_step, 1.0) / self.frame_rate
+        return (self.pulse_high_time + self.pulse_low_time + speed) * 1e-6 / self.time_scale
+
+    def move(self, command):
+        try:
+            speed = int(command[2:4])
+            target = int(command[4:8])
+        except ValueError:
+            return
+        direction = -1 if command[1:2] == b"-" else 1
+
+        if self.stopped:                    # doEncoder still reports RF, is_move is only set after delay(500)
+            self.send_jitter()
+        time.sleep(self.start_delay / self.time_scale)
+        start = self.encoder
+        period = self.step_period(speed)
+        limit = int(target / max(self.counts_per_step, 1e-9)) * 10 + 1000   # stalled scale, stop anyway
+        steps, t0, done = 0, time.monotonic(), False
+
+        while self.running and steps < limit:
+            due = int((time.monotonic() - t0) / period) - steps
+            if due <= 0:
+                time.sleep(min(period, 0.001))
+                continue
+            due = min(due, limit - steps, 4096)
+            frames, done = self.step(direction, due, start, target, t0 + steps * period, period)
+            steps += due
+            self.send(frames)
+            if done:
+                break
+        if not done:
+            self.send(self.frame(STATUS_FINISH))
+        self.stopped = True
+        self.send_jitter()                  # overshoot and coasting
+
+    def send_jitter(self):                  # jitter pairs of encoder edges, each an RF frame as is_move is 0
+        for i in range(2 * self.jitter):
+            self.encoder += 1 if i % 2 == 0 else -1
+            self.send(self.frame(STATUS_FINISH))
+
+    # Advance the motor by n steps, the first at t (monotonic s), return the frames of the encoder edges
+    def step(self, direction, n, start, target, t, period):
+        motor = self.motor + direction * np.arange(1, n + 1)
+        if direction > 0:                   # play operator: the carriage follows once the backlash is taken up
+            carriage = np.maximum(self.carriage, motor - self.backlash)
+        else:
+            carriage = np.minimum(self.carriage, motor)
+        counts = carriage * self.counts_per_step
+        if self.noise:
+            counts = counts + self.rng.normal(0, self.noise, n)
+        counts = np.rint(counts).astype(np.int64)
+
+        edges = np.flatnonzero(np.diff(np.r_[self.encoder, counts]))
+        finished = np.flatnonzero(np.abs(counts[edges] - start) >= target)
+        if len(finished):                   # the ISR stops the motor on the edge reaching the target
+            n = edges[finished[0]] + 1
+            edges = edges[:finished[0] + 1]
+
+        frames = np.empty(len(edges), dtype=FRAME_DTYPE)
+        frames["status"] = STATUS_MOVING
+        frames["pulse"] = self.pulse + direction * (edges + 1)
+        frames["dro"] = counts[edges]
+        frames["device"] = self.counter(t + (edges + 1) * period)
+        if len(finished):
+            frames["status"][-1] = STATUS_FINISH
+
+        self.pulse += direction * n
+        self.motor = motor[n - 1]
+        self.carriage = carriage[n - 1]
+        self.encoder = int(counts[n - 1])
+        return self.encode(frames), bool(len(finished))
+
+    def counter(self, t):                   # micros() at monotonic time t
+        us = (np.asarray(t) - self.boot) * 1e6 * (1 + self.clock_drift * 1e-6) + self.counter_start
+        return us.astype(np.int64) & 0xFFFFFFFF
+
+    def frame(self, status):
+        return self.encode(np.array([(status, self.pulse, self.encoder, self.counter(time.monotonic()))], dtype=FRAME_DTYPE))
+
+    def encode(self, frames):               # Serialise in the negotiated protocol
+        self.frames += len(frames)
+        if self.protocol == 0:
+            names = np.where(frames["status"] == STATUS_FINISH, "RF", "RR")
+            if self.micros:
+                return "".join("%s%d;%d;%d!" % f for f in zip(names.tolist(), frames["pulse"].tolist(), frames["dro"].tolist(),
+                                                              frames["device"].tolist())).encode()
+            return "".join("%s%d;%d!" % f for f in zip(names.tolist(), frames["pulse"].tolist(), frames["dro"].tolist())).encode()
+        # held until BATCH_SIZE samples are in, across steps, the last frame is sent short when the move
+        # finishes (add_record() of the firmware)
+        frames = np.concatenate((self.batch, frames))
+        end = len(frames) if len(frames) and frames["status"][-1] == STATUS_FINISH else len(frames) - len(frames) % BATCH_SIZE
+        self.batch = frames[end:]
+        return b"".join(self.next_frame(frames[i:min(i + BATCH_SIZE, end)]) for i in range(0, end, BATCH_SIZE))
+
+    def next_frame(self, frames):
+        self.seq += 1
+        return encode_binary_frame(self.seq - 1, frames, self.protocol)
+
+    def handshake(self, command):           # "P<version><baud>", same checks as the firmware
+        try:
+            version, baudrate = int(command[1:2]), int(command[2:8])
+        except ValueError:
+            return
+        if version not in BINARY_RECORDS or baudrate <= 0:
+            return
+        self.send(("RB%d;%d!" % (version, baudrate)).encode())
+        if self.baudrate:
+            self.baudrate = baudrate
+        self.protocol = version
+        self.batch = self.batch[:0]
+
+    def send(self, data):                   # Write to the pty, throttled to the emulated baud rate
+        if not data:
+            return
+        if self.send_start is None:
+            self.send_start = time.monotonic()
+        if self.baudrate:
+            ready = self.send_start + (self.bytes_sent + len(data)) * 10 / self.baudrate
+            wait = ready - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                self.send_start -= wait     # idle time does not count as credit
+        view = memoryview(data)
+        while view:
+            written = os.write(self.master, view)
+            view = view[written:]
+        self.bytes_sent += len(data)
+
+
+# Drive the device through the host parser and report throughput and latency
+def measure(device, moves=10, distance=500, baudrate=9600, binary=False):
+    import serial
+    from frame_parser import FrameParser, BinaryFrameParser, handshake_command, parse_handshake
+
+    ser = serial.Serial(device.port, baudrate, timeout=0.05)
+    parser = FrameParser()
+    if binary:
+        ser.write(handshake_command(baudrate).encode())
+        reply = b""
+        while b"!" not in reply:
+            reply += ser.read(1)
+        if parse_handshake(reply):
+            parser = BinaryFrameParser()
+    latencies, frames, received = [], 0, 0
+    begin = time.monotonic()
+    for i in range(moves):
+        sign = "+" if i % 2 == 0 else "-"
+        sent = time.monotonic()
+        ser.write(("L%s00%04d#" % (sign, distance)).encode())
+        first, done = None, False
+        while not done:
+            chunk = ser.read(ser.in_waiting or 1)
+            if not chunk:
+                continue
+            received += len(chunk)
+            batch = parser.feed(chunk)
+            if len(batch):
+                if first is None:
+                    first = time.monotonic()
+                    latencies.append(first - sent - device.start_delay / device.time_scale)
+                frames += len(batch)
+                done = bool((batch["status"] == STATUS_FINISH).any())
+    elapsed = time.monotonic() - begin
+    ser.close()
+    return {"moves": moves, "frames": frames, "malformed": parser.malformed, "seconds": round(elapsed, 3),
+            "frames_per_second": round(frames / elapsed, 1), "bytes_per_second": round(received / elapsed, 1),
+            "bytes_per_sample": round(received / max(frames, 1), 2),
+            "first_frame_latency_ms": round(1000 * float(np.median(latencies)), 3),
+            "protocol": "binary" if binary else "ascii"}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Emulate Router_DRO_encoder_v1 on a pseudo-terminal")
+    parser.add_argument("--baud", type=int, default=9600, help="emulated baud rate, 0 for unlimited")
+    parser.add_argument("--frame-rate", type=float, default=None, help="frames per second, overrides step timing")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="speed-up of the step timing")
+    parser.add_argument("--resolution", type=float, default=1.0, help="DRO counts per motor step")
+    parser.add_argument("--backlash", type=float, default=0, help="backlash in motor steps")
+    parser.add_argument("--noise", type=float, default=0.0, help="DRO noise in counts")
+    parser.add_argument("--start-delay", type=float, default=0.5, help="delay before each move, in s")
+    parser.add_argument("--measure", type=int, default=0, metavar="MOVES", help="run a load test and exit")
+    parser.add_argument("--binary", action="store_true", help="negotiate the binary protocol for the load test")
+    parser.add_argument("--micros", action="store_true", help="ASCII frames carry the us counter")
+    parser.add_argument("--clock-drift", type=float, default=0.0, help="ppm the us counter runs fast")
+    parser.add_argument("--jitter", type=int, default=0, help="pairs of DRO edges sent as RF after every move")
+    parser.add_argument("--distance", type=int, default=500, help="stroke of the load test moves, in 0.01 mm")
+    args = parser.parse_args()
+
+    device = VirtualDevice(args.baud, start_delay=args.start_delay, counts_per_step=args.resolution,
+                           backlash=args.backlash, noise=args.noise, frame_rate=args.frame_rate,
+                           time_scale=args.time_scale, micros=args.micros, clock_drift=args.clock_drift,
+                           jitter=args.jitter)
+    device.start()
+
+    if args.measure:
+        print(measure(device, args.measure, args.distance, args.baud or 115200, args.binary))
+        device.close()
+        sys.exit(0)
+
+    print("Virtual controller on", device.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        device.close()